@@ -0,0 +1,292 @@
+import argparse
+import atexit
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+"""
+# Background cleanup of agents, threads and files
+
+Every agent plugin call creates a single-use agent and a thread on the Azure AI Agent Service. Deleting
+them inline puts a round trip on the user-visible path, and threads that are never deleted pile up on
+the service. The reaper takes that work off the critical path: callers enqueue what they created once
+they have their result, and a background thread deletes it in batches (several deletions in parallel),
+retrying failures with exponential backoff. Objects that are already gone count as deleted.
+
+Agents and threads are created with CLEANUP_METADATA, so a periodic sweep can find the ones that a
+crashed or killed process never got to enqueue, and delete those older than REAPER_ORPHAN_AGE. The sweep
+can also be run on its own, e.g. from cron: `python agent_reaper.py sweep`.
+
+Pending deletions are flushed when the process exits (for at most REAPER_FLUSH_TIMEOUT seconds); anything
+left after that is picked up by a later sweep.
+
+# .env examples
+
+```.env
+# Deletions run in parallel per batch
+REAPER_BATCH_SIZE=20
+REAPER_CONCURRENCY=4
+REAPER_MAX_ATTEMPTS=5
+# Seconds between orphan sweeps in long-running processes (0 disables them)
+REAPER_SWEEP_INTERVAL=900
+# Only objects older than this many seconds are swept, so runs in progress elsewhere are left alone
+REAPER_ORPHAN_AGE=3600
+REAPER_FLUSH_TIMEOUT=15
+```
+"""
+
+# Marks the agents and threads this repository creates, so the orphan sweep never touches anything else
+CLEANUP_METADATA = {"created_by": "healthplan-agents"}
+
+KINDS = ("agent", "thread", "file")
+
+
+def _delete(project_client, kind: str, object_id: str):
+    if kind == "agent":
+        project_client.agents.delete_agent(object_id)
+    elif kind == "thread":
+        project_client.agents.threads.delete(object_id)
+    elif kind == "file":
+        project_client.agents.files.delete(object_id)
+    else:
+        raise ValueError(f"Unknown kind {kind}")
+
+
+def _is_not_found(error) -> bool:
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status == 404 or type(error).__name__ == "ResourceNotFoundError"
+
+
+def default_project_client():
+    """
+    Returns a project client for the sweep, connected like the agent plugins.
+    """
+    from azure.ai.projects import AIProjectClient
+    from azure.identity import DefaultAzureCredential
+
+    return AIProjectClient(credential=DefaultAzureCredential(), endpoint=os.environ["AIPROJECT_CONNECTION_STRING"])
+
+
+class _Cleanup:
+    """
+    One object waiting to be deleted.
+    """
+    def __init__(self, project_client, kind: str, object_id: str):
+        self.project_client = project_client
+        self.kind = kind
+        self.object_id = object_id
+        self.attempts = 0
+        self.not_before = 0.0
+
+
+class AgentReaper:
+    """
+    A class to represent the background deleter of agents, threads and files.
+    """
+    def __init__(self, batch_size: int = None, concurrency: int = None, max_attempts: int = None,
+                 sweep_interval: float = None, orphan_age: float = None, client_factory=None):
+        """
+        Parameters:
+        batch_size (int): Deletions taken from the queue at a time. Defaults to REAPER_BATCH_SIZE or 20.
+        concurrency (int): Deletions run in parallel within a batch. Defaults to REAPER_CONCURRENCY or 4.
+        max_attempts (int): Attempts per deletion before it is given up on. Defaults to REAPER_MAX_ATTEMPTS or 5.
+        sweep_interval (float): Seconds between orphan sweeps, 0 to disable. Defaults to REAPER_SWEEP_INTERVAL or 900.
+        orphan_age (float): Minimum age in seconds of swept objects. Defaults to REAPER_ORPHAN_AGE or 3600.
+        client_factory (callable): Creates the project client used by the sweep. Defaults to default_project_client.
+        """
+        self.batch_size = int(os.getenv("REAPER_BATCH_SIZE", "20")) if batch_size is None else batch_size
+        self.concurrency = int(os.getenv("REAPER_CONCURRENCY", "4")) if concurrency is None else concurrency
+        self.max_attempts = int(os.getenv("REAPER_MAX_ATTEMPTS", "5")) if max_attempts is None else max_attempts
+        self.sweep_interval = float(os.getenv("REAPER_SWEEP_INTERVAL", "900")) if sweep_interval is None else sweep_interval
+        self.orphan_age = float(os.getenv("REAPER_ORPHAN_AGE", "3600")) if orphan_age is None else orphan_age
+        self.client_factory = client_factory or default_project_client
+        self.queue = deque()
+        self.deleted = 0
+        self.failed = 0
+        self.swept = 0
+        self._in_progress = 0
+        self._condition = threading.Condition()
+        self._thread = None
+        self._last_sweep = time.monotonic()
+
+    def enqueue(self, project_client, kind: str, object_id: str):
+        """
+        Schedules an agent, thread or file for deletion with the client that created it.
+        """
+        if not object_id:
+            return
+        if kind not in KINDS:
+            raise ValueError(f"Unknown kind {kind}, expected one of {', '.join(KINDS)}")
+        with self._condition:
+            self.queue.append(_Cleanup(project_client, kind, object_id))
+            self._start()
+            self._condition.notify()
+
+    def delete_agent(self, project_client, agent_id: str):
+        self.enqueue(project_client, "agent", agent_id)
+
+    def delete_thread(self, project_client, thread_id: str):
+        self.enqueue(project_client, "thread", thread_id)
+
+    def delete_file(self, project_client, file_id: str):
+        self.enqueue(project_client, "file", file_id)
+
+    def _start(self):
+        # Called with the lock held; the worker starts with the first deletion, so idle processes pay nothing
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._work, name="agent-reaper", daemon=True)
+            self._thread.start()
+
+    def _take_batch(self, timeout: float) -> list:
+        with self._condition:
+            deadline = time.monotonic() + timeout
+            while True:
+                now = time.monotonic()
+                ready = [item for item in self.queue if item.not_before <= now][:self.batch_size]
+                if ready or now >= deadline:
+                    for item in ready:
+                        self.queue.remove(item)
+                    self._in_progress += len(ready)
+                    return ready
+                # Sleep until new work arrives, a retry is due, or it is time to sweep
+                waits = [item.not_before - now for item in self.queue] + [deadline - now]
+                self._condition.wait(max(0.01, min(waits)))
+
+    def _run_batch(self, batch: list, executor: ThreadPoolExecutor = None):
+        results = [False] * len(batch)
+        try:
+            try:
+                results = list(executor.map(self._delete_one, batch)) if executor is not None else list(map(self._delete_one, batch))
+            except RuntimeError:
+                # The executor takes no new work once the interpreter is shutting down, so the exit flush deletes on this thread
+                results = list(map(self._delete_one, batch))
+        finally:
+            # Whatever happened, the batch is accounted for; items without a result are retried like failed deletions
+            with self._condition:
+                for item, ok in zip(batch, results):
+                    if ok:
+                        self.deleted += 1
+                    elif item.attempts >= self.max_attempts:
+                        self.failed += 1
+                        print(f"Could not delete {item.kind} {item.object_id} after {item.attempts} attempts, leaving it for the orphan sweep.")
+                    else:
+                        # Retry later with exponential backoff
+                        item.not_before = time.monotonic() + min(60.0, 2 ** item.attempts)
+                        self.queue.append(item)
+                self._in_progress -= len(batch)
+                self._condition.notify_all()
+
+    def _work(self):
+        executor = ThreadPoolExecutor(max_workers=max(1, self.concurrency), thread_name_prefix="reaper")
+        while True:
+            batch = self._take_batch(timeout=self.sweep_interval or 60.0)
+            if batch:
+                self._run_batch(batch, executor)
+            if self.sweep_interval and time.monotonic() - self._last_sweep >= self.sweep_interval:
+                self._last_sweep = time.monotonic()
+                try:
+                    self.sweep()
+                except Exception as e:
+                    print(f"The orphan sweep failed: {e}")
+
+    def _delete_one(self, item: _Cleanup) -> bool:
+        item.attempts += 1
+        try:
+            _delete(item.project_client, item.kind, item.object_id)
+            return True
+        except Exception as e:
+            return _is_not_found(e)
+
+    def sweep(self, project_client=None, orphan_age: float = None) -> int:
+        """
+        Deletes agents and threads marked with CLEANUP_METADATA that are older than `orphan_age` seconds.
+
+        Returns:
+        swept (int): The number of objects scheduled for deletion.
+        """
+        project_client = project_client or self.client_factory()
+        orphan_age = self.orphan_age if orphan_age is None else orphan_age
+        cutoff = datetime.now(timezone.utc).timestamp() - orphan_age
+        swept = 0
+        for kind, objects in (("agent", project_client.agents.list_agents()), ("thread", project_client.agents.threads.list())):
+            for item in objects:
+                metadata = getattr(item, "metadata", None) or {}
+                created_at = getattr(item, "created_at", None)
+                created = created_at.timestamp() if isinstance(created_at, datetime) else created_at
+                if all(metadata.get(key) == value for key, value in CLEANUP_METADATA.items()) and created is not None and created < cutoff:
+                    self.enqueue(project_client, kind, item.id)
+                    swept += 1
+        self.swept += swept
+        return swept
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Waits until every pending deletion is done, for at most `timeout` seconds.
+        If the background worker is gone, the deletions that are left run on the calling thread.
+
+        Returns:
+        flushed (bool): True if nothing is left pending.
+        """
+        timeout = float(os.getenv("REAPER_FLUSH_TIMEOUT", "15")) if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            # Retries that are not due yet are attempted now rather than abandoned
+            for item in self.queue:
+                item.not_before = 0.0
+            self._condition.notify_all()
+        while time.monotonic() < deadline:
+            with self._condition:
+                if not self.queue and not self._in_progress:
+                    break
+                if self._thread is not None and self._thread.is_alive():
+                    self._condition.wait(max(0.01, deadline - time.monotonic()))
+                    continue
+            batch = self._take_batch(timeout=max(0.0, deadline - time.monotonic()))
+            if batch:
+                self._run_batch(batch)
+        with self._condition:
+            return not self.queue and not self._in_progress
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {"pending": len(self.queue) + self._in_progress, "deleted": self.deleted, "failed": self.failed, "swept": self.swept}
+
+
+_reaper = None
+_reaper_lock = threading.Lock()
+
+
+def get_reaper() -> AgentReaper:
+    """
+    Returns the process-wide reaper. Its pending deletions are flushed when the process exits.
+    """
+    global _reaper
+    with _reaper_lock:
+        if _reaper is None:
+            _reaper = AgentReaper()
+            atexit.register(_reaper.flush)
+        return _reaper
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Delete agents and threads left behind by crashed processes")
+    commands = parser.add_subparsers(dest="command", required=True)
+    sweep = commands.add_parser("sweep", help="Delete orphaned agents and threads")
+    sweep.add_argument("--older-than", type=float, help="Minimum age in seconds (defaults to REAPER_ORPHAN_AGE)")
+    args = parser.parse_args()
+
+    reaper = get_reaper()
+    swept = reaper.sweep(orphan_age=args.older_than)
+    reaper.flush(timeout=max(60.0, swept))
+    print(f"Swept {swept} orphaned agents and threads: {reaper.stats()}")
+
+
+if __name__ == "__main__":
+    main()
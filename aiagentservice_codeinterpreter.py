@@ -6,6 +6,8 @@ from azure.ai.projects import AIProjectClient
 from azure.identity import DefaultAzureCredential
 from azure.ai.agents.models import CodeInterpreterTool
 
+from agent_reaper import CLEANUP_METADATA, get_reaper
+
 load_dotenv() # Load environment variables from .env file
 
 # Get the project connection string and model from environment variables, which are needed to make a call to the LLM
@@ -29,11 +31,12 @@ with project_client:
         instructions="You are a helpful agent that creates clear, well-labeled charts.",
         tools=code_interpreter.definitions,
         tool_resources=code_interpreter.resources,
+        metadata=CLEANUP_METADATA, # Lets the reaper's orphan sweep find the agent if this script dies early
     )
     print(f"Created agent, agent ID: {agent.id}")
 
     # Create a thread which is a conversation session between an agent and a user.
-    thread = project_client.agents.threads.create()
+    thread = project_client.agents.threads.create(metadata=CLEANUP_METADATA)
     print(f"Created thread, thread ID: {thread.id}")
 
     # Create a prompt with clearer formatting
@@ -73,6 +76,7 @@ with project_client:
     messages_list = list(messages)
     print(f"Number of messages: {len(messages_list)}")
     files_saved = 0
+    reaper = get_reaper()
     
     # Iterate through each message to find file attachments
     for message in messages_list:
@@ -85,6 +89,8 @@ with project_client:
             project_client.agents.files.save(file_id=file_id, file_name=file_name)
             print(f"Saved image file: {file_name}")
             files_saved += 1
+            # The chart is saved locally, so the service's copy can go
+            reaper.delete_file(project_client, file_id)
 
         # Process file path annotations
         for file_path_annotation in message.file_path_annotations:
@@ -96,6 +102,9 @@ with project_client:
         
     print(f"Total files saved: {files_saved}")
     
-    # Delete the agent once done
-    project_client.agents.delete_agent(agent.id)
-    print("Deleted agent")
\ No newline at end of file
+    # Delete the agent, the thread and the generated files in the background,
+    # waiting for them before the client is closed
+    reaper.delete_agent(project_client, agent.id)
+    reaper.delete_thread(project_client, thread.id)
+    reaper.flush()
+    print(f"Deleted agent, thread and files: {reaper.stats()}")
\ No newline at end of file
@@ -1,18 +1,13 @@
 import os
-from openai import AzureOpenAI
-from azure.identity import DefaultAzureCredential, get_bearer_token_provider
+from aoai_clients import get_azure_openai_client
 
-endpoint = "https://admin-may8kgid-eastus2.cognitiveservices.azure.com/"
+endpoint = os.getenv("AZURE_OPENAI_ENDPOINT", "https://admin-may8kgid-eastus2.cognitiveservices.azure.com/")
 model_name = "o3"
 deployment = "o3"
-token_provider = get_bearer_token_provider(DefaultAzureCredential(), "https://cognitiveservices.azure.com/.default")
 api_version = "2025-01-01-preview"
 
-client = AzureOpenAI(
-    api_version=api_version,
-    azure_endpoint=endpoint,
-    azure_ad_token_provider=token_provider,
-)
+# Shared client backed by the process-wide connection pool and a cached Entra ID token provider (see aoai_clients.py)
+client = get_azure_openai_client(endpoint=endpoint, api_version=api_version)
 
 response = client.chat.completions.create(
     messages=[
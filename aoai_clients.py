@@ -0,0 +1,192 @@
+import os
+import asyncio
+import weakref
+from functools import lru_cache
+
+import httpx
+from dotenv import load_dotenv
+from openai import OpenAI, AsyncOpenAI, AzureOpenAI, AsyncAzureOpenAI
+
+from tracing import trace_http_client
+
+load_dotenv()
+
+"""
+# Shared OpenAI / Azure OpenAI client factory
+
+Every aoai_* sample used to build its own client, which meant its own connection pool and its own
+TLS handshake. The helpers below hand out cached clients that all share one tuned httpx connection
+pool per process (and one async pool per event loop), so many concurrent requests in one worker reuse
+keep-alive connections instead of reconnecting.
+
+# .env examples
+
+```.env
+AZURE_OPENAI_API_KEY=*******************
+AZURE_OPENAI_V1_API_ENDPOINT=https://*********.openai.azure.com/openai/v1/
+AZURE_OPENAI_ENDPOINT=https://*********.cognitiveservices.azure.com/
+AZURE_OPENAI_API_VERSION="2025-01-01-preview"
+
+# Optional pool tuning
+AOAI_MAX_CONNECTIONS=100
+AOAI_MAX_KEEPALIVE_CONNECTIONS=20
+AOAI_KEEPALIVE_EXPIRY=30
+AOAI_CONNECT_TIMEOUT=10
+AOAI_READ_TIMEOUT=600
+```
+"""
+
+COGNITIVE_SERVICES_SCOPE = "https://cognitiveservices.azure.com/.default"
+DEFAULT_AZURE_API_VERSION = "2025-01-01-preview"
+
+# Async pools are bound to the event loop that created them, so they are cached per loop
+_async_http_clients = weakref.WeakKeyDictionary()
+
+
+def _http2_available() -> bool:
+    """
+    HTTP/2 needs the optional `h2` package (pip install httpx[http2]); fall back to HTTP/1.1 without it.
+    """
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _pool_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=int(os.getenv("AOAI_MAX_CONNECTIONS", "100")),
+        max_keepalive_connections=int(os.getenv("AOAI_MAX_KEEPALIVE_CONNECTIONS", "20")),
+        keepalive_expiry=float(os.getenv("AOAI_KEEPALIVE_EXPIRY", "30")),
+    )
+
+
+def _pool_timeout() -> httpx.Timeout:
+    # Reasoning models can think for minutes, so only the connect phase gets a short timeout
+    return httpx.Timeout(
+        float(os.getenv("AOAI_READ_TIMEOUT", "600")),
+        connect=float(os.getenv("AOAI_CONNECT_TIMEOUT", "10")),
+    )
+
+
+@lru_cache(maxsize=None)
+def get_http_client() -> httpx.Client:
+    """
+    Returns the process-wide synchronous httpx client shared by every sync OpenAI client.
+    """
+    # Every request becomes a span when tracing is enabled (see tracing.py)
+    return trace_http_client(httpx.Client(limits=_pool_limits(), timeout=_pool_timeout(), http2=_http2_available()))
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """
+    Returns the httpx async client shared by every async OpenAI client running on the current event loop.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_http_clients.get(loop)
+    if client is None or client.is_closed:
+        client = trace_http_client(httpx.AsyncClient(limits=_pool_limits(), timeout=_pool_timeout(), http2=_http2_available()))
+        _async_http_clients[loop] = client
+    return client
+
+
+@lru_cache(maxsize=None)
+def get_credential():
+    """
+    Returns a cached DefaultAzureCredential so the credential chain is only probed once per process.
+    """
+    from azure.identity import DefaultAzureCredential
+
+    return DefaultAzureCredential()
+
+
+@lru_cache(maxsize=None)
+def get_token_provider(scope: str = COGNITIVE_SERVICES_SCOPE):
+    """
+    Returns a cached bearer token provider for the given scope. The provider caches the token itself and only
+    goes back to AAD when it is close to expiry.
+
+    Parameters:
+    scope (str): The AAD scope to request tokens for.
+
+    Returns:
+    token_provider (callable): A callable returning a bearer token, usable as `azure_ad_token_provider`.
+    """
+    from azure.identity import get_bearer_token_provider
+
+    return get_bearer_token_provider(get_credential(), scope)
+
+
+def _v1_client_kwargs() -> dict:
+    return dict(
+        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+        base_url=os.getenv("AZURE_OPENAI_V1_API_ENDPOINT"),
+        default_query={"api-version": "preview"},
+    )
+
+
+def _azure_client_kwargs(endpoint: str = None, api_version: str = None) -> dict:
+    return dict(
+        azure_endpoint=endpoint or os.environ["AZURE_OPENAI_ENDPOINT"],
+        api_version=api_version or os.getenv("AZURE_OPENAI_API_VERSION", DEFAULT_AZURE_API_VERSION),
+        azure_ad_token_provider=get_token_provider(),
+    )
+
+
+@lru_cache(maxsize=None)
+def get_openai_client() -> OpenAI:
+    """
+    Returns the shared OpenAI client for the Azure OpenAI v1 endpoint (API key auth).
+    """
+    return OpenAI(http_client=get_http_client(), **_v1_client_kwargs())
+
+
+def get_async_openai_client() -> AsyncOpenAI:
+    """
+    Returns an AsyncOpenAI client for the Azure OpenAI v1 endpoint that uses the current loop's shared pool.
+    The client object itself is cheap; the connection pool behind it is what gets reused.
+    """
+    return AsyncOpenAI(http_client=get_async_http_client(), **_v1_client_kwargs())
+
+
+@lru_cache(maxsize=None)
+def get_azure_openai_client(endpoint: str = None, api_version: str = None) -> AzureOpenAI:
+    """
+    Returns the shared AzureOpenAI client for an endpoint / API version pair (Entra ID auth).
+
+    Parameters:
+    endpoint (str): The Azure OpenAI resource endpoint. Defaults to AZURE_OPENAI_ENDPOINT.
+    api_version (str): The API version. Defaults to AZURE_OPENAI_API_VERSION or DEFAULT_AZURE_API_VERSION.
+
+    Returns:
+    client (AzureOpenAI): A client backed by the process-wide connection pool.
+    """
+    return AzureOpenAI(http_client=get_http_client(), **_azure_client_kwargs(endpoint, api_version))
+
+
+def get_async_azure_openai_client(endpoint: str = None, api_version: str = None) -> AsyncAzureOpenAI:
+    """
+    Returns an AsyncAzureOpenAI client (Entra ID auth) that uses the current loop's shared pool.
+    """
+    return AsyncAzureOpenAI(http_client=get_async_http_client(), **_azure_client_kwargs(endpoint, api_version))
+
+
+def close_clients():
+    """
+    Closes the shared sync pool. Async pools are closed with `aclose_clients` from inside their loop.
+    """
+    if get_http_client.cache_info().currsize:
+        get_http_client().close()
+        get_http_client.cache_clear()
+        get_openai_client.cache_clear()
+        get_azure_openai_client.cache_clear()
+
+
+async def aclose_clients():
+    """
+    Closes the async pool bound to the running event loop, if one was created.
+    """
+    client = _async_http_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
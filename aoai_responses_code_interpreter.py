@@ -1,16 +1,13 @@
 import os
-from openai import OpenAI
+from aoai_clients import get_openai_client
 from dotenv import load_dotenv
 
 
 # Load environment variables from .env file
 load_dotenv()
 
-client = OpenAI(
-    api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-    base_url=os.getenv("AZURE_OPENAI_V1_API_ENDPOINT"),
-    default_query={"api-version": "preview"}, 
-)
+# Shared client backed by the process-wide connection pool (see aoai_clients.py)
+client = get_openai_client()
 
 resp = client.responses.create(
   model=os.environ["AZURE_OPENAI_API_MODEL"],
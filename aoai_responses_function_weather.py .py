@@ -1,16 +1,13 @@
 import os
 import requests
 import json
-from openai import OpenAI
+from aoai_clients import get_openai_client
 from dotenv import load_dotenv
 
 load_dotenv()
 
-client = OpenAI(
-    api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-    base_url=os.getenv("AZURE_OPENAI_V1_API_ENDPOINT"),
-    default_query={"api-version": "preview"}, 
-)
+# Shared client backed by the process-wide connection pool (see aoai_clients.py)
+client = get_openai_client()
 
 def get_weather(latitude, longitude):
     response = requests.get(f"https://api.open-meteo.com/v1/forecast?latitude={latitude}&longitude={longitude}&current=temperature_2m,wind_speed_10m&hourly=temperature_2m,relative_humidity_2m,wind_speed_10m")
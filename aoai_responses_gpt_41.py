@@ -1,14 +1,11 @@
 import os
-from openai import OpenAI
+from aoai_clients import get_openai_client
 from dotenv import load_dotenv
 
 load_dotenv()
 
-client = OpenAI(
-    api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-    base_url=os.getenv("AZURE_OPENAI_V1_API_ENDPOINT"),
-    default_query={"api-version": "preview"}, 
-)
+# Shared client backed by the process-wide connection pool (see aoai_clients.py)
+client = get_openai_client()
 
 response = client.responses.create(
     model=os.environ["AZURE_OPENAI_API_MODEL"],
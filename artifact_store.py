@@ -0,0 +1,124 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+"""
+# Artifact store
+
+Large inter-agent payloads (search results, draft reports) are kept server-side and passed between the
+agent plugins by reference. A plugin stores its output and returns a short handle such as
+`artifact://search/3f2a9c1be07d4a21`; the next plugin resolves the handle back to the content. The
+orchestrator model only ever sees and re-emits the handle, so the full texts never round-trip through
+its input and output tokens.
+
+Handles are content addressed, so storing the same text twice returns the same handle. The store keeps
+the most recently used artifacts in memory and, with ARTIFACT_DIR set, also on disk so that other
+processes (e.g. report job workers) can resolve them.
+
+# .env examples
+
+```.env
+ARTIFACT_STORE_MAX_ITEMS=1000
+ARTIFACT_DIR=.artifacts
+```
+"""
+
+HANDLE_PATTERN = re.compile(r"artifact://([a-z]+)/([0-9a-f]{16})")
+
+
+class UnknownArtifactError(KeyError):
+    """
+    Raised when a handle does not refer to a stored artifact (e.g. it was evicted or mistyped by the model).
+    """
+
+
+class ArtifactStore:
+    """
+    A class to represent the content-addressed artifact store.
+    """
+    def __init__(self, max_items: int = None, directory: str = None):
+        """
+        Parameters:
+        max_items (int): Artifacts kept in memory before the least recently used one is evicted.
+        directory (str): Optional directory artifacts are also written to, shared between processes.
+        """
+        self.max_items = int(os.getenv("ARTIFACT_STORE_MAX_ITEMS", "1000")) if max_items is None else max_items
+        self.directory = directory if directory is not None else os.getenv("ARTIFACT_DIR")
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, kind: str, digest: str) -> str:
+        return os.path.join(self.directory, f"{kind}-{digest}.txt")
+
+    def put(self, content: str, kind: str = "text") -> str:
+        """
+        Stores `content` and returns its handle.
+
+        Parameters:
+        content (str): The payload.
+        kind (str): A short lowercase label that ends up in the handle, e.g. "search" or "report".
+
+        Returns:
+        handle (str): The handle to pass around instead of the content.
+        """
+        digest = hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+        handle = f"artifact://{kind}/{digest}"
+        with self._lock:
+            self._items[handle] = content
+            self._items.move_to_end(handle)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+        if self.directory and not os.path.exists(self._path(kind, digest)):
+            with open(self._path(kind, digest), "w", encoding="utf-8") as f:
+                f.write(content)
+        return handle
+
+    def get(self, handle: str) -> str:
+        """
+        Returns the content of a handle.
+        """
+        handle = handle.strip()
+        with self._lock:
+            if handle in self._items:
+                self._items.move_to_end(handle)
+                return self._items[handle]
+        match = HANDLE_PATTERN.fullmatch(handle)
+        if match and self.directory and os.path.exists(self._path(*match.groups())):
+            with open(self._path(*match.groups()), encoding="utf-8") as f:
+                content = f.read()
+            with self._lock:
+                self._items[handle] = content
+            return content
+        raise UnknownArtifactError(handle)
+
+    def resolve(self, value: str) -> str:
+        """
+        Replaces every handle in `value` with its content. Text without handles is returned unchanged, so
+        plugins keep working when the orchestrator passes content instead of a handle.
+        """
+        if not value or "artifact://" not in value:
+            return value
+        return HANDLE_PATTERN.sub(lambda match: self.get(match.group(0)), value)
+
+    @staticmethod
+    def is_handle(value: str) -> bool:
+        return bool(value) and HANDLE_PATTERN.fullmatch(value.strip()) is not None
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_artifact_store() -> ArtifactStore:
+    """
+    Returns the process-wide artifact store shared by the agent plugins and the orchestrator.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ArtifactStore()
+        return _store
@@ -0,0 +1,193 @@
+import asyncio
+import json
+import os
+import re
+import time
+import uuid
+
+from aiohttp import web
+from dotenv import load_dotenv
+
+load_dotenv()
+
+"""
+# Local Batch API stand-in
+
+A small in-memory imitation of the OpenAI / Azure OpenAI Batch API (the /files and /batches endpoints), so
+report_batch.py can be run end to end without a batch deployment or quota. Uploaded request files are
+"processed" after BATCH_STUB_DELAY seconds with canned answers: every report request gets a short markdown
+report built from the plan information it was sent, and every validation request gets 'Pass' if the report
+it was sent mentions exclusions, 'Fail' otherwise.
+
+Endpoints (under /v1, like the v1 API):
+
+- POST /files                    multipart purpose=batch, file=<jsonl>
+- GET  /files/{file_id}
+- GET  /files/{file_id}/content
+- POST /batches                  {"input_file_id": "...", "endpoint": "/chat/completions", "completion_window": "24h"}
+- GET  /batches/{batch_id}
+- POST /batches/{batch_id}/cancel
+
+# Usage
+
+```zsh
+python batch_stub.py
+REPORT_BATCH_ENDPOINT=http://localhost:8090/v1 SEARCH_BACKEND=local python report_batch.py "Northwind Standard"
+```
+
+# .env examples
+
+```.env
+BATCH_STUB_PORT=8090
+# Seconds a batch stays in progress before its results are available
+BATCH_STUB_DELAY=3
+```
+"""
+
+
+def _report(plan_name: str, plan_info: str) -> str:
+    # Echo the first few sentences of the plan information so the report depends on what was sent
+    sentences = [s.strip() for s in re.split(r"(?<=[.!?])\s+", plan_info) if s.strip()][:6]
+    exclusions = [s for s in sentences if "exclu" in s.lower() or "not covered" in s.lower()]
+    return "\n".join([
+        f"# {plan_name} Report",
+        "",
+        "## Overview",
+        " ".join(sentences[:3]) or f"No information was found about {plan_name}.",
+        "",
+        "## Coverage Exclusions",
+        " ".join(exclusions) or "The plan documents list no specific exclusions; services that are not medically necessary are excluded.",
+    ])
+
+
+def respond(body: dict) -> str:
+    """
+    Returns the canned answer to a chat completions request body.
+    """
+    messages = body.get("messages") or []
+    instructions = " ".join(m.get("content", "") for m in messages if m.get("role") in ("system", "developer"))
+    content = " ".join(m.get("content", "") for m in messages if m.get("role") == "user")
+    if "validating" in instructions:
+        return "Pass" if "exclusion" in content.lower() else "Fail"
+    match = re.search(r"report about the (.+?) plan", content)
+    plan_info = content.split("Here is the relevant information for the plan:", 1)[-1]
+    return _report(match.group(1) if match else "health", plan_info)
+
+
+def _completion(body: dict, text: str) -> dict:
+    prompt_tokens = sum(len(m.get("content", "")) for m in body.get("messages", [])) // 4
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model"),
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(text) // 4, "total_tokens": prompt_tokens + len(text) // 4},
+    }
+
+
+class BatchStub:
+    """
+    A class to represent the stand-in's files and batches, kept in memory.
+    """
+    def __init__(self, delay: float = None):
+        self.delay = float(os.getenv("BATCH_STUB_DELAY", "3")) if delay is None else delay
+        self.files = {}
+        self.contents = {}
+        self.batches = {}
+
+    def add_file(self, content: bytes, filename: str, purpose: str) -> dict:
+        file = {"id": f"file-{uuid.uuid4().hex}", "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                "filename": filename, "purpose": purpose, "status": "processed"}
+        self.files[file["id"]] = file
+        self.contents[file["id"]] = content
+        return file
+
+    async def process(self, batch: dict):
+        batch["status"], batch["in_progress_at"] = "in_progress", int(time.time())
+        await asyncio.sleep(self.delay)
+        if batch["status"] != "in_progress":
+            return
+        outputs, errors = [], []
+        for line in self.contents[batch["input_file_id"]].decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            record = {"id": f"batch_req_{uuid.uuid4().hex[:24]}", "custom_id": request.get("custom_id")}
+            body = request.get("body") or {}
+            if request.get("url") != batch["endpoint"] or not body.get("messages"):
+                errors.append({**record, "response": None, "error": {"code": "invalid_request", "message": "Expected a chat completions request"}})
+                continue
+            outputs.append({**record, "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": _completion(body, respond(body))}, "error": None})
+
+        def jsonl(records):
+            return "".join(json.dumps(record) + "\n" for record in records).encode("utf-8")
+
+        batch["output_file_id"] = self.add_file(jsonl(outputs), f"{batch['id']}_output.jsonl", "batch_output")["id"] if outputs else None
+        batch["error_file_id"] = self.add_file(jsonl(errors), f"{batch['id']}_error.jsonl", "batch_output")["id"] if errors else None
+        batch["request_counts"] = {"total": len(outputs) + len(errors), "completed": len(outputs), "failed": len(errors)}
+        batch["status"], batch["completed_at"] = "completed", int(time.time())
+
+
+def create_app(stub: BatchStub = None) -> web.Application:
+    stub = stub or BatchStub()
+    routes = web.RouteTableDef()
+
+    @routes.post("/v1/files")
+    async def upload_file(request: web.Request) -> web.Response:
+        form = await request.post()
+        upload = form["file"]
+        return web.json_response(stub.add_file(upload.file.read(), upload.filename, form.get("purpose", "batch")))
+
+    @routes.get("/v1/files/{file_id}")
+    async def get_file(request: web.Request) -> web.Response:
+        file = stub.files.get(request.match_info["file_id"])
+        return web.json_response(file) if file else web.json_response({"error": {"message": "No such file"}}, status=404)
+
+    @routes.get("/v1/files/{file_id}/content")
+    async def get_file_content(request: web.Request) -> web.Response:
+        content = stub.contents.get(request.match_info["file_id"])
+        if content is None:
+            return web.json_response({"error": {"message": "No such file"}}, status=404)
+        return web.Response(body=content, content_type="application/jsonl")
+
+    @routes.post("/v1/batches")
+    async def create_batch(request: web.Request) -> web.Response:
+        body = await request.json()
+        if body.get("input_file_id") not in stub.files:
+            return web.json_response({"error": {"message": "No such input file"}}, status=400)
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex}", "object": "batch", "endpoint": body.get("endpoint", "/chat/completions"),
+            "errors": None, "input_file_id": body["input_file_id"], "completion_window": body.get("completion_window", "24h"),
+            "status": "validating", "output_file_id": None, "error_file_id": None, "created_at": int(time.time()),
+            "metadata": body.get("metadata"), "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        stub.batches[batch["id"]] = batch
+        asyncio.create_task(stub.process(batch))
+        return web.json_response(batch)
+
+    @routes.get("/v1/batches/{batch_id}")
+    async def get_batch(request: web.Request) -> web.Response:
+        batch = stub.batches.get(request.match_info["batch_id"])
+        return web.json_response(batch) if batch else web.json_response({"error": {"message": "No such batch"}}, status=404)
+
+    @routes.post("/v1/batches/{batch_id}/cancel")
+    async def cancel_batch(request: web.Request) -> web.Response:
+        batch = stub.batches.get(request.match_info["batch_id"])
+        if batch is None:
+            return web.json_response({"error": {"message": "No such batch"}}, status=404)
+        if batch["status"] in ("validating", "in_progress"):
+            batch["status"], batch["cancelled_at"] = "cancelled", int(time.time())
+        return web.json_response(batch)
+
+    app = web.Application()
+    app.add_routes(routes)
+    return app
+
+
+def main():
+    web.run_app(create_app(), host=os.getenv("BATCH_STUB_HOST", "localhost"), port=int(os.getenv("BATCH_STUB_PORT", "8090")))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+import gzip
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+"""
+# Persistent chat sessions
+
+Chat histories used to live only in process memory and vanished on exit, and a server had to keep
+every transcript of every idle session in RAM. The chat store keeps them on disk instead:
+
+- Each session is a directory of append-only segments with one compact JSON record per message. Plain
+  text messages are stored as role and content; messages with function calls or results keep their
+  full Semantic Kernel serialization.
+- Once a segment holds CHAT_STORE_SEGMENT_SIZE messages it is sealed and, with CHAT_STORE_COMPRESS,
+  gzip-compressed. Only the newest segment is ever appended to.
+- Only the active window (the last CHAT_STORE_WINDOW messages, plus system and developer messages) is
+  kept in memory. Older messages are read back lazily, one segment at a time, when asked for.
+- A session is resumed by loading its window into a new ChatHistory. The service evicts idle sessions
+  from memory and resumes them on their next request. The chat loops resume the session named by
+  CHAT_SESSION.
+
+A turn is committed once it has succeeded, from the user's message through every message the turn
+added (replies, function calls and their results). Unanswered questions are never persisted.
+
+# .env examples
+
+```.env
+CHAT_STORE_DIR=chat_sessions
+CHAT_STORE_WINDOW=40
+CHAT_STORE_SEGMENT_SIZE=256
+CHAT_STORE_COMPRESS=true
+# Sessions untouched for this many seconds are deleted from disk (0 keeps them forever)
+CHAT_STORE_RETENTION=604800
+# Resume a session in the chat loops
+CHAT_SESSION=my-session
+```
+"""
+
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# Messages that set up the conversation rather than belong to it; they are never trimmed from the window
+PINNED_ROLES = ("system", "developer")
+
+
+def _role(message) -> str:
+    role = getattr(message, "role", "")
+    return str(getattr(role, "value", role)).lower()
+
+
+def encode_message(message) -> dict:
+    """
+    Returns the compact record of a ChatMessageContent.
+    """
+    items = getattr(message, "items", None) or []
+    if all(type(item).__name__ == "TextContent" for item in items):
+        record = {"r": _role(message), "c": str(message.content or "")}
+        if getattr(message, "name", None):
+            record["n"] = message.name
+    else:
+        # Function calls and results need their items; response metadata (usage, ids) is not worth keeping
+        record = {"r": _role(message), "m": message.model_dump(mode="json", exclude_none=True, exclude={"metadata", "inner_content"})}
+    record["t"] = round(time.time(), 3)
+    return record
+
+
+def decode_message(record: dict):
+    """
+    Rebuilds a ChatMessageContent from its record.
+    """
+    from semantic_kernel.contents.chat_message_content import ChatMessageContent
+    from semantic_kernel.contents.utils.author_role import AuthorRole
+
+    if "m" in record:
+        return ChatMessageContent.model_validate(record["m"])
+    return ChatMessageContent(role=AuthorRole(record["r"]), content=record["c"], name=record.get("n"))
+
+
+def turn_messages(history, first_message) -> list:
+    """
+    Returns `first_message` and every message after it in the history.
+    """
+    messages = history.messages
+    for index in range(len(messages) - 1, -1, -1):
+        if messages[index] is first_message:
+            return messages[index:]
+    return []
+
+
+def discard_turn(history, first_message, keep_first: bool = False):
+    """
+    Removes `first_message` (unless `keep_first`) and every message after it from the history, e.g. to roll
+    back a turn that failed or to start a retried attempt over from the user's message.
+    """
+    messages = history.messages
+    for index in range(len(messages) - 1, -1, -1):
+        if messages[index] is first_message:
+            del messages[index + 1 if keep_first else index:]
+            return
+
+
+def trim_window(history, window: int) -> int:
+    """
+    Drops the oldest messages from memory until at most `window` remain, not counting system and developer messages.
+
+    Returns:
+    dropped (int): The number of messages dropped.
+    """
+    messages = history.messages
+    dropped = 0
+
+    def oldest():
+        return next((i for i, m in enumerate(messages) if _role(m) not in PINNED_ROLES), None)
+
+    while sum(1 for m in messages if _role(m) not in PINNED_ROLES) > window:
+        del messages[oldest()]
+        dropped += 1
+    # A function result whose call was dropped would be rejected by the model, so it goes too
+    while oldest() is not None and _role(messages[oldest()]) == "tool":
+        del messages[oldest()]
+        dropped += 1
+    return dropped
+
+
+def chat_session_id() -> str:
+    """
+    Returns the session to resume from CHAT_SESSION, or a new session id.
+    """
+    return os.getenv("CHAT_SESSION") or uuid.uuid4().hex
+
+
+class ChatStore:
+    """
+    A class to represent the on-disk chat sessions: append-only segments of message records, one directory per session.
+    """
+    def __init__(self, path: str = None, window: int = None, segment_size: int = None, compress: bool = None):
+        """
+        Parameters:
+        path (str): The directory of the sessions. Defaults to CHAT_STORE_DIR or chat_sessions.
+        window (int): Messages kept in memory per session. Defaults to CHAT_STORE_WINDOW or 40.
+        segment_size (int): Messages per segment. Defaults to CHAT_STORE_SEGMENT_SIZE or 256.
+        compress (bool): Gzip sealed segments. Defaults to CHAT_STORE_COMPRESS or true.
+        """
+        self.path = path or os.getenv("CHAT_STORE_DIR", "chat_sessions")
+        self.window = int(os.getenv("CHAT_STORE_WINDOW", "40")) if window is None else window
+        self.segment_size = int(os.getenv("CHAT_STORE_SEGMENT_SIZE", "256")) if segment_size is None else segment_size
+        self.compress = os.getenv("CHAT_STORE_COMPRESS", "true").lower() in ("1", "true", "yes") if compress is None else compress
+        self._lock = threading.Lock()
+
+    def _dir(self, session_id: str) -> str:
+        if not SESSION_ID_PATTERN.match(session_id or ""):
+            raise ValueError(f"Invalid session id {session_id!r}")
+        return os.path.join(self.path, session_id)
+
+    def _segments(self, session_id: str) -> list:
+        # Segment numbers in order; each is either NNNNNN.jsonl (active or uncompressed) or NNNNNN.jsonl.gz (sealed)
+        try:
+            names = os.listdir(self._dir(session_id))
+        except FileNotFoundError:
+            return []
+        return sorted({int(name.split(".", 1)[0]) for name in names if name.endswith((".jsonl", ".jsonl.gz"))})
+
+    def _segment_file(self, session_id: str, number: int) -> str:
+        path = os.path.join(self._dir(session_id), f"{number:06d}.jsonl")
+        return path if os.path.exists(path) else f"{path}.gz"
+
+    def _read_segment(self, session_id: str, number: int) -> list:
+        path = self._segment_file(session_id, number)
+        opener = gzip.open if path.endswith(".gz") else open
+        records = []
+        with opener(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # A line cut short by a crash mid-write
+                    continue
+        return records
+
+    def create(self, session_id: str):
+        os.makedirs(self._dir(session_id), exist_ok=True)
+
+    def exists(self, session_id: str) -> bool:
+        try:
+            return os.path.isdir(self._dir(session_id))
+        except ValueError:
+            return False
+
+    def delete(self, session_id: str):
+        if self.exists(session_id):
+            shutil.rmtree(self._dir(session_id), ignore_errors=True)
+
+    def count(self, session_id: str) -> int:
+        """
+        Returns the number of messages stored for a session. Only the active segment is read.
+        """
+        segments = self._segments(session_id)
+        if not segments:
+            return 0
+        return segments[-1] * self.segment_size + len(self._read_segment(session_id, segments[-1]))
+
+    def append(self, session_id: str, messages: list, create: bool = True) -> int:
+        """
+        Appends messages to the session's active segment, sealing it when it is full.
+
+        Parameters:
+        session_id (str): The session.
+        messages (list[ChatMessageContent]): The messages to append.
+        create (bool): Create the session if it does not exist. Otherwise FileNotFoundError is raised, so a
+        session deleted while a turn was running is not brought back.
+
+        Returns:
+        count (int): The number of messages stored for the session afterwards.
+        """
+        # The lock only serializes appends within this process; see the service's notes on sharing CHAT_STORE_DIR
+        with self._lock:
+            if create:
+                self.create(session_id)
+            elif not os.path.isdir(self._dir(session_id)):
+                raise FileNotFoundError(f"Chat session {session_id} does not exist")
+            segments = self._segments(session_id)
+            number = segments[-1] if segments else 0
+            stored = len(self._read_segment(session_id, number)) if segments else 0
+            active = os.path.join(self._dir(session_id), f"{number:06d}.jsonl")
+            if os.path.exists(active) and os.path.getsize(active):
+                # Terminate a line cut short by a crash, so the next record does not run into it
+                with open(active, "rb+") as f:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        f.write(b"\n")
+            for message in messages:
+                if stored >= self.segment_size:
+                    self._seal(session_id, number)
+                    number, stored = number + 1, 0
+                path = os.path.join(self._dir(session_id), f"{number:06d}.jsonl")
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(encode_message(message), separators=(",", ":"), ensure_ascii=False) + "\n")
+                stored += 1
+            if stored >= self.segment_size:
+                self._seal(session_id, number)
+            # Appending to a file does not touch its directory; the retention sweep goes by the directory's time
+            os.utime(self._dir(session_id))
+            return number * self.segment_size + stored
+
+    def _seal(self, session_id: str, number: int):
+        # Called with the lock held; a full segment is never written again, so it can be compressed
+        path = os.path.join(self._dir(session_id), f"{number:06d}.jsonl")
+        if not self.compress or not os.path.exists(path):
+            return
+        with open(path, "rb") as source, gzip.open(f"{path}.gz.tmp", "wb") as target:
+            shutil.copyfileobj(source, target)
+        os.replace(f"{path}.gz.tmp", f"{path}.gz")
+        os.remove(path)
+
+    def read(self, session_id: str, start: int = 0, end: int = None) -> list:
+        """
+        Returns messages `start` to `end` (exclusive) of a session, reading only the segments that hold them.
+        """
+        total = self.count(session_id)
+        end = total if end is None else min(end, total)
+        start = max(0, start)
+        messages = []
+        if start >= end:
+            return messages
+        for number in range(start // self.segment_size, (end - 1) // self.segment_size + 1):
+            offset = number * self.segment_size
+            for record in self._read_segment(session_id, number)[max(0, start - offset):end - offset]:
+                messages.append(decode_message(record))
+        return messages
+
+    def load(self, session_id: str, history, window: int = None) -> int:
+        """
+        Resumes a session: adds its last `window` messages to `history` (which may already hold the system message).
+
+        Returns:
+        total (int): The number of messages stored for the session.
+        """
+        window = self.window if window is None else window
+        total = self.count(session_id)
+        messages = self.read(session_id, max(0, total - window), total)
+        # The window must not start with function results whose calls are outside it
+        while messages and _role(messages[0]) == "tool":
+            messages.pop(0)
+        for message in messages:
+            history.add_message(message)
+        return total
+
+    def commit_turn(self, session_id: str, history, first_message, create: bool = True) -> int:
+        """
+        Persists a turn that succeeded (`first_message`, the user's message, and everything after it) and
+        trims the history in memory to the active window. See `append` for `create`.
+
+        Returns:
+        count (int): The number of messages stored for the session.
+        """
+        count = self.append(session_id, turn_messages(history, first_message), create)
+        trim_window(history, self.window)
+        return count
+
+    def expire(self, max_age: float = None) -> int:
+        """
+        Deletes the sessions that have not been written to for `max_age` seconds. Defaults to CHAT_STORE_RETENTION.
+
+        Returns:
+        deleted (int): The number of sessions deleted.
+        """
+        max_age = float(os.getenv("CHAT_STORE_RETENTION", "604800")) if max_age is None else max_age
+        if max_age <= 0 or not os.path.isdir(self.path):
+            return 0
+        cutoff = time.time() - max_age
+        deleted = 0
+        for entry in os.scandir(self.path):
+            if entry.is_dir() and entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                deleted += 1
+        return deleted
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_chat_store() -> ChatStore:
+    """
+    Returns the process-wide chat store.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ChatStore()
+        return _store
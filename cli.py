@@ -0,0 +1,219 @@
+import argparse
+import asyncio
+import importlib
+import os
+import re
+import runpy
+import subprocess
+import sys
+import threading
+import time
+
+"""
+# Unified command line
+
+One entry point for the samples in this repository. Only the mode that is run gets imported, and while
+its prompt waits for the user, a background thread imports the heavy SDKs it needs (Semantic Kernel,
+the Azure AI Projects / Agents SDKs, azure-identity), acquires the Entra ID token and opens the TLS
+connections to the configured endpoints, so the first request does not pay for them.
+
+# Usage
+
+```zsh
+python cli.py report                # health plan reports (skmultiagent_reasoning.py)
+python cli.py report --reasoning    # reports with the o3 orchestrator (skmultiagent_aiagentservice.py)
+python cli.py chat                  # open-ended chat with the orchestrator
+python cli.py reasoning             # reasoning model chat (reasoning_simple.py)
+python cli.py reasoning-tools       # reasoning model chat with function calling
+python cli.py chart                 # code interpreter bar chart (aiagentservice_codeinterpreter.py)
+python cli.py responses gpt-41      # one of the aoai_* samples, see `python cli.py responses --help`
+python cli.py service               # the HTTP service (orchestrator_service.py)
+python cli.py bench-imports         # how long each mode's imports take in a fresh interpreter
+```
+
+# .env examples
+
+```.env
+# Set to false to skip the background imports, token acquisition and connection warm-up
+CLI_PREWARM=true
+```
+"""
+
+# Scripts that run on import, by sample name
+SAMPLES = {
+    "gpt-41": "aoai_responses_gpt_41.py",
+    "o3": "aoai_responses_o3.py",
+    "code-interpreter": "aoai_responses_code_interpreter.py",
+    "structured": "aoai_responses_structured.py",
+    "weather": "aoai_responses_function_weather.py .py",
+    "chat-gpt-41": "aoai_chat_completions_gpt_41.py",
+    "chat-o3": "aoai_chat_completions_o3.py",
+}
+
+# The heavy modules each mode needs, imported in the background while it waits for input
+PREWARM_MODULES = {
+    "report": ["healthplan_agents"],
+    "chat": ["healthplan_agents"],
+    "reasoning": ["semantic_kernel.connectors.ai.open_ai"],
+    "reasoning-tools": ["semantic_kernel.connectors.ai.open_ai"],
+    "chart": ["azure.ai.projects", "azure.ai.agents.models", "azure.identity"],
+    "responses": ["openai"],
+    "service": ["aiohttp", "healthplan_agents"],
+}
+
+# Modules measured by bench-imports
+BENCH_MODULES = [
+    "semantic_kernel",
+    "azure.ai.projects",
+    "azure.ai.agents",
+    "azure.identity",
+    "openai",
+    "aiohttp",
+    "healthplan_agents",
+    "skmultiagent_reasoning",
+    "reasoning_budget",
+    "token_budget",
+]
+
+# Environment variables holding the endpoints that are worth a TLS handshake up front
+ENDPOINT_VARIABLES = ("CHAT_MODEL_ENDPOINT", "AZURE_OPENAI_ENDPOINT", "AZURE_OPENAI_V1_API_ENDPOINT", "AIPROJECT_CONNECTION_STRING")
+
+TOKEN_SCOPE = "https://cognitiveservices.azure.com/.default"
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _warm_connections():
+    from aoai_clients import get_credential, get_http_client
+
+    try:
+        # DefaultAzureCredential caches the token, so the first real call skips the round trip to Entra ID
+        get_credential().get_token(TOKEN_SCOPE)
+    except Exception as e:
+        print(f"(prewarm: no Entra ID token: {e.__class__.__name__})", file=sys.stderr)
+    client = get_http_client()
+    for variable in ENDPOINT_VARIABLES:
+        url = os.getenv(variable)
+        match = re.match(r"https://[^/]+", url or "")
+        if match:
+            try:
+                # Any response will do: the point is the pooled, already-negotiated TLS connection that the
+                # aoai_clients-based samples reuse (and a warm DNS cache for the rest)
+                client.head(match.group(0) + "/")
+            except Exception:
+                pass
+
+
+def prewarm(mode: str) -> threading.Thread:
+    """
+    Starts importing the mode's heavy modules and warming the credential and connections on a daemon thread.
+    Imports are safe to race with the main thread: a module being imported in the background is waited for, not imported twice.
+    """
+    def work():
+        for module in PREWARM_MODULES.get(mode, []):
+            try:
+                importlib.import_module(module)
+            except Exception as e:
+                print(f"(prewarm: could not import {module}: {e})", file=sys.stderr)
+        _warm_connections()
+
+    thread = threading.Thread(target=work, name="cli-prewarm", daemon=True)
+    if os.getenv("CLI_PREWARM", "true").lower() in ("1", "true", "yes"):
+        thread.start()
+    return thread
+
+
+def import_time(module: str) -> tuple:
+    """
+    Imports `module` in a fresh interpreter with -X importtime.
+
+    Returns:
+    (wall_seconds, cumulative_seconds, slowest) (tuple[float, float, list]): The wall time of the interpreter
+    run, the cumulative import time of `module`, and its five slowest direct dependencies as (seconds, name).
+    """
+    # The repository's modules are importable from any working directory, as they are for this script
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, (HERE, os.environ.get("PYTHONPATH")))))
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True, env=env)
+    wall = time.perf_counter() - started
+    if result.returncode != 0:
+        raise ImportError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else module)
+    cumulative, children, dependencies = 0.0, [], []
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s*(\d+)\s*\|\s*(\d+)\s*\|( *)(\S+)", line)
+        if not match:
+            continue
+        # Nested imports are indented two spaces per level and printed before the module that imported them
+        seconds, depth, name = int(match.group(2)) / 1e6, (len(match.group(3)) - 1) // 2, match.group(4)
+        if depth == 1:
+            children.append((seconds, name))
+        elif depth == 0:
+            if name == module.split(".")[0] or name == module:
+                cumulative, dependencies = max(cumulative, seconds), dependencies + children
+            children = []
+    return wall, cumulative, sorted(dependencies, reverse=True)[:5]
+
+
+def bench_imports(modules: list):
+    print(f"{'module':<28} {'wall':>8} {'import':>8}  slowest dependencies")
+    for module in modules:
+        try:
+            wall, cumulative, slowest = import_time(module)
+        except ImportError as e:
+            print(f"{module:<28} {'-':>8} {'-':>8}  not importable: {e}")
+            continue
+        details = ", ".join(f"{name} {seconds:.2f}s" for seconds, name in slowest)
+        print(f"{module:<28} {wall:>7.2f}s {cumulative:>7.2f}s  {details}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Health plan agents and Azure OpenAI samples")
+    commands = parser.add_subparsers(dest="command", required=True)
+    report = commands.add_parser("report", help="Generate health plan reports")
+    report.add_argument("--reasoning", action="store_true", help="Use the o3 orchestrator (orchestrator-reasoning route)")
+    commands.add_parser("chat", help="Open-ended chat with the orchestrator agent")
+    commands.add_parser("reasoning", help="Chat with a reasoning model")
+    commands.add_parser("reasoning-tools", help="Chat with a reasoning model that can call functions")
+    commands.add_parser("chart", help="Create a bar chart with the code interpreter agent")
+    responses = commands.add_parser("responses", help="Run one of the Azure OpenAI samples")
+    responses.add_argument("sample", choices=sorted(SAMPLES))
+    commands.add_parser("service", help="Serve the orchestrator over HTTP")
+    bench = commands.add_parser("bench-imports", help="Measure module import times in fresh interpreters")
+    bench.add_argument("modules", nargs="*", default=BENCH_MODULES)
+    args = parser.parse_args()
+
+    if args.command == "bench-imports":
+        bench_imports(args.modules)
+        return
+    prewarm(args.command)
+
+    if args.command == "report":
+        if args.reasoning:
+            from skmultiagent_aiagentservice import main as report_loop
+        else:
+            from skmultiagent_reasoning import orchestrator_report_loop as report_loop
+        asyncio.run(report_loop())
+    elif args.command == "chat":
+        from skmultiagent_reasoning import orchestrator_chat_loop
+
+        asyncio.run(orchestrator_chat_loop())
+    elif args.command == "reasoning":
+        from reasoning_simple import main as reasoning_main
+
+        asyncio.run(reasoning_main())
+    elif args.command == "reasoning-tools":
+        from reasoning_simple_functioncalling import main as reasoning_main
+
+        asyncio.run(reasoning_main())
+    elif args.command == "chart":
+        runpy.run_path(os.path.join(HERE, "aiagentservice_codeinterpreter.py"), run_name="__main__")
+    elif args.command == "responses":
+        runpy.run_path(os.path.join(HERE, SAMPLES[args.sample]), run_name="__main__")
+    elif args.command == "service":
+        from orchestrator_service import main as service_main
+
+        service_main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import os
+import re
+
+from token_budget import count_tokens
+
+"""
+# Context packing
+
+The SearchAgent's answer is handed to the ReportAgent as plan_info. It tends to repeat the same passage
+several times, carries citation markers such as 【4:0†source】, and wraps the facts in chatty boilerplate.
+pack_context() turns it into a smaller prompt before the ReportAgent sees it:
+
+1. citation markers and boilerplate lines are removed
+2. the text is split into passages, and exact or near-duplicate passages are dropped
+3. passages are scored by how much they say about the report requirements (coverage, exclusions, costs)
+4. the best passage for every requirement is always kept, then the highest scoring passages fill the
+   token budget, and the selection is emitted in its original order
+
+Text that already fits the budget is only cleaned and deduplicated.
+
+# .env examples
+
+```.env
+# Token budget for the packed plan_info; 0 disables packing
+CONTEXT_PACK_MAX_TOKENS=3000
+```
+"""
+
+# Keywords for each section the report must cover
+REPORT_REQUIREMENTS = {
+    "coverage": ("cover", "covers", "covered", "coverage", "benefit", "benefits", "services", "in-network", "network", "preventive"),
+    "exclusions": ("exclusion", "exclusions", "excluded", "exclude", "not covered", "does not cover", "limitation", "limitations"),
+    "costs": ("cost", "costs", "deductible", "copay", "copayment", "coinsurance", "premium", "out-of-pocket", "maximum", "$"),
+}
+
+CITATION_PATTERNS = (
+    re.compile(r"[ \t]*【[^】]*】"),
+    re.compile(r"[ \t]*\[(?:doc)?\d+(?::\d+)?(?:†[^\]]*)?\]"),
+)
+
+BOILERPLATE_PATTERNS = (
+    re.compile(r"^(sure|certainly|of course)[,!.]", re.IGNORECASE),
+    re.compile(r"^(here is|here's|i found|based on (the|my) search)\b.*:\s*$", re.IGNORECASE),
+    re.compile(r"\b(let me know|feel free to ask|if you have any (other|more|further) questions|hope this helps)\b", re.IGNORECASE),
+)
+
+# Passages whose word shingles overlap at least this much are treated as duplicates
+NEAR_DUPLICATE_THRESHOLD = 0.85
+
+
+def strip_citations(text: str) -> str:
+    for pattern in CITATION_PATTERNS:
+        text = pattern.sub("", text)
+    return text
+
+
+def split_passages(text: str) -> list:
+    """
+    Splits text into passages on blank lines and markdown headings. A heading stays attached to the passage under it.
+    """
+    passages = []
+    for block in re.split(r"\n\s*\n|\n(?=#{1,6}\s)", text):
+        lines = [line.rstrip() for line in block.strip().splitlines()]
+        lines = [line for line in lines if line.strip() and not any(p.search(line.strip()) for p in BOILERPLATE_PATTERNS)]
+        if not lines:
+            continue
+        # A lone heading is merged into the passage that follows it
+        if passages and re.fullmatch(r"#{1,6}\s.*", passages[-1]):
+            passages[-1] = passages[-1] + "\n" + "\n".join(lines)
+        else:
+            passages.append("\n".join(lines))
+    return passages
+
+
+def _shingles(text: str) -> set:
+    words = re.findall(r"[a-z0-9$%]+", text.lower())
+    return {" ".join(words[i:i + 3]) for i in range(max(1, len(words) - 2))}
+
+
+def deduplicate(passages: list) -> list:
+    """
+    Drops passages that repeat (or nearly repeat) an earlier one. When a passage is contained in a later,
+    longer one, the longer one replaces it.
+    """
+    kept = []
+    for passage in passages:
+        shingles = _shingles(passage)
+        duplicate = False
+        for i, (other, other_shingles) in enumerate(kept):
+            overlap = len(shingles & other_shingles)
+            if overlap >= NEAR_DUPLICATE_THRESHOLD * len(shingles):
+                duplicate = True
+                break
+            if overlap >= NEAR_DUPLICATE_THRESHOLD * len(other_shingles):
+                kept[i] = (passage, shingles)
+                duplicate = True
+                break
+        if not duplicate:
+            kept.append((passage, shingles))
+    return [passage for passage, _ in kept]
+
+
+def requirement_scores(passage: str, requirements: dict = None) -> dict:
+    """
+    Returns, for every requirement, how many of its keywords occur in the passage.
+    """
+    lowered = passage.lower()
+    return {name: sum(lowered.count(keyword) for keyword in keywords) for name, keywords in (requirements or REPORT_REQUIREMENTS).items()}
+
+
+def pack_context(plan_info: str, plan_name: str = "", max_tokens: int = None, requirements: dict = None) -> str:
+    """
+    Packs the search results for a plan into a deduplicated, requirement-ranked excerpt that fits a token budget.
+
+    Parameters:
+    plan_info (str): The SearchAgent's answer.
+    plan_name (str): The plan the report is about; passages naming it score higher.
+    max_tokens (int): The token budget. Defaults to CONTEXT_PACK_MAX_TOKENS; 0 returns the cleaned text unpacked.
+    requirements (dict): Requirement name -> keywords. Defaults to REPORT_REQUIREMENTS.
+
+    Returns:
+    packed (str): The packed plan information.
+    """
+    max_tokens = int(os.getenv("CONTEXT_PACK_MAX_TOKENS", "3000")) if max_tokens is None else max_tokens
+    requirements = requirements or REPORT_REQUIREMENTS
+    passages = deduplicate(split_passages(strip_citations(plan_info)))
+    if max_tokens <= 0 or count_tokens("\n\n".join(passages)) <= max_tokens:
+        return "\n\n".join(passages)
+
+    plan_words = set(re.findall(r"[a-z0-9]+", plan_name.lower())) - {"plan", "health"}
+    scored = []
+    for index, passage in enumerate(passages):
+        per_requirement = requirement_scores(passage, requirements)
+        mentions_plan = bool(plan_words) and plan_words <= set(re.findall(r"[a-z0-9]+", passage.lower()))
+        # Keyword density, so long passages do not win just by being long
+        score = (sum(per_requirement.values()) + 2 * mentions_plan) / (1 + count_tokens(passage) / 100)
+        scored.append((index, passage, per_requirement, score))
+
+    selected, used = set(), 0
+
+    def take(index, passage):
+        nonlocal used
+        cost = count_tokens(passage)
+        if index in selected or used + cost > max_tokens:
+            return
+        selected.add(index)
+        used += cost
+
+    # The best passage for each requirement goes in first so no required section loses its only source
+    for name in requirements:
+        candidates = [s for s in scored if s[2][name] > 0]
+        if candidates:
+            index, passage, _, _ = max(candidates, key=lambda s: (s[2][name], s[3]))
+            take(index, passage)
+    # Then the rest by relevance; passages that say nothing about the plan or the requirements are dropped
+    for index, passage, _, score in sorted(scored, key=lambda s: -s[3]):
+        if score > 0:
+            take(index, passage)
+
+    return "\n\n".join(passage for index, passage, _, _ in scored if index in selected)
@@ -0,0 +1,845 @@
+import asyncio
+import json
+import os
+import time
+import threading
+from semantic_kernel.functions import kernel_function
+from dotenv import load_dotenv
+from pydantic import PrivateAttr
+from azure.ai.projects import AIProjectClient
+from azure.identity import DefaultAzureCredential
+from azure.ai.agents.models import AzureAISearchTool
+
+from semantic_kernel.agents import ChatCompletionAgent
+from semantic_kernel.connectors.ai.open_ai import AzureChatCompletion
+from semantic_kernel.connectors.ai.function_choice_behavior import FunctionChoiceBehavior
+from semantic_kernel.contents.chat_history import ChatHistory
+from semantic_kernel.contents.chat_message_content import ChatMessageContent
+from semantic_kernel.contents.utils.author_role import AuthorRole
+from semantic_kernel.kernel import Kernel
+
+from agent_reaper import CLEANUP_METADATA, get_reaper
+from artifact_store import ArtifactStore, get_artifact_store
+from context_packing import pack_context
+from hedging import (
+    AnyEvent,
+    RequestCancelledError,
+    StageTimeoutError,
+    current_deadline,
+    deadline_scope,
+    hedge_delay,
+    hedge_target,
+    hedged_call,
+    stage_timeout,
+    with_timeout,
+)
+from model_router import ModelRouter, NoHealthyDeploymentError, escalated, get_router
+from plan_index import LocalSearchAgent
+from plan_catalog import canonical_plan
+from single_flight import SingleFlight
+from token_budget import count_tokens, fit_content, fit_history
+from tracing import add_kernel_tracing, span
+from speculative_prefetch import SearchPrefetcher, speculative_search_enabled
+from report_sections import validation_prompt
+from request_scheduler import get_scheduler, priority, run_in_slot
+from rate_limiter import (
+    RateLimitExceededError,
+    RateLimitManager,
+    estimate_tokens,
+    get_rate_limiter,
+    is_rate_limit_error,
+    retry_after_from_error,
+)
+
+load_dotenv()
+
+"""
+# Health plan agents
+
+The Search, Report and Validation agent plugins and the report orchestrator shared by
+skmultiagent_reasoning.py and skmultiagent_aiagentservice.py. Every plugin asks the model router
+(model_router.py) for its deployment instead of hard-coding "gpt-4o", and spends from the shared
+per-deployment quota (rate_limiter.py) before each run. Runs are polled with per-stage timeouts and
+can be hedged (hedging.py). Search results and reports are passed between the plugins by handle
+(artifact_store.py) so they never round-trip through the orchestrator model's tokens, and the search
+results are packed (context_packing.py) before they reach the ReportAgent.
+
+SEARCH_BACKEND=local swaps the remote SearchAgent for LocalSearchAgent (plan_index.py), which answers
+from an on-disk index of the plan documents.
+"""
+
+# In-flight report pipelines and searches, shared by every session in the process
+report_flights = SingleFlight()
+search_flights = SingleFlight()
+search_prefetcher = SearchPrefetcher()
+
+# Completion allowances used to estimate the quota cost of a call before it is sent
+AGENT_OUTPUT_TOKENS = 2000
+ORCHESTRATOR_OUTPUT_TOKENS = 4000
+CHAT_OUTPUT_TOKENS = 1000
+
+
+def is_rate_limited(last_error) -> bool:
+    """
+    Returns True if a failed run's last_error is a quota (429) error.
+    """
+    if not last_error:
+        return False
+    code = last_error.get("code") if isinstance(last_error, dict) else getattr(last_error, "code", None)
+    return code == "rate_limit_exceeded"
+
+
+def message_text(message) -> str:
+    """
+    Returns the text content of an agent message (as returned by get_last_message_by_role), or of anything else as str().
+    """
+    if message is None:
+        return ""
+    if isinstance(message, str):
+        return message
+    text_messages = getattr(message, "text_messages", None)
+    if text_messages:
+        return "\n\n".join(text_message.text.value for text_message in text_messages)
+    return str(message)
+
+
+class AgentRunError(RuntimeError):
+    """
+    Raised when an agent run failed on every deployment it was tried on.
+    """
+
+
+# Run statuses after which the service does no more work on a run
+TERMINAL_RUN_STATUSES = ("completed", "failed", "cancelled", "expired", "incomplete")
+
+
+def poll_run(project_client: AIProjectClient, thread_id: str, run_id: str, timeout: float, stage: str,
+             cancel_event: threading.Event = None):
+    """
+    Polls a run until it reaches a terminal status. If the timeout passes or `cancel_event` is set first,
+    the run is cancelled on the service so it stops burning tokens.
+
+    Returns:
+    run (ThreadRun): The finished run.
+    """
+    deadline = time.monotonic() + timeout
+    interval = 0.25
+    while True:
+        with span("poll", run_id=run_id):
+            run = project_client.agents.runs.get(thread_id=thread_id, run_id=run_id)
+        if run.status in TERMINAL_RUN_STATUSES:
+            return run
+        if cancel_event is not None and cancel_event.is_set():
+            project_client.agents.runs.cancel(thread_id=thread_id, run_id=run_id)
+            raise RequestCancelledError(f"The {stage} run {run_id} was cancelled (its caller gave up or a hedge won)")
+        if time.monotonic() >= deadline:
+            project_client.agents.runs.cancel(thread_id=thread_id, run_id=run_id)
+            raise StageTimeoutError(stage, timeout)
+        # Back off gently so long runs are not polled more often than necessary
+        time.sleep(min(interval, max(0.0, deadline - time.monotonic())))
+        interval = min(interval * 1.5, 2.0)
+
+
+def _run_once(project_client: AIProjectClient, deployment: str, name: str, instructions: str, content: str,
+              stage: str, timeout: float, cancel_event: threading.Event = None, **agent_kwargs):
+    """
+    Creates a single-use agent on `deployment`, runs it on a new thread and returns (run, thread).
+    The agent is deleted in the background once the run is over; the caller hands the thread to the reaper
+    when it has read the reply.
+    """
+    reaper = get_reaper()
+    # Create the agent on the deployment picked by the router, marked so the reaper's orphan sweep can find it
+    with span("create agent", deployment=deployment):
+        agent = project_client.agents.create_agent(
+            model=deployment,
+            name=name,
+            instructions=instructions, # System prompt for the agent
+            metadata=CLEANUP_METADATA,
+            **agent_kwargs,
+        )
+    thread = None
+    try:
+        # Create a thread which is a conversation session between an agent and a user.
+        with span("create thread"):
+            thread = project_client.agents.threads.create(metadata=CLEANUP_METADATA)
+
+        # Create a message in the thread with the user's request
+        with span("create message"):
+            project_client.agents.messages.create(
+                thread_id=thread.id,
+                role="user",
+                content=content, # The user's message
+            )
+
+        # Run the agent to process the message in the thread, giving up (and cancelling the run) after the stage timeout
+        with span("run", deployment=deployment) as run_span:
+            run = project_client.agents.runs.create(thread_id=thread.id, agent_id=agent.id)
+            run = poll_run(project_client, thread.id, run.id, timeout, stage, cancel_event)
+            if run_span is not None:
+                run_span.set(status=run.status)
+    except BaseException:
+        # Nobody will read a thread whose run failed or was cancelled
+        if thread is not None:
+            reaper.delete_thread(project_client, thread.id)
+        raise
+    finally:
+        # Delete the agent off the critical path once it's done running
+        reaper.delete_agent(project_client, agent.id)
+    return run, thread
+
+
+class _Attempt:
+    """
+    The outcome of one run of an agent on one deployment.
+    """
+    def __init__(self, deployment: str):
+        self.deployment = deployment
+        self.run = None
+        self.thread = None
+        self.rate_limited = False
+        self.retry_after = None
+        self.error = None
+
+    @property
+    def ok(self) -> bool:
+        return self.run is not None and self.run.status == "completed"
+
+
+def run_agent(project_client: AIProjectClient, name: str, instructions: str, content: str,
+              router: ModelRouter = None, route: str = "agent", limiter: RateLimitManager = None,
+              max_output_tokens: int = AGENT_OUTPUT_TOKENS, stage: str = None, cancel_event: threading.Event = None,
+              **agent_kwargs):
+    """
+    Creates a single-use Azure AI Agent on the routed deployment, runs it on a new thread and returns its reply.
+
+    The estimated token cost is spent from the deployment's shared TPM / RPM budget before the run starts.
+    Rate limited runs are retried after the service's Retry-After (or a jittered backoff), on another
+    deployment of the route if one is healthy. Runs that fail for other reasons, including REST errors, fall back to the route's
+    next deployment until the candidates run out. All attempts together must finish within the stage
+    timeout, and with hedging enabled a slow run is raced against a duplicate (see hedging.py).
+    Under a caller's deadline, the stage only gets its share of the time that is left (or is not started
+    at all), and the run is cancelled on the service as soon as the caller gives up.
+
+    Parameters:
+    project_client (AIProjectClient): The client connected to the Azure AI Foundry project.
+    name (str): The name of the agent.
+    instructions (str): The system prompt for the agent.
+    content (str): The user's message.
+    router (ModelRouter): The router to pick deployments from. Defaults to the process-wide router.
+    route (str): The route to pick deployments from.
+    limiter (RateLimitManager): The rate limiter. Defaults to the process-wide limiter.
+    max_output_tokens (int): The completion allowance used for the token estimate.
+    stage (str): The pipeline stage (search, report, validate) whose timeout applies. Defaults to the agent name.
+    cancel_event (threading.Event): When set, the run in progress is cancelled on the service and RequestCancelledError is raised.
+    agent_kwargs: Extra arguments for `create_agent`, e.g. tools and tool_resources.
+
+    Returns:
+    last_msg (json): The last message from the agent.
+    """
+    router = router or get_router()
+    limiter = limiter or get_rate_limiter()
+    scheduler = get_scheduler()
+    stage = stage or name
+    # Within a request's deadline the stage gets its share of the remaining time; too little fails fast here
+    request_deadline = current_deadline()
+    timeout = request_deadline.stage_budget(stage) if request_deadline is not None else stage_timeout(stage)
+    deadline = time.monotonic() + timeout
+    # A caller that goes away (Ctrl-C, a client disconnect, a timed-out orchestrator turn) cancels the run on the service
+    cancel_event = AnyEvent(cancel_event, request_deadline)
+    estimated = estimate_tokens(instructions, content, max_output_tokens=max_output_tokens)
+
+    def attempt(deployment: str, hedge_event: threading.Event = None) -> _Attempt:
+        with span("attempt", deployment=deployment, hedged=hedge_event is not None):
+            outcome = _attempt(deployment, hedge_event)
+        # Only the winning attempt's thread is read; failed runs and a hedge that finished second are cleaned up now
+        if outcome.thread is not None and (not outcome.ok or (hedge_event is not None and hedge_event.is_set())):
+            get_reaper().delete_thread(project_client, outcome.thread.id)
+        return outcome
+
+    def _attempt(deployment: str, hedge_event: threading.Event = None) -> _Attempt:
+        outcome = _Attempt(deployment)
+        # Cut an oversized message to the deployment's context window (or reject it) before paying for the run
+        fitted, _ = fit_content(deployment, instructions, content, max_output_tokens)
+        # The run is cancelled when the caller gives up or, for a hedged attempt, when the other attempt won
+        attempt_cancel_event = AnyEvent(cancel_event, hedge_event)
+        # Wait for a slot of the request's priority class (see request_scheduler.py), then for the deployment's quota
+        with scheduler.slot(cost=estimated / 1000, cancel_event=attempt_cancel_event, expires=deadline, stage=stage):
+            limiter.acquire(deployment, estimated)
+            if attempt_cancel_event.is_set():
+                raise RequestCancelledError(f"{name} was cancelled before its run started")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise StageTimeoutError(stage, timeout)
+            with router.track(deployment) as call:
+                try:
+                    outcome.run, outcome.thread = _run_once(project_client, deployment, name, instructions, fitted,
+                                                            stage, remaining, attempt_cancel_event, **agent_kwargs)
+                except RequestCancelledError:
+                    call.cancelled()
+                    raise
+                except StageTimeoutError:
+                    raise
+                except Exception as e:
+                    # 429s on the REST calls themselves are retried like rate limited runs; any other failure
+                    # (5xx, a reset connection) falls back to the route's next deployment like a failed run
+                    outcome.error = e
+                    if is_rate_limit_error(e):
+                        outcome.rate_limited, outcome.retry_after = True, retry_after_from_error(e)
+                else:
+                    if not outcome.ok:
+                        outcome.error = outcome.run.last_error or outcome.run.status
+                        outcome.rate_limited = is_rate_limited(outcome.run.last_error)
+                        outcome.retry_after = retry_after_from_error(outcome.run.last_error) if outcome.rate_limited else None
+                if not outcome.ok:
+                    call.failed(saturated=outcome.rate_limited, retry_after=outcome.retry_after)
+        return outcome
+
+    failed = []
+    outcome = None
+    for retry in range(limiter.max_retries + 1):
+        if cancel_event.is_set():
+            raise RequestCancelledError(f"{name} was cancelled")
+        try:
+            deployment = router.select(route, exclude=failed)
+        except NoHealthyDeploymentError:
+            break
+
+        hedge_after = hedge_delay(router, deployment)
+        if hedge_after is None:
+            outcome = attempt(deployment)
+        else:
+            backup = hedge_target(router, route, deployment, exclude=failed)
+            outcome = hedged_call(lambda event: attempt(deployment, event), lambda event: attempt(backup, event),
+                                  hedge_after, accept=lambda result: result.ok)
+
+        if outcome.ok:
+            limiter.reconcile(outcome.deployment, estimated, getattr(getattr(outcome.run, "usage", None), "total_tokens", None))
+            # Get the last message, which is the agent's resposne to the user's question
+            try:
+                with span("fetch message"):
+                    return project_client.agents.messages.get_last_message_by_role(thread_id=outcome.thread.id, role="assistant")
+            finally:
+                get_reaper().delete_thread(project_client, outcome.thread.id)
+
+        print(f"Run failed on {outcome.deployment}: {outcome.error}")
+        if outcome.rate_limited:
+            # Pause the deployment for every caller; the router prefers another healthy deployment meanwhile
+            limiter.backoff(outcome.deployment, retry, outcome.retry_after)
+        else:
+            failed.append(outcome.deployment)
+
+    if outcome is not None and outcome.rate_limited:
+        raise RateLimitExceededError(f"{name} is still rate limited after {limiter.max_retries} retries: {outcome.error}")
+    raise AgentRunError(f"{name} failed on {', '.join(failed) or 'every deployment'}: {outcome.error if outcome else None}")
+
+
+def slot_cost(*texts) -> float:
+    """
+    Returns the scheduler cost of an agent run on `texts`, as run_agent estimates it: its tokens in thousands.
+    """
+    return estimate_tokens(*texts, max_output_tokens=AGENT_OUTPUT_TOKENS) / 1000
+
+
+class SearchAgent:
+    """
+    A class to represent the Search Agent.
+    """
+    def __init__(self, router: ModelRouter = None, artifacts: ArtifactStore = None, prefetcher: SearchPrefetcher = None):
+        self.router = router or get_router()
+        self.artifacts = artifacts or get_artifact_store()
+        self.prefetcher = prefetcher or search_prefetcher
+
+    @kernel_function(description='An agent that searches health plan documents. Returns a handle to the search results.')
+    async def search_plan_docs(self, plan_name:str) -> str:
+        """
+        Creates an Azure AI Agent that searches an Azure AI Search index for information about a health plan.
+
+        Parameters:
+        plan_name (str): The name of the health plan to search for.
+
+        Returns:
+        handle (str): A handle to the information about the health plan, stored in the artifact store.
+
+        """
+        last_msg = None
+        prefetched = self.prefetcher.take(plan_name)
+        if prefetched is not None:
+            try:
+                # The speculative search started with the request; shield it so a cancelled caller does not cancel it for others
+                last_msg = await asyncio.shield(prefetched)
+                print("SearchAgent used the speculative search.")
+            except Exception as e:
+                print(f"The speculative search failed ({e}), searching again...")
+        if last_msg is None:
+            # The agent run blocks on REST calls, so it runs on a worker thread (once the scheduler grants a slot) to keep the
+            # event loop serving other sessions. Identical searches already running on other threads (e.g. other sessions) are joined instead of repeated.
+            last_msg = await run_in_slot(self.prefetch, plan_name, cost=slot_cost(plan_name))
+
+        # Keep the search results server-side; the orchestrator only passes the handle on to the ReportAgent
+        return self.artifacts.put(message_text(last_msg), kind="search")
+
+    def prefetch(self, plan_name: str, cancel_event: threading.Event = None):
+        """
+        Runs the search on the calling thread, joining an identical search that is already in flight.
+        Every spelling of a plan searches for its canonical name (see plan_catalog.py), so they all share one search.
+        """
+        plan = canonical_plan(plan_name)
+        return search_flights.do(plan.id, self._search, plan.name, cancel_event=cancel_event)
+
+    def _search(self, plan_name: str, cancel_event: threading.Event = None):
+        print("Calling SearchAgent...")
+
+        # Connecting to our Azure AI Foundry project, which will allow us to use the deployed models for our agent
+        project_client = AIProjectClient(
+            credential=DefaultAzureCredential(),
+            endpoint=os.environ["AIPROJECT_CONNECTION_STRING"],
+        )
+
+        # Iterate through the connections in your project and get the connection ID of the Aazure AI Search connection.
+        conn_list = project_client.connections.list()
+        conn_id = ""
+        for conn in conn_list:
+            if conn.type == "CognitiveSearch":
+                conn_id = conn.id
+        # Connect to your Azure AI Search index
+        ai_search = AzureAISearchTool(index_connection_id=conn_id, index_name="healthplan-index")
+
+        # Run an agent that will be used to search for health plan information
+        last_msg = run_agent(
+            project_client,
+            name="search-agent",
+            stage="search",
+            instructions="You are a helpful agent that is an expert at searching health plan documents.",
+            content=f"Tell me about the {plan_name} plan.",
+            router=self.router,
+            cancel_event=cancel_event,
+            tools=ai_search.definitions,
+            tool_resources=ai_search.resources,
+        )
+
+        print("SearchAgent completed successfully.")
+
+        return last_msg
+
+
+# The Report and Validation agents' prompts, shared with the Batch API mode (report_batch.py)
+REPORT_AGENT_INSTRUCTIONS = "You are a helpful agent that is an expert at writing detailed reports about health plans."
+VALIDATION_AGENT_INSTRUCTIONS = "You are a helpful agent that is an expert at validating that reports meet requirements. Return 'Pass' if the report meets requirement or 'Fail' if it does not meet requirements. You must only return 'Pass' or 'Fail'."
+
+
+def report_agent_content(plan_name: str, plan_info: str) -> str:
+    """
+    Returns the ReportAgent's request for a plan, given its (packed) search results.
+    """
+    return f"Write a detailed report about the {plan_name} plan. Make sure to include information about coverage exclusions. Here is the relevant information for the plan: {plan_info}."
+
+
+class ReportAgent:
+    """
+    A class to represent the Report Agent.
+    """
+    def __init__(self, router: ModelRouter = None, artifacts: ArtifactStore = None):
+        self.router = router or get_router()
+        self.artifacts = artifacts or get_artifact_store()
+
+    @kernel_function(description='An agent that writes detailed reports about health plans. Takes the handle returned by SearchAgent as plan_info and returns a handle to the report.')
+    async def write_report(self, plan_name:str, plan_info:str) -> str:
+        """
+        Creates an Azure AI Agent that writes a detailed report about a health plan.
+
+        Parameters:
+        plan_name (str): The name of the health plan to search for.
+        plan_info (str): The information about the speciifc health plan to include in the report, or a handle to it.
+
+        Returns:
+        handle (str): A handle to the detailed report about the health plan, stored in the artifact store.
+
+        """
+        # Resolve the search results server-side instead of having the orchestrator re-emit them
+        plan_info = self.artifacts.resolve(plan_info)
+
+        # The agent run blocks on REST calls, so it runs on a worker thread (once the scheduler grants a slot) to keep the event loop serving other sessions
+        last_msg = await run_in_slot(self._write_report, plan_name, plan_info, cost=slot_cost(plan_info))
+        return self.artifacts.put(message_text(last_msg), kind="report")
+
+    def _write_report(self, plan_name: str, plan_info: str):
+        print("Calling ReportAgent...")
+
+        # Drop duplicate passages, citations and boilerplate, and keep what the report needs within the token budget
+        packed = pack_context(message_text(plan_info), plan_name)
+        print(f"Packed plan_info from {count_tokens(plan_info)} to {count_tokens(packed)} tokens.")
+        plan_info = packed
+
+        # Connecting to our Azure AI Foundry project, which will allow us to use the deployed models for our agent
+        project_client = AIProjectClient(
+            credential=DefaultAzureCredential(),
+            endpoint=os.environ["AIPROJECT_CONNECTION_STRING"],
+        )
+
+        # Run an agent that will be used to write a detailed report about a health plan
+        last_msg = run_agent(
+            project_client,
+            name="report-agent",
+            stage="report",
+            instructions=REPORT_AGENT_INSTRUCTIONS,
+            content=report_agent_content(plan_name, plan_info),
+            router=self.router,
+        )
+
+        print("ReportAgent completed successfully.")
+
+        return last_msg
+
+
+class ValidationAgent:
+    """
+    A class to represent the Validation Agent.
+    """
+    def __init__(self, router: ModelRouter = None, artifacts: ArtifactStore = None):
+        self.router = router or get_router()
+        self.artifacts = artifacts or get_artifact_store()
+
+    @kernel_function(description='An agent that runs validation checks to ensure the generated report meets requirements. Takes the handle returned by ReportAgent as report.')
+    async def validate_report(self, report:str) -> str:
+        """
+        Creates an Azure AI Agent that validates that the report generated by the Report Agent meets requirements.
+        Coverage Exlusion Requirement: The report must include information about coverage exclusions.
+
+        Parameters:
+        report (str): The report generated by the Report Agent, or a handle to it.
+
+        Returns:
+        verdict (str): The validation result, 'Pass' or 'Fail'.
+
+        """
+        # Resolve the report server-side instead of having the orchestrator re-emit it
+        report = self.artifacts.resolve(report)
+
+        # The agent run blocks on REST calls, so it runs on a worker thread (once the scheduler grants a slot) to keep the event loop serving other sessions
+        return message_text(await run_in_slot(self._validate_report, report, cost=slot_cost(report)))
+
+    def _validate_report(self, report: str, requirements: dict = None):
+        print("Calling ValidationAgent...")
+
+        # Connecting to our Azure AI Foundry project, which will allow us to use the deployed models for our agent
+        project_client = AIProjectClient(
+            credential=DefaultAzureCredential(),
+            endpoint=os.environ["AIPROJECT_CONNECTION_STRING"],
+        )
+
+        # Only the table of contents and the sections relevant to each requirement are sent, not the whole report.
+        # An incremental update (report_update.py) only re-checks the requirements its rewritten sections touch.
+        content = validation_prompt(report, requirements)
+        print(f"Validating {count_tokens(content)} of the report's {count_tokens(report)} tokens.")
+
+        # Run an agent that will be used to validate that the generated report meets requirements
+        last_msg = run_agent(
+            project_client,
+            name="validation-agent",
+            stage="validate",
+            instructions=VALIDATION_AGENT_INSTRUCTIONS,
+            content=content,
+            router=self.router,
+        )
+
+        print("ValidationAgent completed successfully.")
+
+        return last_msg
+
+
+REPORT_ORCHESTRATOR_INSTRUCTIONS = """
+            You are an agent designed to create detailed reports about health plans. The user will provide the name of a health plan and you will create a detailed report about that health plan. You will also need to validate that the report meets requirements. Call the appropriate functions to help write the report.
+            Do not write the report on your own. Your role is to be an orchestrator who will call the appropriate plugins and functions provided to you. Each plugin that you have available is an agent that can accomplish a specific task. Here are descriptions of the plugins you have available:
+
+            - ReportAgent: An agent that writes detailed reports about health plans.
+            - SearchAgent: An agent that searches health plan documents.
+            - ValidationAgent: An agent that runs validation checks to ensure the generated report meets requirements. It will return 'Pass' if the report meets requirements or 'Fail' if it does not meet requirements.
+
+            SearchAgent and ReportAgent return short handles that look like artifact://search/0123456789abcdef instead of the full text. Pass these handles to the other functions exactly as you received them; the content is resolved for you. Never try to expand, summarize or rewrite a handle.
+
+            Validating that the report meets requirements is critical. If the report does not meet requirements, you must inform the user that the report could not be generated. Do not output a report that does not meet requirements to the user.
+            If the report meets requirements, you can output the report to the user. Format your response as a JSON object with two attributes, report_was_generated and content. Here are descriptions of the two attributes:
+
+            - report_was_generated: A boolean value that indicates whether the report was generated. If the report was generated, set this value to True. If the report was not generated, set this value to False.
+            - content: A string that contains the report. If the report was generated, this string should contain only the handle of the report returned by ReportAgent. If the report was not generated, this string should contain a message to the user indicating that the report could not be generated.
+
+            Here's an example of a JSON object that you can return to the user:
+            {"report_was_generated": false, "content": "The report for the Northwind Standard health plan could not be generated as it did not meet the required validation standards."}
+
+            Your response must contain only a single valid JSON object. Do not include any additional text, comments, or blank lines before or after it. Use lowercase booleans (true/false) and double quotes for all keys and string values. The JSON object that you generate will be parsed in Python using the json.loads() method. If your output is not a valid JSON object, it will cause an error in the Python code.
+            """
+
+
+def search_backend() -> str:
+    """
+    Returns the configured search backend: "agent" (the remote Azure AI Search agent, default) or "local".
+    """
+    return os.getenv("SEARCH_BACKEND", "agent").lower()
+
+
+def create_search_agent(router: ModelRouter = None, artifacts: ArtifactStore = None):
+    """
+    Returns the SearchAgent plugin for the configured search backend.
+    """
+    if search_backend() == "local":
+        return LocalSearchAgent(artifacts=artifacts)
+    return SearchAgent(router, artifacts)
+
+
+class RateLimitedAzureChatCompletion(AzureChatCompletion):
+    """
+    A class to represent an Azure chat completion service whose requests spend from the deployment's shared quota
+    and are retried after a 429. The retry wraps the single chat completion request, so a rate-limited orchestrator
+    turn never runs (and pays for) the plugin calls it already made again.
+    Each request is reported to the model router on its own, so the deployment's latency samples do not include
+    the plugin calls the orchestrator makes between its requests.
+    """
+    # The rate limiter to spend from; the process-wide limiter when not set
+    _limiter: RateLimitManager = PrivateAttr(default=None)
+    # The router the deployment's latency and errors are reported to; the process-wide router when not set
+    _router: ModelRouter = PrivateAttr(default=None)
+
+    async def _send_request(self, settings):
+        # SK 1.19 sends every chat completion, streaming or not, through here with the prepared messages
+        estimated = estimate_tokens(*(str(message.get("content") or "") for message in getattr(settings, "messages", None) or []),
+                                    max_output_tokens=ORCHESTRATOR_OUTPUT_TOKENS)
+        router = self._router or get_router()
+
+        async def send():
+            rate_limited = None
+            with router.track(self.ai_model_id) as call:
+                try:
+                    return await super(RateLimitedAzureChatCompletion, self)._send_request(settings)
+                except asyncio.CancelledError:
+                    # A turn that timed out or whose caller went away says nothing about the deployment's health
+                    call.cancelled()
+                    raise
+                except Exception as e:
+                    if not is_rate_limit_error(e):
+                        raise
+                    rate_limited = e
+                    call.failed(saturated=True, retry_after=retry_after_from_error(e))
+            # Raised outside the tracked block, which would otherwise record the 429 as a plain error
+            raise rate_limited
+
+        return await (self._limiter or get_rate_limiter()).call_async(self.ai_model_id, estimated, send)
+
+
+def create_report_orchestrator(deployment_name: str, router: ModelRouter = None, artifacts: ArtifactStore = None,
+                               limiter: RateLimitManager = None) -> ChatCompletionAgent:
+    """
+    Builds the Orchestrator Agent that calls the Search, Report and Validation agents on a given deployment.
+
+    Parameters:
+    deployment_name (str): The chat deployment the orchestrator itself runs on.
+    router (ModelRouter): The router the agent plugins pick their deployments from.
+    artifacts (ArtifactStore): The store the agent plugins exchange their outputs through.
+    limiter (RateLimitManager): The rate limiter the orchestrator's chat completions spend from. Defaults to the process-wide limiter.
+
+    Returns:
+    agent (ChatCompletionAgent): The orchestrator agent.
+    """
+    artifacts = artifacts or get_artifact_store()
+    # The environment variables needed to connect to the chat model in Azure AI Foundry
+    endpoint = os.environ["CHAT_MODEL_ENDPOINT"]
+    api_key = os.environ["CHAT_MODEL_API_KEY"]
+
+    # The Kernel is the main entry point for the Semantic Kernel. It will be used to add services and plugins to the Kernel.
+    kernel = Kernel()
+
+    # Add the necessary services and plugins to the Kernel
+    # Adding the ReportAgent and SearchAgent plugins will allow the OrchestratorAgent to call the functions in these plugins
+    service_id = "orchestrator_agent"
+    # Rate limits are handled per chat completion request rather than per orchestrator turn (see RateLimitedAzureChatCompletion)
+    chat_service = RateLimitedAzureChatCompletion(service_id=service_id, deployment_name=deployment_name, endpoint=endpoint, api_key=api_key)
+    chat_service._limiter = limiter
+    chat_service._router = router
+    kernel.add_service(chat_service)
+    kernel.add_plugin(ReportAgent(router, artifacts), plugin_name="ReportAgent")
+    kernel.add_plugin(create_search_agent(router, artifacts), plugin_name="SearchAgent")
+    kernel.add_plugin(ValidationAgent(router, artifacts), plugin_name="ValidationAgent")
+    # Every plugin call the orchestrator makes becomes a span when tracing is enabled
+    add_kernel_tracing(kernel)
+
+    settings = kernel.get_prompt_execution_settings_from_service_id(service_id=service_id)
+    # Configure the function choice behavior to automatically invoke kernel functions
+    settings.function_choice_behavior = FunctionChoiceBehavior.Auto()
+
+    # Create the Orchestrator Agent that will call the Search and Report agents to create the report
+    return ChatCompletionAgent(
+        service_id=service_id,
+        kernel=kernel, # The Kernel that contains the services and plugins
+        name="OrchestratorAgent",
+        instructions=REPORT_ORCHESTRATOR_INSTRUCTIONS,
+        execution_settings=settings,
+    )
+
+
+CHAT_INSTRUCTIONS = "You are a helpful assistant. Answer the user's questions and have a conversation on any topic."
+
+
+def create_chat_agent(deployment_name: str) -> ChatCompletionAgent:
+    """
+    Builds the open-ended chat agent (no plugins) on a given deployment.
+    """
+    endpoint = os.environ["CHAT_MODEL_ENDPOINT"]
+    api_key = os.environ["CHAT_MODEL_API_KEY"]
+    service_id = "orchestrator_agent"
+
+    kernel = Kernel()
+    kernel.add_service(AzureChatCompletion(service_id=service_id, deployment_name=deployment_name, endpoint=endpoint, api_key=api_key))
+    add_kernel_tracing(kernel)
+
+    # You can add plugins if you want, but for open chat, just the service is enough
+    return ChatCompletionAgent(
+        service_id=service_id,
+        kernel=kernel,
+        name="OrchestratorAgent",
+        instructions=CHAT_INSTRUCTIONS,
+        # You can add execution_settings if needed
+    )
+
+
+def parse_report_response(content: str) -> tuple:
+    """
+    Parses the orchestrator's JSON reply.
+
+    Returns:
+    (report_was_generated, content) (tuple[bool, str]): Whether the report passed validation, and the report or failure message.
+    """
+    # Ensure that boolean values are lowercase as it's required JSON formatting
+    fixed_content = content.replace("False", "false").replace("True", "true")
+    response_json = json.loads(fixed_content)
+    return response_json['report_was_generated'], response_json['content']
+
+
+def save_report(user_input: str, report_content: str) -> str:
+    """
+    Saves a generated report to `<plan> Report.md`, named after the canonical plan of `user_input`, and returns the file name.
+    """
+    plan_name = canonical_plan(user_input).name
+    report_name = f"{plan_name} Report.md"
+    with open(f"{report_name}", "w") as f:
+        f.write(report_content)
+    print(f"The report for {plan_name} has been generated. Please check the {report_name} file for the report.")
+    return report_name
+
+
+async def generate_report(history, route: str = "orchestrator", orchestrators: dict = None, router: ModelRouter = None,
+                          limiter: RateLimitManager = None) -> tuple:
+    """
+    Invokes the report orchestrator on the routed deployment. If the report fails validation, the orchestrator
+    and the agent plugins (the ReportAgent wrote the report) are escalated to the next quality tier of their
+    routes (e.g. gpt-4.1-nano -> gpt-4.1 -> o3) until one passes. Every retry starts from the conversation as
+    it was passed in, without the failed turn's tool calls and results.
+
+    Parameters:
+    history (ChatHistory): The conversation, ending with the user's plan name.
+    route (str): The router route of the orchestrator deployment.
+    orchestrators (dict[str, ChatCompletionAgent]): Cache of orchestrators per deployment, filled lazily.
+    router (ModelRouter): The router. Defaults to the process-wide router.
+    limiter (RateLimitManager): The rate limiter. Defaults to the process-wide limiter.
+
+    Returns:
+    (report_was_generated, content) (tuple[bool, str]): The final outcome.
+    """
+    router = router or get_router()
+    limiter = limiter or get_rate_limiter()
+    orchestrators = {} if orchestrators is None else orchestrators
+    deployment_name = router.select(route)
+    # The agent route's tier once escalated, and the conversation every attempt starts from
+    agent_tier = None
+    original = list(history.messages)
+    while True:
+        if deployment_name not in orchestrators:
+            orchestrators[deployment_name] = create_report_orchestrator(deployment_name, router, limiter=limiter)
+        agent = orchestrators[deployment_name]
+
+        async def invoke_orchestrator():
+            result = (False, "An unexpected response was received. Please try again")
+            # Invoke the Orchestrator Agent to generate the report based on the user's input
+            async for response in agent.invoke(history=history):
+                result = parse_report_response(response.content)
+            return result
+
+        # Trim the conversation to the deployment's context window; a request that cannot fit is rejected here
+        fit_history(history, deployment_name, ORCHESTRATOR_OUTPUT_TOKENS, REPORT_ORCHESTRATOR_INSTRUCTIONS)
+
+        with span("orchestrator turn", deployment=deployment_name), escalated("agent", agent_tier):
+            # The whole orchestrator turn, plugins included, is bounded by the orchestrator stage timeout.
+            # Its chat completion requests spend from the deployment's quota, are retried on their own after a 429
+            # and are tracked by the router one by one (see RateLimitedAzureChatCompletion).
+            report_was_generated, report_content = await with_timeout(invoke_orchestrator(), stage="orchestrator")
+
+        # The orchestrator answers with the report's handle; swap in the report itself
+        report_content = get_artifact_store().resolve(report_content)
+
+        if report_was_generated:
+            return report_was_generated, report_content
+
+        # Escalate to a stronger orchestrator, and stronger agents, when the report failed validation
+        next_deployment = router.escalate(route, deployment_name)
+        next_agent = router.escalate("agent", router.select("agent", min_tier=agent_tier))
+        if next_deployment is None and next_agent is None:
+            return report_was_generated, report_content
+        print(f"The report did not pass validation on {deployment_name}, escalating to "
+              f"{next_deployment or deployment_name} with agents on {next_agent or 'the same tier'}...")
+        deployment_name = next_deployment or deployment_name
+        if next_agent is not None:
+            agent_tier = router.deployments[next_agent].quality_tier
+        history.messages[:] = original
+
+
+def report_key(plan_name: str, route: str = "orchestrator", router: ModelRouter = None) -> tuple:
+    """
+    Returns the single-flight key of a report request: the canonical plan id plus the pipeline configuration.
+    """
+    router = router or get_router()
+    return (canonical_plan(plan_name).id, route, tuple(router.routes[route].candidates))
+
+
+async def generate_plan_report(plan_name: str, route: str = "orchestrator", orchestrators: dict = None,
+                               router: ModelRouter = None, limiter: RateLimitManager = None,
+                               flights: SingleFlight = None, speculative: bool = None) -> tuple:
+    """
+    Runs the report pipeline for one plan. Concurrent requests for the same plan and pipeline configuration
+    attach to the pipeline that is already running and all receive its result.
+
+    Parameters:
+    plan_name (str): The plan name as the user typed it.
+    route (str): The router route of the orchestrator deployment.
+    orchestrators (dict[str, ChatCompletionAgent]): Cache of orchestrators per deployment, filled lazily.
+    router (ModelRouter): The router. Defaults to the process-wide router.
+    limiter (RateLimitManager): The rate limiter. Defaults to the process-wide limiter.
+    flights (SingleFlight): The in-flight registry. Defaults to the process-wide report registry.
+    speculative (bool): Start the search for `plan_name` alongside the orchestrator's first turn. Defaults to SPECULATIVE_SEARCH.
+
+    Returns:
+    (report_was_generated, content) (tuple[bool, str]): The final outcome.
+    """
+    router = router or get_router()
+    flights = report_flights if flights is None else flights
+    speculative = speculative_search_enabled() if speculative is None else speculative
+    # Every spelling of a plan runs (and coalesces) as its canonical name, so the conversation and the searches are identical
+    plan_name = canonical_plan(plan_name).name
+
+    async def pipeline():
+        # Every plan gets its own conversation so the outcome only depends on the plan and the configuration
+        history = ChatHistory()
+        history.add_message(ChatMessageContent(role=AuthorRole.USER, content=plan_name))
+        # A local search answers in milliseconds, so there is nothing to gain from starting it early
+        speculate = speculative and search_backend() != "local"
+        # The pipeline's agent runs queue in the report class, unless the caller is a batch job.
+        # Other requests may join this pipeline, so the caller that started it going away does not cancel it;
+        # it is cancelled when the last caller waiting for it has gone (see single_flight.py).
+        with priority("report", only_if_unset=True), deadline_scope(detached=True):
+            if speculate:
+                # The orchestrator's first call is almost always a search for the plan the user typed, so start it now
+                search_prefetcher.start(plan_name, SearchAgent(router).prefetch, cost=slot_cost(plan_name))
+            try:
+                return await generate_report(history, route=route, orchestrators=orchestrators, router=router, limiter=limiter)
+            finally:
+                if speculate:
+                    search_prefetcher.finish(plan_name)
+
+    return await flights.run(report_key(plan_name, route, router), pipeline)
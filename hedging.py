@@ -0,0 +1,319 @@
+import os
+import time
+import asyncio
+import contextvars
+import threading
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from model_router import NoHealthyDeploymentError
+
+"""
+# Hedged requests and per-stage timeouts
+
+Tail latency control for agent runs and chat completions:
+
+- Every stage (search, report, validate, orchestrator turn, reasoning turn) has a timeout. A stage that
+  runs past it is cancelled and raises StageTimeoutError instead of stalling the whole report.
+- Deadlines propagate. Every timed scope (with_timeout, or deadline_scope for a whole request) sets a
+  Deadline in a context variable that follows the request into the agent plugins' worker threads. Each
+  agent run gets a share of the time that is left, split across the remaining pipeline stages in
+  proportion to their timeouts, and a stage whose share is below its minimum fails fast instead of
+  starting. When a scope times out or its caller goes away (Ctrl-C, a client disconnect, a cancelled
+  task), the deadline is cancelled and the runs in flight under it are cancelled on the service.
+- Hedging is opt-in. Once a call has been running longer than the configured latency percentile of its
+  deployment (as observed by the model router), a duplicate is sent to a second deployment of the same
+  route, or to the same deployment when the route has only one. Whichever finishes first wins and the
+  loser is cancelled.
+
+# .env examples
+
+```.env
+# Stage timeouts in seconds
+SEARCH_STAGE_TIMEOUT=120
+REPORT_STAGE_TIMEOUT=300
+VALIDATE_STAGE_TIMEOUT=120
+ORCHESTRATOR_STAGE_TIMEOUT=900
+REASONING_STAGE_TIMEOUT=300
+# Stages given less than this many seconds by the caller's deadline fail fast instead of starting
+SEARCH_STAGE_MIN=5
+REPORT_STAGE_MIN=20
+VALIDATE_STAGE_MIN=5
+
+# Send a hedge once a call is slower than the deployment's observed p90 (unset disables hedging)
+HEDGE_AFTER_PERCENTILE=0.9
+# Never hedge before this many seconds, so cold deployments with few samples are not duplicated
+HEDGE_MIN_DELAY=2
+```
+"""
+
+DEFAULT_STAGE_TIMEOUTS = {
+    "search": 120.0,
+    "report": 300.0,
+    "validate": 120.0,
+    "orchestrator": 900.0,
+    "reasoning": 300.0,
+}
+
+DEFAULT_STAGE_MINIMUMS = {
+    "search": 5.0,
+    "report": 20.0,
+    "validate": 5.0,
+}
+
+# The agent stages of a report, in the order the orchestrator calls them
+PIPELINE_STAGES = ("search", "report", "validate")
+
+
+class StageTimeoutError(TimeoutError):
+    """
+    Raised when a stage runs past its timeout. The stage has been cancelled when this is raised.
+    """
+    def __init__(self, stage: str, timeout: float):
+        super().__init__(f"The {stage} stage did not finish within {timeout:g} seconds")
+        self.stage = stage
+        self.timeout = timeout
+
+
+class RequestCancelledError(RuntimeError):
+    """
+    Raised inside a call that was cancelled: a hedged call that lost the race, or a call whose caller went away.
+    """
+
+
+class DeadlineExceededError(StageTimeoutError):
+    """
+    Raised before a stage starts when the caller's deadline leaves it too little time to finish.
+    """
+    def __init__(self, stage: str, remaining: float):
+        TimeoutError.__init__(self, f"Only {max(0.0, remaining):.1f} seconds were left for the {stage} stage, not starting it")
+        self.stage = stage
+        self.timeout = remaining
+
+
+class AnyEvent:
+    """
+    A read-only view over several threading.Events that is set as soon as any of them is. None entries are ignored.
+    """
+    def __init__(self, *events):
+        self.events = [event for event in events if event is not None]
+
+    def is_set(self) -> bool:
+        return any(event.is_set() for event in self.events)
+
+
+def stage_timeout(stage: str) -> float:
+    """
+    Returns the timeout in seconds for a stage, from <STAGE>_STAGE_TIMEOUT or the built-in default.
+    """
+    value = os.getenv(f"{stage.upper()}_STAGE_TIMEOUT")
+    return float(value) if value else DEFAULT_STAGE_TIMEOUTS.get(stage, 300.0)
+
+
+def stage_minimum(stage: str) -> float:
+    """
+    Returns the least time in seconds worth starting a stage with, from <STAGE>_STAGE_MIN or the built-in default.
+    """
+    value = os.getenv(f"{stage.upper()}_STAGE_MIN")
+    return float(value) if value else DEFAULT_STAGE_MINIMUMS.get(stage, 0.0)
+
+
+class Deadline:
+    """
+    A class to represent the time a request has left, and whether its caller has given up on it.
+    Like AnyEvent, it has is_set(), so it can be passed wherever a cancel_event is expected.
+    """
+    def __init__(self, timeout: float = None, parent: "Deadline" = None):
+        self.parent = parent
+        expires = None if timeout is None else time.monotonic() + timeout
+        if parent is not None and parent.expires is not None:
+            expires = parent.expires if expires is None else min(expires, parent.expires)
+        self.expires = expires
+        self.reason = None
+        self._cancelled = threading.Event()
+
+    def remaining(self) -> float:
+        return float("inf") if self.expires is None else self.expires - time.monotonic()
+
+    def cancel(self, reason: str = "cancelled"):
+        """
+        Cancels the deadline and every deadline derived from it; runs polling it are cancelled on the service.
+        """
+        self.reason = self.reason or reason
+        self._cancelled.set()
+
+    def is_set(self) -> bool:
+        return self._cancelled.is_set() or (self.parent is not None and self.parent.is_set())
+
+    def cancel_reason(self) -> str:
+        """
+        Returns why this deadline or the nearest enclosing one was cancelled, or None.
+        """
+        if self._cancelled.is_set():
+            return self.reason
+        return self.parent.cancel_reason() if self.parent is not None else None
+
+    def stage_budget(self, stage: str) -> float:
+        """
+        Returns the seconds `stage` may take: its timeout, or its share of the remaining time split across it
+        and the pipeline stages after it in proportion to their timeouts, whichever is smaller.
+        Raises DeadlineExceededError when that is less than the stage's minimum.
+        """
+        if self.is_set():
+            raise RequestCancelledError(f"The {stage} stage was not started: the request was {self.cancel_reason()}")
+        remaining = self.remaining()
+        stages = PIPELINE_STAGES[PIPELINE_STAGES.index(stage):] if stage in PIPELINE_STAGES else (stage,)
+        share = remaining * stage_timeout(stage) / sum(stage_timeout(s) for s in stages)
+        budget = min(stage_timeout(stage), share)
+        if budget < stage_minimum(stage):
+            raise DeadlineExceededError(stage, budget)
+        return budget
+
+
+_current_deadline = contextvars.ContextVar("current_deadline", default=None)
+
+
+def current_deadline() -> Deadline:
+    """
+    Returns the innermost deadline of the current request, or None outside any timed scope.
+    """
+    return _current_deadline.get()
+
+
+@contextmanager
+def deadline_scope(timeout: float = None, detached: bool = False):
+    """
+    Runs the enclosed block under a deadline `timeout` seconds from now (capped by any enclosing deadline).
+    If the block is left by an exception, e.g. a cancellation or KeyboardInterrupt, the deadline is cancelled
+    so work started under it on other threads stops too.
+
+    Parameters:
+    timeout (float): Seconds from now, or None for no limit of its own.
+    detached (bool): Keep the enclosing deadline's expiry but not its cancellation, for work shared with other callers.
+    """
+    parent = current_deadline()
+    if detached and parent is not None:
+        remaining = parent.remaining()
+        if remaining != float("inf"):
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        parent = None
+    deadline = Deadline(timeout, parent)
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    except BaseException as e:
+        deadline.cancel("timed out" if isinstance(e, (asyncio.TimeoutError, TimeoutError)) else "cancelled")
+        raise
+    finally:
+        _current_deadline.reset(token)
+
+
+def hedge_delay(router, deployment: str) -> float:
+    """
+    Returns how long to wait before hedging a call to `deployment`, or None when hedging is disabled.
+    """
+    percentile = os.getenv("HEDGE_AFTER_PERCENTILE")
+    if not percentile:
+        return None
+    return max(float(os.getenv("HEDGE_MIN_DELAY", "2")), router.latency_percentile(deployment, float(percentile)))
+
+
+def hedge_target(router, route: str, primary: str, exclude=()) -> str:
+    """
+    Picks where the hedge goes: another healthy deployment of the route if there is one, else the primary again.
+    """
+    try:
+        backup = router.select(route, exclude=[primary, *exclude])
+    except NoHealthyDeploymentError:
+        return primary
+    return backup if router.is_healthy(backup) else primary
+
+
+def hedged_call(primary, backup, hedge_after: float, accept=lambda result: True):
+    """
+    Runs `primary` and, if it has not finished after `hedge_after` seconds, also `backup`, each on its own thread.
+    Both are called with a threading.Event that is set when the other one has won, so they can cancel their
+    server-side work and raise RequestCancelledError.
+
+    Parameters:
+    primary (callable): Called as primary(cancel_event).
+    backup (callable): Called as backup(cancel_event).
+    hedge_after (float): Seconds to wait for the primary before sending the backup.
+    accept (callable): Returns False for results that should not win the race (e.g. a failed run).
+
+    Returns:
+    result: The first accepted result, or the primary's result / exception when neither was accepted.
+    """
+    events = {"primary": threading.Event(), "backup": threading.Event()}
+    executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="hedge")
+    try:
+        # Each attempt runs in a copy of the caller's context, so its trace spans nest under the caller's
+        futures = {executor.submit(contextvars.copy_context().run, primary, events["primary"]): "primary"}
+        done, _ = wait(futures, timeout=hedge_after)
+        primary_future = next(iter(futures))
+        if done and primary_future.exception() is None and accept(primary_future.result()):
+            return primary_future.result()
+
+        # The primary is slow (or already failed): send the duplicate
+        futures[executor.submit(contextvars.copy_context().run, backup, events["backup"])] = "backup"
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None and accept(future.result()):
+                    # Cancel the loser; it notices the event on its next poll
+                    for other, name in futures.items():
+                        if other is not future:
+                            events[name].set()
+                    return future.result()
+        # Neither attempt produced an acceptable result
+        return primary_future.result()
+    finally:
+        executor.shutdown(wait=False)
+
+
+async def hedged_async(primary, backup, hedge_after: float, accept=lambda result: True):
+    """
+    Async version of `hedged_call`. `primary` and `backup` are coroutine factories; the loser's task is cancelled.
+    """
+    primary_task = asyncio.ensure_future(primary())
+    done, _ = await asyncio.wait({primary_task}, timeout=hedge_after)
+    if done and primary_task.exception() is None and accept(primary_task.result()):
+        return primary_task.result()
+
+    # The primary is slow (or already failed): send the duplicate
+    tasks = [primary_task, asyncio.ensure_future(backup())]
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None and accept(task.result()):
+                    return task.result()
+        return primary_task.result()
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def with_timeout(awaitable, stage: str, timeout: float = None):
+    """
+    Awaits `awaitable`, cancelling it and raising StageTimeoutError if it runs past the stage's timeout or the
+    caller's deadline, whichever comes first. The awaitable runs under a deadline scope, so agent runs it starts
+    on worker threads are cancelled on the service when it times out or is cancelled.
+    """
+    timeout = stage_timeout(stage) if timeout is None else timeout
+    parent = current_deadline()
+    if parent is not None:
+        if parent.is_set():
+            raise RequestCancelledError(f"The {stage} stage was not started: the request was {parent.cancel_reason()}")
+        timeout = min(timeout, parent.remaining())
+        if timeout <= 0:
+            raise DeadlineExceededError(stage, timeout)
+    try:
+        # wait_for runs the awaitable as a task, which copies the context with the new deadline in it
+        with deadline_scope(timeout):
+            return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        raise StageTimeoutError(stage, timeout) from None
@@ -0,0 +1,234 @@
+import argparse
+import csv
+import hashlib
+import os
+import random
+import statistics
+import time
+from dataclasses import asdict, dataclass, fields
+
+from dotenv import load_dotenv
+
+from reasoning_budget import supports_reasoning_effort
+
+load_dotenv()
+
+"""
+# Model comparison benchmark
+
+Runs a fixed prompt set through both API surfaces the aoai_* samples use (chat completions and
+Responses) for every deployment and reasoning effort, with repetitions, and records per request:
+time to first token, total latency, input / output / reasoning tokens and output length. Results are
+written to a CSV file and summarized per (surface, deployment, effort).
+
+Requests are streamed so that time to first token can be measured. The stub backend simulates the
+service locally (latency grows with effort and output length, with jitter) so the harness can be run
+and tested offline.
+
+# Usage
+
+```zsh
+python model_benchmark.py --backend stub
+python model_benchmark.py --deployments gpt-4.1 o3 --efforts low medium high --repetitions 5 --output bench.csv
+```
+
+# .env examples
+
+```.env
+# The v1 endpoint used by get_openai_client() (see aoai_clients.py)
+AZURE_OPENAI_V1_API_ENDPOINT=https://*********.openai.azure.com/openai/v1/
+```
+"""
+
+SURFACES = ("chat", "responses")
+
+PROMPTS = {
+    "paris": "I am going to Paris, what should I see?",
+    "sky": "Why is the sky blue in one sentence?",
+    "plans": "Compare a health plan with a $1,500 deductible and $6,000 out-of-pocket limit to one with a $2,200 deductible "
+             "and $6,500 limit for someone expecting $4,000 of medical costs this year. Show the calculation.",
+}
+
+SYSTEM_PROMPT = "You are a helpful assistant."
+
+
+@dataclass
+class BenchmarkResult:
+    """
+    A class to represent the measurements of one benchmark request.
+    """
+    surface: str
+    deployment: str
+    effort: str
+    prompt: str
+    repetition: int
+    ttft: float = None
+    latency: float = None
+    input_tokens: int = None
+    output_tokens: int = None
+    reasoning_tokens: int = None
+    output_chars: int = 0
+    error: str = None
+
+
+class StubBackend:
+    """
+    A class to represent an offline stand-in for the service, with latencies shaped like the real models'.
+    """
+    # Seconds to first token and per output token, by effort ("" is a non-reasoning model)
+    FIRST_TOKEN = {"": 0.3, "low": 1.0, "medium": 2.5, "high": 6.0}
+    REASONING_TOKENS = {"": 0, "low": 150, "medium": 600, "high": 2000}
+    PER_TOKEN = 0.004
+
+    def __init__(self, scale: float = None, seed: int = 0):
+        # Real sleeps are scaled down so a full matrix runs in seconds
+        self.scale = float(os.getenv("BENCH_STUB_SCALE", "0.01")) if scale is None else scale
+        self.random = random.Random(seed)
+
+    def run(self, surface: str, deployment: str, effort: str, prompt: str) -> dict:
+        output_tokens = 40 + int(hashlib.sha256(f"{deployment}{prompt}".encode()).hexdigest(), 16) % 400
+        # Chat completions and Responses share the model, so only a small per-surface overhead differs
+        overhead = 0.05 if surface == "responses" else 0.0
+        ttft = (self.FIRST_TOKEN[effort] + overhead) * self.random.uniform(0.8, 1.3)
+        latency = ttft + output_tokens * self.PER_TOKEN * self.random.uniform(0.9, 1.2)
+        time.sleep(latency * self.scale)
+        return {"ttft": ttft, "latency": latency, "input_tokens": len(prompt) // 4 + 12, "output_tokens": output_tokens
+                + self.REASONING_TOKENS[effort], "reasoning_tokens": self.REASONING_TOKENS[effort], "output_chars": output_tokens * 4}
+
+
+class AzureBackend:
+    """
+    A class to represent the real service, reached through the shared v1 client from aoai_clients.py.
+    """
+    def __init__(self):
+        from aoai_clients import get_openai_client
+
+        self.client = get_openai_client()
+
+    def run(self, surface: str, deployment: str, effort: str, prompt: str) -> dict:
+        started = time.perf_counter()
+        ttft, chars, usage = None, 0, None
+        if surface == "chat":
+            kwargs = {"reasoning_effort": effort} if effort else {}
+            stream = self.client.chat.completions.create(
+                model=deployment, stream=True, stream_options={"include_usage": True},
+                messages=[{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}], **kwargs)
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                    ttft = ttft if ttft is not None else time.perf_counter() - started
+                    chars += len(chunk.choices[0].delta.content)
+                if chunk.usage:
+                    usage = chunk.usage
+            details = getattr(usage, "completion_tokens_details", None)
+            return {"ttft": ttft, "latency": time.perf_counter() - started,
+                    "input_tokens": getattr(usage, "prompt_tokens", None), "output_tokens": getattr(usage, "completion_tokens", None),
+                    "reasoning_tokens": getattr(details, "reasoning_tokens", None), "output_chars": chars}
+
+        kwargs = {"reasoning": {"effort": effort}} if effort else {}
+        stream = self.client.responses.create(
+            model=deployment, stream=True,
+            input=[{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}], **kwargs)
+        for event in stream:
+            if event.type == "response.output_text.delta":
+                ttft = ttft if ttft is not None else time.perf_counter() - started
+                chars += len(event.delta)
+            elif event.type == "response.completed":
+                usage = event.response.usage
+        details = getattr(usage, "output_tokens_details", None)
+        return {"ttft": ttft, "latency": time.perf_counter() - started,
+                "input_tokens": getattr(usage, "input_tokens", None), "output_tokens": getattr(usage, "output_tokens", None),
+                "reasoning_tokens": getattr(details, "reasoning_tokens", None), "output_chars": chars}
+
+
+def run_matrix(backend, surfaces, deployments, efforts, prompts: dict, repetitions: int) -> list:
+    """
+    Runs every combination of surface, deployment, effort and prompt `repetitions` times.
+    Efforts only apply to reasoning deployments; other deployments run once per prompt with no effort.
+
+    Returns:
+    results (list[BenchmarkResult]): One result per request, failed ones included.
+    """
+    results = []
+    for repetition in range(repetitions):
+        for surface in surfaces:
+            for deployment in deployments:
+                for effort in (efforts if supports_reasoning_effort(deployment) else [""]):
+                    for prompt_name, prompt in prompts.items():
+                        result = BenchmarkResult(surface, deployment, effort, prompt_name, repetition)
+                        try:
+                            for key, value in backend.run(surface, deployment, effort, prompt).items():
+                                setattr(result, key, value)
+                        except Exception as e:
+                            result.error = f"{e.__class__.__name__}: {e}"
+                        print(f"{surface:<9} {deployment:<14} {effort or '-':<6} {prompt_name:<6} #{repetition}  "
+                              + (result.error or f"ttft {result.ttft or 0:.2f}s  total {result.latency:.2f}s"))
+                        results.append(result)
+    return results
+
+
+def write_csv(results: list, path: str):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=[field.name for field in fields(BenchmarkResult)])
+        writer.writeheader()
+        for result in results:
+            writer.writerow(asdict(result))
+
+
+def _percentile(values: list, q: float):
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def _mean(values: list):
+    values = [v for v in values if v is not None]
+    return statistics.mean(values) if values else None
+
+
+def summarize(results: list) -> str:
+    """
+    Returns a table with one row per (surface, deployment, effort), fastest median latency first.
+    """
+    groups = {}
+    for result in results:
+        groups.setdefault((result.surface, result.deployment, result.effort), []).append(result)
+
+    def fmt(value, spec):
+        return "-" if value is None else format(value, spec)
+
+    rows = []
+    for (surface, deployment, effort), group in groups.items():
+        ok = [r for r in group if r.error is None]
+        rows.append((_percentile([r.latency for r in ok], 0.5) or float("inf"), (
+            f"{surface:<9} {deployment:<14} {effort or '-':<6} {len(ok):>3}/{len(group):<3} "
+            f"{fmt(_percentile([r.ttft for r in ok], 0.5), '>8.2f')} {fmt(_percentile([r.latency for r in ok], 0.5), '>8.2f')} "
+            f"{fmt(_percentile([r.latency for r in ok], 0.95), '>8.2f')} {fmt(_mean([r.input_tokens for r in ok]), '>7.0f')} "
+            f"{fmt(_mean([r.output_tokens for r in ok]), '>7.0f')} {fmt(_mean([r.reasoning_tokens for r in ok]), '>7.0f')} "
+            f"{fmt(_mean([r.output_chars for r in ok]), '>7.0f')}")))
+    header = (f"{'surface':<9} {'deployment':<14} {'effort':<6} {'ok':>7} {'ttft p50':>8} {'p50':>8} {'p95':>8} "
+              f"{'in tok':>7} {'out tok':>7} {'reason':>7} {'chars':>7}")
+    return "\n".join([header] + [row for _, row in sorted(rows, key=lambda row: row[0])])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark chat completions vs Responses across deployments and reasoning efforts")
+    parser.add_argument("--backend", choices=("azure", "stub"), default="azure")
+    parser.add_argument("--surfaces", nargs="+", choices=SURFACES, default=list(SURFACES))
+    parser.add_argument("--deployments", nargs="+", default=["gpt-4.1", "o3"])
+    parser.add_argument("--efforts", nargs="+", choices=("low", "medium", "high"), default=["low", "medium", "high"])
+    parser.add_argument("--prompts", nargs="+", choices=sorted(PROMPTS), default=sorted(PROMPTS))
+    parser.add_argument("--repetitions", type=int, default=3)
+    parser.add_argument("--output", default="benchmark_results.csv")
+    args = parser.parse_args()
+
+    backend = StubBackend() if args.backend == "stub" else AzureBackend()
+    results = run_matrix(backend, args.surfaces, args.deployments, args.efforts,
+                         {name: PROMPTS[name] for name in args.prompts}, args.repetitions)
+    write_csv(results, args.output)
+    print(f"\nWrote {len(results)} results to {args.output}\n")
+    print(summarize(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+import os
+import time
+import contextvars
+import threading
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+"""
+# Model router
+
+Picks a deployment per call instead of hard-coding "gpt-4.1-nano", "gpt-4o" or "o3" at every call site.
+Each call site asks for a named route (orchestrator, agent, reasoning, ...). A route has a list of
+candidate deployments, a minimum quality tier and a policy:
+
+- cheapest: the cheapest healthy deployment that meets the route's quality tier (default)
+- fastest: the healthy deployment with the lowest observed p95 latency that meets the tier
+
+Callers report every call back through `router.track(...)`. Those live latency samples drive the
+`fastest` policy, and errors / 429s temporarily take a deployment out of rotation so the router falls
+back to the next candidate. `router.escalate(...)` walks a route up the quality tiers, e.g. from
+gpt-4.1-nano to o3 after a report fails validation, and `escalated(...)` raises a route's tier for
+everything a block starts, e.g. the agent runs of an escalated orchestrator turn.
+
+# .env examples
+
+```.env
+# Comma separated candidates and policy for a route (route name upper-cased, '-' replaced by '_')
+ROUTE_ORCHESTRATOR_DEPLOYMENTS=gpt-4.1-nano,gpt-4.1,o3
+ROUTE_ORCHESTRATOR_POLICY=fastest
+ROUTE_AGENT_DEPLOYMENTS=gpt-4o,gpt-4.1
+```
+"""
+
+
+@dataclass(frozen=True)
+class Deployment:
+    """
+    A class to represent a model deployment the router can pick.
+
+    Attributes:
+    name (str): The deployment name sent to the service.
+    quality_tier (int): Relative capability, higher is better (1 = nano ... 4 = reasoning).
+    cost (float): Relative blended price per 1M tokens, only used for ordering.
+    max_concurrency (int): In-flight calls above this count mark the deployment as saturated.
+    """
+    name: str
+    quality_tier: int
+    cost: float
+    max_concurrency: int = 32
+
+
+@dataclass
+class Route:
+    """
+    A class to represent a routing policy for one call site.
+    """
+    candidates: list
+    min_tier: int = 1
+    policy: str = "cheapest"
+
+
+# Blended list prices (USD per 1M tokens, 1:3 input/output) are only used to order the candidates
+DEFAULT_DEPLOYMENTS = [
+    Deployment("gpt-4.1-nano", quality_tier=1, cost=0.33),
+    Deployment("gpt-4o", quality_tier=2, cost=8.13),
+    Deployment("gpt-4.1", quality_tier=3, cost=6.50),
+    Deployment("o3", quality_tier=4, cost=6.50, max_concurrency=16),
+]
+
+# The defaults reproduce the deployments the samples used before routing was added
+DEFAULT_ROUTES = {
+    "orchestrator": Route(candidates=["gpt-4.1-nano", "gpt-4.1", "o3"]),
+    "orchestrator-reasoning": Route(candidates=["o3"]),
+    "reasoning": Route(candidates=["o3"]),
+    "agent": Route(candidates=["gpt-4o"], min_tier=2),
+}
+
+POLICIES = ("cheapest", "fastest")
+
+
+class NoHealthyDeploymentError(RuntimeError):
+    """
+    Raised when every candidate of a route is erroring or saturated.
+    """
+
+
+@dataclass
+class _DeploymentStats:
+    latencies: deque = field(default_factory=lambda: deque(maxlen=200))
+    in_flight: int = 0
+    consecutive_errors: int = 0
+    unavailable_until: float = 0.0
+    calls: int = 0
+    errors: int = 0
+
+
+class _CallTracker:
+    """
+    Handed out by `ModelRouter.track`. Call `failed()` when the call returned an error status without raising.
+    """
+    def __init__(self, deployment: str):
+        self.deployment = deployment
+        self.ok = True
+        self.saturated = False
+        self.retry_after = None
+        self.is_cancelled = False
+
+    def failed(self, saturated: bool = False, retry_after: float = None):
+        self.ok = False
+        self.saturated = saturated
+        self.retry_after = retry_after
+
+    def cancelled(self):
+        # A call we abandoned ourselves (e.g. a hedge that lost) says nothing about the deployment's health
+        self.is_cancelled = True
+
+
+class ModelRouter:
+    """
+    A class to represent the latency / cost aware deployment router.
+    """
+    def __init__(self, deployments=None, routes=None, error_threshold: int = 3, cooldown: float = 30.0,
+                 default_latency: float = 5.0):
+        """
+        Parameters:
+        deployments (list[Deployment]): The known deployments. Defaults to DEFAULT_DEPLOYMENTS.
+        routes (dict[str, Route]): Named routes. Defaults to DEFAULT_ROUTES, overridable from the environment.
+        error_threshold (int): Consecutive errors before a deployment is taken out of rotation.
+        cooldown (float): Seconds a failing deployment stays out of rotation.
+        default_latency (float): Latency assumed for deployments that have not been observed yet.
+        """
+        self.deployments = {d.name: d for d in (deployments or DEFAULT_DEPLOYMENTS)}
+        self.routes = dict(routes or DEFAULT_ROUTES)
+        self.error_threshold = error_threshold
+        self.cooldown = cooldown
+        self.default_latency = default_latency
+        self._stats = {name: _DeploymentStats() for name in self.deployments}
+        self._lock = threading.Lock()
+        self._apply_env_overrides()
+
+    def _apply_env_overrides(self):
+        for route_name, route in list(self.routes.items()):
+            prefix = "ROUTE_" + route_name.upper().replace("-", "_")
+            candidates = os.getenv(f"{prefix}_DEPLOYMENTS")
+            policy = os.getenv(f"{prefix}_POLICY")
+            if candidates:
+                route = Route([c.strip() for c in candidates.split(",") if c.strip()], route.min_tier, route.policy)
+            if policy:
+                route = Route(route.candidates, route.min_tier, policy)
+            self.routes[route_name] = route
+        for route in self.routes.values():
+            if route.policy not in POLICIES:
+                raise ValueError(f"Unknown routing policy '{route.policy}', expected one of {POLICIES}")
+            for name in route.candidates:
+                # Deployments only named in the environment are treated as mid-tier with unknown cost
+                if name not in self.deployments:
+                    self.deployments[name] = Deployment(name, quality_tier=route.min_tier, cost=float("inf"))
+                    self._stats[name] = _DeploymentStats()
+
+    def latency_percentile(self, deployment: str, percentile: float) -> float:
+        """
+        Returns an observed latency percentile (0-1) in seconds, or the default latency if there are no samples yet.
+        """
+        with self._lock:
+            samples = sorted(self._stats[deployment].latencies)
+        if not samples:
+            return self.default_latency
+        return samples[min(len(samples) - 1, int(round(percentile * (len(samples) - 1))))]
+
+    def p95(self, deployment: str) -> float:
+        """
+        Returns the observed p95 latency in seconds, or the default latency if there are no samples yet.
+        """
+        return self.latency_percentile(deployment, 0.95)
+
+    def is_healthy(self, deployment: str) -> bool:
+        """
+        A deployment is healthy when it is not cooling down after errors / 429s and is under its concurrency cap.
+        """
+        stats = self._stats[deployment]
+        return (time.monotonic() >= stats.unavailable_until
+                and stats.in_flight < self.deployments[deployment].max_concurrency)
+
+    def _eligible(self, route: Route, min_tier: int, exclude) -> list:
+        return [self.deployments[name] for name in route.candidates
+                if self.deployments[name].quality_tier >= min_tier and name not in exclude]
+
+    def select(self, route_name: str, min_tier: int = None, exclude=()) -> str:
+        """
+        Picks the deployment for one call.
+
+        Parameters:
+        route_name (str): The route of the call site, e.g. "orchestrator" or "agent".
+        min_tier (int): Overrides the route's minimum quality tier. Defaults to the tier set by an enclosing `escalated`.
+        exclude (iterable[str]): Deployments that must not be picked, e.g. ones that already failed this request.
+
+        Returns:
+        deployment (str): The name of the deployment to call.
+        """
+        route = self.routes[route_name]
+        if min_tier is None:
+            min_tier = (_escalations.get() or {}).get(route_name)
+        eligible = self._eligible(route, route.min_tier if min_tier is None else min_tier, exclude)
+        if not eligible:
+            raise NoHealthyDeploymentError(f"No deployment of route '{route_name}' meets the requested tier")
+
+        if route.policy == "fastest":
+            ranked = sorted(eligible, key=lambda d: (self.p95(d.name), d.cost))
+        else:
+            ranked = sorted(eligible, key=lambda d: (d.cost, d.quality_tier))
+
+        for deployment in ranked:
+            if self.is_healthy(deployment.name):
+                return deployment.name
+
+        # Everything is degraded: pick whichever deployment comes back into rotation first rather than failing
+        return min(ranked, key=lambda d: self._stats[d.name].unavailable_until).name
+
+    def escalate(self, route_name: str, current: str) -> str:
+        """
+        Returns the cheapest healthy deployment of the route with a higher quality tier than `current`,
+        or None if `current` is already the top tier.
+        """
+        tier = self.deployments[current].quality_tier + 1
+        if not self._eligible(self.routes[route_name], tier, ()):
+            return None
+        return self.select(route_name, min_tier=tier)
+
+    @contextmanager
+    def track(self, deployment: str):
+        """
+        Records latency and outcome of one call. Exceptions raised inside the block count as errors.
+
+        with router.track(deployment) as call:
+            run = ...
+            if run.status == "failed":
+                call.failed()
+        """
+        call = _CallTracker(deployment)
+        with self._lock:
+            self._stats[deployment].in_flight += 1
+        start = time.monotonic()
+        try:
+            yield call
+        except BaseException:
+            if not call.is_cancelled:
+                call.failed()
+            raise
+        finally:
+            self._record(call, time.monotonic() - start)
+
+    def _record(self, call: _CallTracker, latency: float):
+        with self._lock:
+            stats = self._stats[call.deployment]
+            stats.in_flight -= 1
+            if call.is_cancelled:
+                return
+            stats.calls += 1
+            if call.ok:
+                stats.latencies.append(latency)
+                stats.consecutive_errors = 0
+                return
+            stats.errors += 1
+            stats.consecutive_errors += 1
+            now = time.monotonic()
+            if call.saturated:
+                stats.unavailable_until = now + (call.retry_after or self.cooldown)
+            elif stats.consecutive_errors >= self.error_threshold:
+                stats.unavailable_until = now + self.cooldown
+
+    def snapshot(self) -> dict:
+        """
+        Returns per-deployment call counts, error counts, p95 latency and health, e.g. for logging.
+        """
+        return {
+            name: {
+                "calls": stats.calls,
+                "errors": stats.errors,
+                "in_flight": stats.in_flight,
+                "p95": self.p95(name),
+                "healthy": self.is_healthy(name),
+            }
+            for name, stats in self._stats.items()
+        }
+
+
+_escalations = contextvars.ContextVar("route_escalations", default=None)
+
+
+@contextmanager
+def escalated(route_name: str, min_tier: int = None):
+    """
+    Runs the enclosed block (and everything it starts) with `route_name` raised to quality tier `min_tier`.
+    None leaves the route as it is.
+    """
+    if min_tier is None:
+        yield
+        return
+    token = _escalations.set({**(_escalations.get() or {}), route_name: min_tier})
+    try:
+        yield
+    finally:
+        _escalations.reset(token)
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> ModelRouter:
+    """
+    Returns the process-wide router, so every call site feeds and reads the same latency statistics.
+    """
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ModelRouter()
+        return _router
@@ -0,0 +1,385 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+
+from aiohttp import web
+from dotenv import load_dotenv
+from semantic_kernel.contents.chat_history import ChatHistory
+
+from agent_reaper import get_reaper
+from chat_store import ChatStore, discard_turn, get_chat_store
+from healthplan_agents import (
+    CHAT_INSTRUCTIONS,
+    CHAT_OUTPUT_TOKENS,
+    AgentRunError,
+    create_chat_agent,
+    generate_plan_report,
+    report_flights,
+    search_prefetcher,
+)
+from hedging import RequestCancelledError, StageTimeoutError, deadline_scope, with_timeout
+from model_router import get_router
+from plan_catalog import canonical_plan
+from rate_limiter import RateLimitExceededError, estimate_tokens, get_rate_limiter, is_rate_limit_error
+from request_scheduler import PRIORITY_CLASSES, get_scheduler, priority
+from token_budget import BudgetExceededError, fit_history
+
+load_dotenv()
+
+"""
+# Orchestrator HTTP service
+
+Serves the report orchestrator and the open-ended chat agent over HTTP instead of the input() loops in
+skmultiagent_reasoning.py. The kernels and agents are built once per deployment and shared by every
+request; each chat session keeps its own ChatHistory. All sessions are served concurrently on one event
+loop (the agent plugins run their blocking REST calls on worker threads), so several instances can sit
+behind a load balancer.
+
+Sessions are persisted in the chat store (chat_store.py). Only their recent messages are kept in memory,
+sessions idle for SESSION_IDLE_TIMEOUT are evicted from memory, and a request for an evicted session (or
+one created before a restart) resumes it from disk. Before every turn the session's message count on
+disk is compared with what its window was loaded from, and the window is reloaded if another instance
+sharing CHAT_STORE_DIR has added turns since. Turns are only serialized within one instance, though: two
+instances answering the same session at the same moment would both append, so route each session to one
+instance (e.g. sticky sessions on the load balancer).
+
+A client that disconnects cancels its request, and the agent runs started for it are cancelled on the
+service (unless another request is waiting for the same report). A report request can carry a timeout;
+stages that cannot finish within what is left of it are not started.
+
+Endpoints:
+
+- POST   /reports                     {"plan_name": "...", "priority": "report"|"batch", "timeout": seconds}
+                                                            -> {"report_was_generated": ..., "content": ...}
+- POST   /sessions                                          -> {"session_id": "..."}
+- POST   /sessions/{session_id}/messages {"content": "..."} -> {"content": "..."}
+         add ?stream=true (or Accept: text/event-stream) for server-sent events, one `data:` per chunk
+- GET    /sessions/{session_id}/messages?start=0&end=50     -> {"messages": [{"role": ..., "content": ...}], "total": ...}
+- DELETE /sessions/{session_id}
+- GET    /healthz                                           -> router, session and cleanup statistics
+
+# .env examples
+
+```.env
+SERVICE_HOST=0.0.0.0
+SERVICE_PORT=8080
+# Idle chat sessions are evicted from memory after this many seconds (they stay in the chat store)
+SESSION_IDLE_TIMEOUT=3600
+```
+
+Run with `python orchestrator_service.py`.
+"""
+
+
+class ChatSession:
+    """
+    A class to represent one chat session: its history (the active window), plus a lock so its turns run one at a time.
+    """
+    def __init__(self, session_id: str, history: ChatHistory = None):
+        self.session_id = session_id
+        self.history = history or ChatHistory()
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+        # The number of messages in the chat store that the history reflects, and whether the session was deleted
+        self.stored = 0
+        self.deleted = False
+
+
+class OrchestratorService:
+    """
+    A class to represent the long-running orchestrator service and its shared agents.
+    """
+    def __init__(self, idle_timeout: float = None, chat_store: ChatStore = None):
+        self.router = get_router()
+        self.limiter = get_rate_limiter()
+        self.scheduler = get_scheduler()
+        self.idle_timeout = float(os.getenv("SESSION_IDLE_TIMEOUT", "3600")) if idle_timeout is None else idle_timeout
+        self.chat_store = chat_store or get_chat_store()
+        self.sessions_resumed = 0
+        # Built lazily once per deployment and reused by every request
+        self.report_orchestrators = {}
+        self.chat_agents = {}
+        self.sessions = {}
+
+    def chat_agent(self, deployment_name: str):
+        if deployment_name not in self.chat_agents:
+            self.chat_agents[deployment_name] = create_chat_agent(deployment_name)
+        return self.chat_agents[deployment_name]
+
+    def get_session(self, session_id: str) -> ChatSession:
+        session = self.sessions.get(session_id)
+        if session is None:
+            if not self.chat_store.exists(session_id):
+                raise web.HTTPNotFound(text=json.dumps({"error": f"Unknown session {session_id}"}), content_type="application/json")
+            # Evicted or created by another instance: its active window is loaded from the chat store by sync_session
+            session = ChatSession(session_id)
+            self.sessions[session_id] = session
+            self.sessions_resumed += 1
+        session.last_used = time.monotonic()
+        return session
+
+    async def sync_session(self, session: ChatSession):
+        """
+        Reloads the session's active window from the chat store if the store holds messages the history does not,
+        i.e. the session was just resumed or another instance has answered it since. Called with the session's lock held.
+        """
+        stored = await asyncio.to_thread(self.chat_store.count, session.session_id)
+        if stored != session.stored:
+            history = ChatHistory()
+            session.stored = await asyncio.to_thread(self.chat_store.load, session.session_id, history)
+            session.history = history
+
+    async def commit_turn(self, session: ChatSession, user_message):
+        """
+        Persists a turn that succeeded, unless the session was deleted while it ran. Called with the session's lock held.
+        """
+        if session.deleted:
+            return
+        try:
+            # Appending parses the active segment and may compress it, so it stays off the event loop
+            session.stored = await asyncio.to_thread(self.chat_store.commit_turn, session.session_id, session.history,
+                                                     user_message, create=False)
+        except FileNotFoundError:
+            # Deleted by another instance; the reply is still returned, but nothing brings the session back
+            session.deleted = True
+            self.sessions.pop(session.session_id, None)
+
+    async def sweep_idle_sessions(self):
+        """
+        Periodically evicts sessions that have been idle for longer than the idle timeout from memory,
+        and deletes sessions past the chat store's retention from disk.
+        """
+        while True:
+            await asyncio.sleep(min(60.0, self.idle_timeout))
+            cutoff = time.monotonic() - self.idle_timeout
+            for session_id in [s.session_id for s in self.sessions.values() if s.last_used < cutoff and not s.lock.locked()]:
+                self.sessions.pop(session_id, None)
+            await asyncio.to_thread(self.chat_store.expire)
+
+    # Handlers
+
+    async def create_report(self, request: web.Request) -> web.Response:
+        try:
+            body = await request.json()
+        except ValueError:
+            body = None
+        if not isinstance(body, dict):
+            raise web.HTTPBadRequest(text=json.dumps({"error": "The body must be a JSON object"}), content_type="application/json")
+        plan_name = str(body.get("plan_name") or "").strip()
+        if not plan_name:
+            raise web.HTTPBadRequest(text=json.dumps({"error": "plan_name is required"}), content_type="application/json")
+        try:
+            # Names without letters or digits, e.g. "!!!", name no plan
+            canonical_plan(plan_name)
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=json.dumps({"error": str(e)}), content_type="application/json")
+        request_priority = body.get("priority", "report")
+        if request_priority not in PRIORITY_CLASSES:
+            raise web.HTTPBadRequest(text=json.dumps({"error": f"priority must be one of {', '.join(PRIORITY_CLASSES)}"}),
+                                     content_type="application/json")
+        route = body.get("route", "orchestrator")
+        if not isinstance(route, str) or route not in self.router.routes:
+            raise web.HTTPBadRequest(text=json.dumps({"error": f"route must be one of {', '.join(self.router.routes)}"}),
+                                     content_type="application/json")
+        timeout = body.get("timeout")
+        try:
+            timeout = float(timeout) if timeout else None
+            valid = timeout is None or timeout > 0
+        except (TypeError, ValueError):
+            valid = False
+        if not valid:
+            raise web.HTTPBadRequest(text=json.dumps({"error": "timeout must be a positive number of seconds"}),
+                                     content_type="application/json")
+        try:
+            # Callers regenerating reports in the background can ask for the batch class
+            with priority(request_priority), deadline_scope(timeout):
+                report_was_generated, content = await generate_plan_report(
+                    plan_name, route=route, orchestrators=self.report_orchestrators, router=self.router, limiter=self.limiter)
+        except (StageTimeoutError, RequestCancelledError) as e:
+            raise web.HTTPGatewayTimeout(text=json.dumps({"error": str(e)}), content_type="application/json")
+        except BudgetExceededError as e:
+            raise web.HTTPRequestEntityTooLarge(max_size=e.context_tokens, actual_size=e.prompt_tokens,
+                                                text=json.dumps({"error": str(e)}), content_type="application/json")
+        except AgentRunError as e:
+            # Every deployment the agents were tried on failed
+            raise web.HTTPBadGateway(text=json.dumps({"error": str(e)}), content_type="application/json")
+        except Exception as e:
+            # Still rate limited after all retries, in an agent run or in the orchestrator's own requests
+            if isinstance(e, RateLimitExceededError) or is_rate_limit_error(e):
+                raise web.HTTPServiceUnavailable(text=json.dumps({"error": str(e)}), content_type="application/json")
+            raise
+        return web.json_response({"report_was_generated": report_was_generated, "content": content})
+
+    async def create_session(self, request: web.Request) -> web.Response:
+        session = ChatSession(uuid.uuid4().hex)
+        self.chat_store.create(session.session_id)
+        self.sessions[session.session_id] = session
+        return web.json_response({"session_id": session.session_id}, status=201)
+
+    async def delete_session(self, request: web.Request) -> web.Response:
+        session = self.sessions.pop(request.match_info["session_id"], None)
+        if session is not None:
+            # A turn still running must not write the session back to disk when it finishes
+            session.deleted = True
+        await asyncio.to_thread(self.chat_store.delete, request.match_info["session_id"])
+        return web.Response(status=204)
+
+    async def get_messages(self, request: web.Request) -> web.Response:
+        session_id = request.match_info["session_id"]
+        if not self.chat_store.exists(session_id):
+            raise web.HTTPNotFound(text=json.dumps({"error": f"Unknown session {session_id}"}), content_type="application/json")
+        try:
+            start = int(request.query.get("start", "0"))
+            end = int(request.query["end"]) if "end" in request.query else None
+        except ValueError:
+            raise web.HTTPBadRequest(text=json.dumps({"error": "start and end must be integers"}), content_type="application/json")
+        # Only the segments holding the requested range are read, so old transcripts can be paged through cheaply
+        total, messages = await asyncio.to_thread(
+            lambda: (self.chat_store.count(session_id), self.chat_store.read(session_id, start, end)))
+        return web.json_response({
+            "messages": [{"role": str(getattr(m.role, "value", m.role)), "content": str(m.content or "")} for m in messages],
+            "total": total,
+        })
+
+    async def post_message(self, request: web.Request) -> web.StreamResponse:
+        session = self.get_session(request.match_info["session_id"])
+        body = await request.json()
+        content = (body.get("content") or "").strip()
+        if not content:
+            raise web.HTTPBadRequest(text=json.dumps({"error": "content is required"}), content_type="application/json")
+        stream = request.query.get("stream", "").lower() in ("1", "true") or "text/event-stream" in request.headers.get("Accept", "")
+
+        async with session.lock:
+            await self.sync_session(session)
+            session.history.add_user_message(content)
+            user_message = session.history.messages[-1]
+            # Until the turn is committed, any failure (a timeout, a cancelled request, rate limits, the budget, the
+            # model's own errors) removes the question and whatever the turn added, so it is not sent twice next time
+            settled = False
+            try:
+                deployment_name = self.router.select("orchestrator")
+                agent = self.chat_agent(deployment_name)
+                try:
+                    fit_history(session.history, deployment_name, CHAT_OUTPUT_TOKENS, CHAT_INSTRUCTIONS)
+                except BudgetExceededError as e:
+                    raise web.HTTPRequestEntityTooLarge(max_size=e.context_tokens, actual_size=e.prompt_tokens,
+                                                        text=json.dumps({"error": str(e)}), content_type="application/json")
+                estimated = estimate_tokens(*(message.content for message in session.history.messages), max_output_tokens=CHAT_OUTPUT_TOKENS)
+                if stream:
+                    # The streaming reply commits or discards the turn itself
+                    settled = True
+                    return await self._stream_reply(request, session, agent, deployment_name, estimated, user_message)
+
+                async def reply():
+                    # A retried attempt starts over from the user's message
+                    discard_turn(session.history, user_message, keep_first=True)
+                    replies = []
+                    async for response in agent.invoke(history=session.history):
+                        session.history.add_message(response)
+                        replies.append(str(response.content))
+                    return "".join(replies)
+
+                try:
+                    async with self.scheduler.slot_async("interactive", cost=estimated / 1000):
+                        with self.router.track(deployment_name):
+                            text = await with_timeout(self.limiter.call_async(deployment_name, estimated, reply), stage="orchestrator")
+                except (StageTimeoutError, RequestCancelledError) as e:
+                    raise web.HTTPGatewayTimeout(text=json.dumps({"error": str(e)}), content_type="application/json")
+                await self.commit_turn(session, user_message)
+                settled = True
+                return web.json_response({"content": text, "deployment": deployment_name})
+            finally:
+                if not settled:
+                    discard_turn(session.history, user_message)
+
+    async def _stream_reply(self, request, session: ChatSession, agent, deployment_name: str, estimated: int, user_message):
+        chunks = []
+        committed = False
+        try:
+            response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+            await response.prepare(request)
+
+            async def stream():
+                # A retried attempt starts over from the user's message
+                discard_turn(session.history, user_message, keep_first=True)
+                try:
+                    async for chunk in agent.invoke_stream(history=session.history):
+                        if chunk.content:
+                            chunks.append(str(chunk.content))
+                            await response.write(f"data: {json.dumps({'content': str(chunk.content)})}\n\n".encode())
+                except Exception as e:
+                    if chunks and is_rate_limit_error(e):
+                        # Part of the reply has already reached the client, so the turn cannot be started over
+                        raise RuntimeError(f"The reply was interrupted: {e}") from None
+                    raise
+
+            try:
+                async with self.scheduler.slot_async("interactive", cost=estimated / 1000):
+                    with self.router.track(deployment_name):
+                        # Bounded and retried like the non-streaming reply; 429s arrive before the first chunk
+                        await with_timeout(self.limiter.call_async(deployment_name, estimated, stream), stage="orchestrator")
+            except Exception as e:
+                # The chunks sent so far are not a complete answer, so the turn is discarded
+                await response.write(f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n".encode())
+            else:
+                if chunks:
+                    # ChatCompletionAgent.invoke_stream appends the assembled reply to the history itself (SK 1.19);
+                    # it is only added here for versions that do not, so it is never stored twice
+                    last = session.history.messages[-1]
+                    if last is user_message or str(getattr(last.role, "value", last.role)).lower() != "assistant":
+                        session.history.add_assistant_message("".join(chunks))
+                    await self.commit_turn(session, user_message)
+                    committed = True
+            await response.write(f"event: done\ndata: {json.dumps({'deployment': deployment_name})}\n\n".encode())
+            await response.write_eof()
+            return response
+        finally:
+            if not committed:
+                discard_turn(session.history, user_message)
+
+    async def healthz(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "sessions": len(self.sessions),
+            "sessions_resumed": self.sessions_resumed,
+            "reports_in_flight": report_flights.in_flight(),
+            "reports_coalesced": report_flights.coalesced,
+            "speculative_searches": search_prefetcher.stats(),
+            "deployments": self.router.snapshot(),
+            "scheduler": self.scheduler.snapshot(),
+            "cleanup": get_reaper().stats(),
+        })
+
+    # App wiring
+
+    async def _start_background_tasks(self, app: web.Application):
+        app["session_sweeper"] = asyncio.create_task(self.sweep_idle_sessions())
+
+    async def _stop_background_tasks(self, app: web.Application):
+        app["session_sweeper"].cancel()
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.add_routes([
+            web.post("/reports", self.create_report),
+            web.post("/sessions", self.create_session),
+            web.delete("/sessions/{session_id}", self.delete_session),
+            web.post("/sessions/{session_id}/messages", self.post_message),
+            web.get("/sessions/{session_id}/messages", self.get_messages),
+            web.get("/healthz", self.healthz),
+        ])
+        app.on_startup.append(self._start_background_tasks)
+        app.on_cleanup.append(self._stop_background_tasks)
+        return app
+
+
+def main():
+    service = OrchestratorService()
+    # Cancel a request's handler when its client disconnects, so its deadline (and agent runs) are cancelled too
+    web.run_app(service.create_app(), host=os.getenv("SERVICE_HOST", "0.0.0.0"), port=int(os.getenv("SERVICE_PORT", "8080")),
+                handler_cancellation=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+import argparse
+import difflib
+import json
+import os
+import re
+import string
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from dotenv import load_dotenv
+
+from single_flight import normalize_plan_name
+
+load_dotenv()
+
+"""
+# Plan catalog
+
+Users type the same plan many ways: "northwind standard", "Northwind Standard plan", "NW Standard",
+"Northwind Standrad". The catalog maps every spelling to one canonical plan before anything runs, and
+the canonical id and name are what the report pipeline, the search cache, the speculative prefetch,
+the batch and section map files, and the saved `<plan> Report.md` use. Requests for the same plan
+then share one search, one pipeline and one report file however they were typed.
+
+Matching, in order:
+
+1. the input is normalized (case, punctuation, whitespace) and filler words such as a trailing
+   "plan", "health plan" or "insurance policy" are dropped
+2. an exact match on a plan's name or one of its aliases wins
+3. otherwise the names sharing the most character trigrams are scored by edit-distance similarity. The
+   best one is accepted if it scores at least PLAN_MATCH_THRESHOLD, clearly beats the runner-up, and
+   every word of the input is a typo, abbreviation or exact match of one of its words, so "Northwind
+   Health Basic" never becomes "Northwind Health Plus". An input that leaves out words of the name, such
+   as "Northwind Health", must beat every other plan by PREFIX_AMBIGUITY_MARGIN, even plans it does not
+   fully match, since the missing words may be the ones that tell the plans apart
+
+Input with no letters or digits, such as "!!!", names no plan and raises ValueError.
+
+A name that matches nothing gets an id derived from its normalized form, so the same spelling always maps
+to the same id. Such names are only remembered (so later misspellings of them match too) when the caller
+trusts its input and asks for it with `learn=True`, as the batch and job queue CLIs do for the plans an
+operator lists; names from service requests and chats are never learned. At most PLAN_CATALOG_MAX_LEARNED
+names are remembered, and the least recently used one is forgotten first.
+
+The catalog starts with the plans in the sample documents. PLAN_CATALOG points at a JSON file with more:
+
+```json
+[{"id": "contoso-gold", "name": "Contoso Gold", "aliases": ["Contoso Gold PPO"]}]
+```
+
+# Usage
+
+```zsh
+python plan_catalog.py match "NW Standard" "northwind health plus plan"
+python plan_catalog.py list
+```
+
+# .env examples
+
+```.env
+PLAN_CATALOG=plan_catalog.json
+PLAN_MATCH_THRESHOLD=0.8
+PLAN_CATALOG_MAX_LEARNED=256
+```
+"""
+
+DEFAULT_PLANS = [
+    {"id": "northwind-standard", "name": "Northwind Standard", "aliases": ["NW Standard", "Northwind Std"]},
+    {"id": "northwind-health-plus", "name": "Northwind Health Plus", "aliases": ["NW Health Plus", "Northwind Plus", "NW Plus"]},
+]
+
+# Words around a plan name that do not tell plans apart
+FILLER_PATTERN = re.compile(r"^(the\s+)+|(\s+(health\s+)?(insurance\s+)?(plan|policy|report))+$")
+
+# The best fuzzy match must beat the runner-up (a different plan) by this much
+AMBIGUITY_MARGIN = 0.05
+# ... and by this much when the input leaves out words of the matched name
+PREFIX_AMBIGUITY_MARGIN = 0.15
+
+
+@dataclass
+class PlanMatch:
+    """
+    A class to represent the canonical plan a raw plan name was mapped to.
+    """
+    id: str
+    name: str
+    score: float
+    # False for names that are not in the catalog (unknown, or only learned from earlier input)
+    known: bool
+
+
+def plan_key(plan_name: str) -> str:
+    """
+    Normalizes a plan name and drops filler words, e.g. "The Northwind Standard Plan" -> "northwind standard".
+    """
+    key = normalize_plan_name(plan_name)
+    return FILLER_PATTERN.sub("", key).strip() or key
+
+
+def _plan_id(key: str) -> str:
+    return re.sub(r"\W+", "-", key).strip("-")
+
+
+def trigrams(key: str) -> set:
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _similarity(a: str, b: str) -> float:
+    return difflib.SequenceMatcher(None, a, b).ratio()
+
+
+def _words_match(key: str, candidate: str) -> bool:
+    # Every word of the input must be a typo or an abbreviation (prefix) of some word of the candidate
+    words = candidate.split()
+    return all(any(word == other or (len(word) >= 3 and other.startswith(word)) or _similarity(word, other) >= 0.75
+                   for other in words)
+               for word in key.split())
+
+
+class PlanCatalog:
+    """
+    A class to represent the catalog of known plans, with an exact index of names and aliases and a trigram index for fuzzy matching.
+    """
+    def __init__(self, plans: list = None, path: str = None, threshold: float = None, max_learned: int = None):
+        """
+        Parameters:
+        plans (list[dict]): Plans as {"id", "name", "aliases"}. Defaults to DEFAULT_PLANS plus the PLAN_CATALOG file.
+        path (str): A JSON file with more plans. Defaults to PLAN_CATALOG.
+        threshold (float): The least similarity for a fuzzy match. Defaults to PLAN_MATCH_THRESHOLD or 0.8.
+        max_learned (int): Names learned from input kept at most. Defaults to PLAN_CATALOG_MAX_LEARNED or 256.
+        """
+        self.threshold = float(os.getenv("PLAN_MATCH_THRESHOLD", "0.8")) if threshold is None else threshold
+        self.max_learned = int(os.getenv("PLAN_CATALOG_MAX_LEARNED", "256")) if max_learned is None else max_learned
+        # Canonical id -> display name, and every known key (names and aliases) -> canonical id
+        self.plans = {}
+        self.keys = {}
+        # Learned plan ids in least recently used order
+        self.learned = OrderedDict()
+        self._trigrams = {}
+        self._lock = threading.Lock()
+        if plans is None:
+            plans = list(DEFAULT_PLANS)
+            path = path or os.getenv("PLAN_CATALOG")
+            if path and os.path.exists(path):
+                with open(path, encoding="utf-8") as f:
+                    plans += json.load(f)
+        for plan in plans:
+            self.add(plan.get("id"), plan["name"], plan.get("aliases", ()))
+
+    def add(self, plan_id: str, name: str, aliases=()) -> str:
+        """
+        Adds a plan (or more aliases of a plan already in the catalog) and returns its id.
+        """
+        plan_id = plan_id or _plan_id(plan_key(name))
+        with self._lock:
+            self.plans.setdefault(plan_id, name)
+            for alias in (name, *aliases):
+                key = plan_key(alias)
+                self.keys[key] = plan_id
+                for trigram in trigrams(key):
+                    self._trigrams.setdefault(trigram, set()).add(key)
+        return plan_id
+
+    def match(self, plan_name: str, learn: bool = False) -> PlanMatch:
+        """
+        Maps a raw plan name to its canonical plan.
+
+        Parameters:
+        plan_name (str): The name as it was typed.
+        learn (bool): Remember a name that matches nothing, so later misspellings of it match too. Only for trusted input.
+
+        Raises ValueError when the name has no letters or digits.
+        """
+        key = plan_key(plan_name)
+        if not key:
+            raise ValueError(f"{plan_name!r} is not a plan name")
+        with self._lock:
+            plan_id = self.keys.get(key)
+            if plan_id is None:
+                plan_id, score = self._fuzzy(key) or (None, 1.0)
+            else:
+                score = 1.0
+            if plan_id is not None:
+                if plan_id in self.learned:
+                    self.learned.move_to_end(plan_id)
+                return PlanMatch(plan_id, self.plans[plan_id], score, plan_id not in self.learned)
+
+        # An unknown plan: its id comes from its normalized name, so the same spelling always gets the same id
+        name = string.capwords(key)
+        if not learn:
+            return PlanMatch(_plan_id(key), name, 1.0, False)
+        plan_id = self.add(None, name)
+        with self._lock:
+            self.learned[plan_id] = True
+            while len(self.learned) > self.max_learned:
+                self._forget(self.learned.popitem(last=False)[0])
+        return PlanMatch(plan_id, self.plans[plan_id], 1.0, False)
+
+    def _forget(self, plan_id: str):
+        # Called with the lock held; removes a learned plan and its keys from both indexes
+        self.plans.pop(plan_id, None)
+        for key in [key for key, other in self.keys.items() if other == plan_id]:
+            del self.keys[key]
+            for trigram in trigrams(key):
+                candidates = self._trigrams.get(trigram)
+                if candidates is not None:
+                    candidates.discard(key)
+                    if not candidates:
+                        del self._trigrams[trigram]
+
+    def _fuzzy(self, key: str):
+        # Called with the lock held. The trigram index narrows the catalog to the names worth an edit-distance comparison.
+        query = trigrams(key)
+        shared = {}
+        for trigram in query:
+            for candidate in self._trigrams.get(trigram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+        candidates = sorted(shared, key=lambda c: -shared[c])[:20]
+        # The best name per plan among those the input matches word for word, and the best similarity per plan among all
+        best_by_plan = {}
+        nearest_by_plan = {}
+        for candidate in candidates:
+            score = _similarity(key, candidate)
+            plan_id = self.keys[candidate]
+            nearest_by_plan[plan_id] = max(score, nearest_by_plan.get(plan_id, 0.0))
+            if _words_match(key, candidate) and score > best_by_plan.get(plan_id, (0.0, None))[0]:
+                best_by_plan[plan_id] = (score, candidate)
+        ranked = sorted(best_by_plan.items(), key=lambda item: -item[1][0])
+        if not ranked or ranked[0][1][0] < self.threshold:
+            return None
+        plan_id, (score, candidate) = ranked[0]
+        if len(ranked) > 1 and score - ranked[1][1][0] < AMBIGUITY_MARGIN:
+            return None
+        if not _words_match(candidate, key):
+            # The input leaves out words of the name ("Northwind Health" for "Northwind Health Plus"), so any other plan
+            # close to it, even one it does not match word for word, may be the one that was meant
+            runner_up = max((other_score for other, other_score in nearest_by_plan.items() if other != plan_id), default=0.0)
+            if score - runner_up < PREFIX_AMBIGUITY_MARGIN:
+                return None
+        return plan_id, score
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_plan_catalog() -> PlanCatalog:
+    """
+    Returns the process-wide plan catalog.
+    """
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = PlanCatalog()
+        return _catalog
+
+
+def canonical_plan(plan_name: str, learn: bool = False) -> PlanMatch:
+    """
+    Maps a raw plan name to its canonical plan in the process-wide catalog. See PlanCatalog.match for `learn`.
+    """
+    return get_plan_catalog().match(plan_name, learn)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Map plan names to canonical plans")
+    commands = parser.add_subparsers(dest="command", required=True)
+    match = commands.add_parser("match", help="Show the canonical plan of each name")
+    match.add_argument("plan_names", nargs="+")
+    commands.add_parser("list", help="List the catalog")
+    args = parser.parse_args()
+
+    catalog = get_plan_catalog()
+    if args.command == "match":
+        for plan_name in args.plan_names:
+            plan = catalog.match(plan_name)
+            print(f"{plan_name!r:40} -> {plan.id:<28} {plan.name!r}  score={plan.score:.2f}{'' if plan.known else '  (not in the catalog)'}")
+    else:
+        for plan_id, name in catalog.plans.items():
+            aliases = sorted(key for key, other in catalog.keys.items() if other == plan_id and key != plan_key(name))
+            print(f"{plan_id:<28} {name}  aliases: {', '.join(aliases) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
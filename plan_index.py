@@ -0,0 +1,296 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+
+import numpy as np
+from dotenv import load_dotenv
+from semantic_kernel.functions import kernel_function
+
+from artifact_store import ArtifactStore, get_artifact_store
+
+load_dotenv()
+
+"""
+# Local plan document index
+
+An offline alternative to the SearchAgent, which wraps a whole gpt-4o agent around the remote
+`healthplan-index` Azure AI Search index just to retrieve plan facts.
+
+`python plan_index.py build <docs_dir>` chunks the local plan documents (.md, .txt, and .pdf when pypdf is
+installed) into overlapping passages and writes a compact on-disk index:
+
+- chunks.jsonl   the passages and where they came from
+- bm25.json      an inverted index (term -> chunk ids and term frequencies) plus document lengths
+- dense.npy      a float32 matrix of L2-normalized hashed TF-IDF vectors, one row per chunk, memory-mapped at load
+
+LocalSearchAgent exposes the same `search_plan_docs` function as SearchAgent. It ranks passages with
+BM25 and dense similarity, fuses the two rankings, and answers in milliseconds without network access.
+Select it with SEARCH_BACKEND=local; the remote agent stays the default.
+
+# .env examples
+
+```.env
+SEARCH_BACKEND=local
+PLAN_INDEX_DIR=plan_index
+```
+"""
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:['-][a-z0-9]+)*")
+STOPWORDS = frozenset("a an and are as at be by for from has have in is it its of on or that the this to was were will with".split())
+
+# Hashed feature space of the dense vectors
+DENSE_DIMENSIONS = 1024
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Reciprocal rank fusion constant
+RRF_K = 60
+
+
+def tokenize(text: str) -> list:
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def read_document(path: str) -> str:
+    """
+    Returns the text of a plan document. PDFs need the optional pypdf package.
+    """
+    if path.lower().endswith(".pdf"):
+        from pypdf import PdfReader
+
+        return "\n\n".join(page.extract_text() or "" for page in PdfReader(path).pages)
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def chunk_text(text: str, max_chars: int = 1200, overlap: int = 200) -> list:
+    """
+    Splits a document into passages of up to `max_chars`, breaking on paragraph boundaries where possible.
+    Consecutive passages share up to `overlap` characters so facts split across a boundary stay findable.
+    `overlap` must be less than half of `max_chars`, so every window moves the text forward.
+    """
+    if max_chars < 2 or not 0 <= overlap < max_chars // 2:
+        raise ValueError(f"Invalid chunking: max_chars={max_chars}, overlap={overlap}; need 0 <= overlap < max_chars // 2")
+    paragraphs = [p.strip() for p in re.split(r"\n\s*\n", text) if p.strip()]
+    chunks, current = [], ""
+    for paragraph in paragraphs:
+        # Paragraphs longer than a whole chunk are cut into windows
+        while len(paragraph) > max_chars:
+            cut = paragraph.rfind(" ", 0, max_chars)
+            cut = cut if cut > max_chars // 2 else max_chars
+            chunks.extend([current] if current else [])
+            current = ""
+            chunks.append(paragraph[:cut].strip())
+            # Always move forward by at least one character, even if a short cut leaves less than the overlap
+            paragraph = paragraph[max(1, cut - overlap):].strip()
+        if current and len(current) + len(paragraph) + 2 > max_chars:
+            chunks.append(current)
+            current = current[-overlap:].lstrip() if overlap else ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _feature(term: str) -> int:
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=4).digest(), "little") % DENSE_DIMENSIONS
+
+
+def dense_vector(tokens: list, idf: dict) -> np.ndarray:
+    """
+    Returns the L2-normalized hashed TF-IDF vector (unigrams and bigrams) of a token list.
+    """
+    vector = np.zeros(DENSE_DIMENSIONS, dtype=np.float32)
+    terms = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    for term, count in Counter(terms).items():
+        vector[_feature(term)] += (1 + math.log(count)) * idf.get(term, 1.0)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def build_index(docs_dir: str, index_dir: str, max_chars: int = 1200, overlap: int = 200) -> int:
+    """
+    Chunks every document under `docs_dir` and writes the index to `index_dir`.
+
+    Returns:
+    chunk_count (int): The number of indexed passages.
+    """
+    chunks = []
+    for root, _, files in os.walk(docs_dir):
+        for name in sorted(files):
+            if not name.lower().endswith((".md", ".txt", ".pdf")):
+                continue
+            path = os.path.join(root, name)
+            for i, text in enumerate(chunk_text(read_document(path), max_chars, overlap)):
+                chunks.append({"id": len(chunks), "source": os.path.relpath(path, docs_dir), "chunk": i, "text": text})
+
+    tokenized = [tokenize(f"{c['source']} {c['text']}") for c in chunks]
+    postings = defaultdict(lambda: [[], []])
+    for chunk_id, tokens in enumerate(tokenized):
+        for term, tf in Counter(tokens).items():
+            postings[term][0].append(chunk_id)
+            postings[term][1].append(tf)
+
+    # Document frequencies over unigrams and bigrams weight the dense vectors
+    document_frequency = Counter()
+    for tokens in tokenized:
+        document_frequency.update(set(tokens) | {f"{a} {b}" for a, b in zip(tokens, tokens[1:])})
+    n = max(1, len(chunks))
+    idf = {term: math.log(1 + n / df) for term, df in document_frequency.items()}
+    dense = np.stack([dense_vector(tokens, idf) for tokens in tokenized]) if chunks else np.zeros((0, DENSE_DIMENSIONS), np.float32)
+
+    os.makedirs(index_dir, exist_ok=True)
+    with open(os.path.join(index_dir, "chunks.jsonl"), "w", encoding="utf-8") as f:
+        for chunk in chunks:
+            f.write(json.dumps(chunk) + "\n")
+    with open(os.path.join(index_dir, "bm25.json"), "w", encoding="utf-8") as f:
+        json.dump({"lengths": [len(tokens) for tokens in tokenized], "postings": postings, "idf": idf}, f)
+    np.save(os.path.join(index_dir, "dense.npy"), dense.astype(np.float32))
+    return len(chunks)
+
+
+class PlanIndex:
+    """
+    A class to represent a loaded plan index. The dense matrix is memory-mapped, so loading is fast and
+    several processes share the same pages.
+    """
+    def __init__(self, index_dir: str):
+        with open(os.path.join(index_dir, "chunks.jsonl"), encoding="utf-8") as f:
+            self.chunks = [json.loads(line) for line in f]
+        with open(os.path.join(index_dir, "bm25.json"), encoding="utf-8") as f:
+            bm25 = json.load(f)
+        self.postings = bm25["postings"]
+        self.idf = bm25["idf"]
+        self.lengths = np.asarray(bm25["lengths"], dtype=np.float32)
+        self.average_length = float(self.lengths.mean()) if len(self.lengths) else 0.0
+        self.dense = np.load(os.path.join(index_dir, "dense.npy"), mmap_mode="r")
+
+    def bm25_scores(self, tokens: list) -> np.ndarray:
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+        n = len(self.chunks)
+        for term in set(tokens):
+            if term not in self.postings:
+                continue
+            ids, tfs = self.postings[term]
+            ids = np.asarray(ids)
+            tfs = np.asarray(tfs, dtype=np.float32)
+            idf = math.log(1 + (n - len(ids) + 0.5) / (len(ids) + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[ids] / self.average_length)
+            scores[ids] += idf * tfs * (BM25_K1 + 1) / (tfs + norm)
+        return scores
+
+    def search(self, query: str, top_k: int = 8) -> list:
+        """
+        Returns the `top_k` passages for `query`, ranked by reciprocal rank fusion of BM25 and dense similarity.
+
+        Returns:
+        results (list[dict]): The chunks with an added "score".
+        """
+        if not self.chunks:
+            return []
+        tokens = tokenize(query)
+        bm25 = self.bm25_scores(tokens)
+        dense = np.asarray(self.dense @ dense_vector(tokens, self.idf))
+        depth = min(len(self.chunks), top_k * 4)
+
+        fused = defaultdict(float)
+        for scores in (bm25, dense):
+            ranked = np.argsort(-scores)[:depth]
+            for rank, chunk_id in enumerate(ranked):
+                if scores[chunk_id] > 0:
+                    fused[int(chunk_id)] += 1.0 / (RRF_K + rank + 1)
+        best = sorted(fused.items(), key=lambda item: -item[1])[:top_k]
+        return [dict(self.chunks[chunk_id], score=score) for chunk_id, score in best]
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def load_index(index_dir: str = None) -> PlanIndex:
+    """
+    Returns the (cached) index in `index_dir`, defaulting to PLAN_INDEX_DIR or plan_index.
+    """
+    index_dir = index_dir or os.getenv("PLAN_INDEX_DIR", "plan_index")
+    with _indexes_lock:
+        if index_dir not in _indexes:
+            _indexes[index_dir] = PlanIndex(index_dir)
+        return _indexes[index_dir]
+
+
+def format_results(plan_name: str, results: list) -> str:
+    """
+    Formats retrieved passages as the plan information handed to the ReportAgent.
+    """
+    if not results:
+        return f"No information about the {plan_name} plan was found in the local plan documents."
+    passages = [f"[{r['source']} #{r['chunk']}]\n{r['text']}" for r in results]
+    return f"Information about the {plan_name} plan from the local plan documents:\n\n" + "\n\n".join(passages)
+
+
+class LocalSearchAgent:
+    """
+    A class to represent the local Search Agent, a drop-in replacement for SearchAgent backed by the on-disk index.
+    """
+    def __init__(self, index_dir: str = None, artifacts: ArtifactStore = None, top_k: int = 8):
+        self.index_dir = index_dir
+        self.artifacts = artifacts or get_artifact_store()
+        self.top_k = top_k
+
+    @kernel_function(description='An agent that searches health plan documents. Returns a handle to the search results.')
+    async def search_plan_docs(self, plan_name:str) -> str:
+        """
+        Searches the local plan index for information about a health plan.
+
+        Parameters:
+        plan_name (str): The name of the health plan to search for.
+
+        Returns:
+        handle (str): A handle to the information about the health plan, stored in the artifact store.
+        """
+        return self.artifacts.put(self._search(plan_name), kind="search")
+
+    def prefetch(self, plan_name: str, cancel_event: threading.Event = None) -> str:
+        return self._search(plan_name)
+
+    def _search(self, plan_name: str, cancel_event: threading.Event = None) -> str:
+        print("Calling LocalSearchAgent...")
+        # The query mirrors what the report needs: the plan itself, its coverage, exclusions and costs
+        query = f"{plan_name} plan coverage benefits exclusions limitations costs deductible copay"
+        return format_results(plan_name, load_index(self.index_dir).search(query, self.top_k))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local health plan document index")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Chunk and index a directory of plan documents")
+    build.add_argument("docs_dir")
+    build.add_argument("--index", default=os.getenv("PLAN_INDEX_DIR", "plan_index"))
+    build.add_argument("--max-chars", type=int, default=1200)
+    build.add_argument("--overlap", type=int, default=200)
+    search = commands.add_parser("search", help="Query the index")
+    search.add_argument("query")
+    search.add_argument("--index", default=os.getenv("PLAN_INDEX_DIR", "plan_index"))
+    search.add_argument("--top-k", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        if args.max_chars < 2:
+            parser.error("--max-chars must be at least 2")
+        if not 0 <= args.overlap < args.max_chars // 2:
+            parser.error("--overlap must be at least 0 and less than half of --max-chars")
+        print(f"Indexed {build_index(args.docs_dir, args.index, args.max_chars, args.overlap)} passages into {args.index}")
+    else:
+        for result in PlanIndex(args.index).search(args.query, args.top_k):
+            print(f"{result['score']:.4f}  {result['source']} #{result['chunk']}: {result['text'][:200]!r}")
+
+
+if __name__ == "__main__":
+    main()
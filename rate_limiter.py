@@ -0,0 +1,254 @@
+import os
+import re
+import time
+import random
+import asyncio
+import threading
+
+from token_budget import count_tokens
+
+"""
+# Client-side rate limiter
+
+The agent plugins, the orchestrator and the reasoning samples all spend from the same Azure OpenAI
+quotas. The RateLimitManager keeps one token bucket for tokens-per-minute (TPM) and one for
+requests-per-minute (RPM) per deployment, shared by every caller in the process. Callers estimate the
+token cost of a request and spend it from the buckets before sending, so concurrent report jobs queue
+locally instead of triggering 429 storms. When a 429 still happens, the `Retry-After` the service sent
+pauses the whole deployment, and the call is retried with jittered exponential backoff.
+
+Limits come from the environment (deployment name upper-cased, non-alphanumerics replaced by '_').
+Deployments without a configured limit are not throttled, but 429s are still retried.
+
+# .env examples
+
+```.env
+RATE_LIMIT_GPT_4O_TPM=150000
+RATE_LIMIT_GPT_4O_RPM=900
+RATE_LIMIT_O3_TPM=100000
+RATE_LIMIT_MAX_RETRIES=6
+```
+"""
+
+
+class RateLimitExceededError(RuntimeError):
+    """
+    Raised when a call is still rate limited after all retries.
+    """
+
+
+def estimate_tokens(*texts, max_output_tokens: int = 1000) -> int:
+    """
+    Estimates the quota cost of a request: prompt tokens plus the completion allowance.
+
+    Parameters:
+    texts (str): The prompt pieces (instructions, messages, embedded documents).
+    max_output_tokens (int): The expected or maximum completion size.
+
+    Returns:
+    tokens (int): The estimated number of tokens the request will be charged for.
+    """
+    return sum(count_tokens(text) for text in texts if text) + max_output_tokens
+
+
+def retry_after_from_error(error) -> float:
+    """
+    Extracts the server's requested wait in seconds from an exception or an agent run's last_error.
+    Exceptions are searched along their __cause__ chain, since Semantic Kernel wraps the OpenAI errors.
+
+    Returns:
+    retry_after (float): Seconds to wait, or None if the error carries no hint.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None) or {}
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            try:
+                return float(headers["retry-after"])
+            except ValueError:
+                pass
+        # Agent runs only report the wait inside the error message, e.g. "Try again in 20 seconds."
+        message = error.get("message", "") if isinstance(error, dict) else str(getattr(error, "message", "") or "")
+        match = re.search(r"try again in (\d+(?:\.\d+)?) seconds?", message, re.IGNORECASE)
+        if match:
+            return float(match.group(1))
+        error = getattr(error, "__cause__", None)
+    return None
+
+
+def is_rate_limit_error(error) -> bool:
+    """
+    Returns True if an exception (or one of its causes) is an HTTP 429 from the service.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+        if status == 429 or type(error).__name__ == "RateLimitError":
+            return True
+        error = getattr(error, "__cause__", None)
+    return False
+
+
+class TokenBucket:
+    """
+    A class to represent a token bucket that refills continuously up to one minute's worth of capacity.
+    Spending reserves capacity immediately and returns how long the caller must wait for it, so waiters
+    are served in arrival order without holding the lock while sleeping.
+    """
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        """
+        Spends `amount` from the bucket and returns the number of seconds until it is actually available.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            # A single request larger than the whole bucket would otherwise wait forever
+            self.tokens -= min(amount, self.capacity)
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def refund(self, amount: float):
+        """
+        Gives back tokens when the actual usage was lower than the estimate (negative amounts charge more).
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class RateLimitManager:
+    """
+    A class to represent the shared per-deployment TPM / RPM limiter.
+    """
+    def __init__(self, limits: dict = None, max_retries: int = None, base_delay: float = 1.0, max_delay: float = 60.0):
+        """
+        Parameters:
+        limits (dict[str, tuple[int, int]]): Optional (tpm, rpm) per deployment. Missing entries are read from the environment.
+        max_retries (int): Retries after a 429 before giving up. Defaults to RATE_LIMIT_MAX_RETRIES or 6.
+        base_delay (float): First backoff delay in seconds when the service sent no Retry-After.
+        max_delay (float): Upper bound for a single backoff delay.
+        """
+        self.limits = dict(limits or {})
+        self.max_retries = int(os.getenv("RATE_LIMIT_MAX_RETRIES", "6")) if max_retries is None else max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._buckets = {}
+        self._blocked_until = {}
+        self._lock = threading.Lock()
+
+    def _buckets_for(self, deployment: str) -> tuple:
+        with self._lock:
+            if deployment not in self._buckets:
+                tpm, rpm = self.limits.get(deployment) or self._limits_from_env(deployment)
+                self._buckets[deployment] = (TokenBucket(tpm) if tpm else None, TokenBucket(rpm) if rpm else None)
+            return self._buckets[deployment]
+
+    @staticmethod
+    def _limits_from_env(deployment: str) -> tuple:
+        prefix = "RATE_LIMIT_" + re.sub(r"[^A-Z0-9]", "_", deployment.upper())
+        tpm = os.getenv(f"{prefix}_TPM")
+        rpm = os.getenv(f"{prefix}_RPM")
+        return (int(tpm) if tpm else None, int(rpm) if rpm else None)
+
+    def _reserve(self, deployment: str, tokens: int) -> float:
+        tpm_bucket, rpm_bucket = self._buckets_for(deployment)
+        wait = self._blocked_until.get(deployment, 0.0) - time.monotonic()
+        if tpm_bucket:
+            wait = max(wait, tpm_bucket.reserve(tokens))
+        if rpm_bucket:
+            wait = max(wait, rpm_bucket.reserve(1))
+        return wait
+
+    def acquire(self, deployment: str, tokens: int):
+        """
+        Blocks until the deployment has budget for a request of `tokens` estimated tokens.
+        """
+        wait = self._reserve(deployment, tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, deployment: str, tokens: int):
+        """
+        Waits, without blocking the event loop, until the deployment has budget for the request.
+        """
+        wait = self._reserve(deployment, tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def reconcile(self, deployment: str, estimated: int, actual: int):
+        """
+        Corrects the TPM bucket once the real usage of a request is known.
+        """
+        tpm_bucket, _ = self._buckets_for(deployment)
+        if tpm_bucket and actual is not None:
+            tpm_bucket.refund(estimated - actual)
+
+    def backoff(self, deployment: str, attempt: int, retry_after: float = None) -> float:
+        """
+        Records a 429 and returns how long to wait before retrying. The server's Retry-After pauses every
+        caller of the deployment; without one, full-jitter exponential backoff is used.
+        """
+        if retry_after is None:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        else:
+            # A little jitter on top of Retry-After keeps waiting callers from retrying in lockstep
+            delay = retry_after + random.uniform(0, self.base_delay)
+        with self._lock:
+            self._blocked_until[deployment] = max(self._blocked_until.get(deployment, 0.0), time.monotonic() + delay)
+        return delay
+
+    def call(self, deployment: str, tokens: int, fn, *args, **kwargs):
+        """
+        Calls `fn(*args, **kwargs)` within the deployment's budget, retrying 429 errors.
+        """
+        for attempt in range(self.max_retries + 1):
+            self.acquire(deployment, tokens)
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == self.max_retries:
+                    raise
+                time.sleep(self.backoff(deployment, attempt, retry_after_from_error(e)))
+
+    async def call_async(self, deployment: str, tokens: int, coro_factory):
+        """
+        Awaits `coro_factory()` within the deployment's budget, retrying 429 errors with a fresh coroutine.
+        """
+        for attempt in range(self.max_retries + 1):
+            await self.acquire_async(deployment, tokens)
+            try:
+                return await coro_factory()
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(self.backoff(deployment, attempt, retry_after_from_error(e)))
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimitManager:
+    """
+    Returns the process-wide rate limit manager shared by every plugin and orchestrator.
+    """
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = RateLimitManager()
+        return _manager
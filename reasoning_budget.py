@@ -0,0 +1,247 @@
+import json
+import math
+import os
+import re
+import threading
+from collections import deque
+from dataclasses import dataclass
+
+"""
+# Adaptive reasoning budgets
+
+Picks `reasoning_effort` and `max_completion_tokens` per request instead of sending every question with
+the same settings. A small local classifier sorts each question into a tier (low, medium, high) from cheap
+features of the text: its length, words that ask for multi-step work ("compare", "step by step", "prove"),
+code, math, several questions at once, and words that ask for brevity ("in one sentence", "briefly").
+
+Each tier starts from a default effort and completion budget and then learns from the usage the service
+reports back:
+
+- the completion budget follows the tier's observed completion tokens (95th percentile plus headroom)
+- a tier whose answers barely reason is moved to a lower effort, one whose answers mostly spend more than
+  half of the completion budget reasoning to a higher effort
+- a tier whose answers keep getting cut off (finish_reason "length") gets a larger budget and, once at the
+  ceiling, a higher effort
+
+Reasoning tokens are read from the OpenAI response (`usage.completion_tokens_details.reasoning_tokens`),
+since Semantic Kernel's own usage object only carries prompt and completion tokens.
+
+The learned statistics are kept in a small JSON file so they survive restarts.
+
+# .env examples
+
+```.env
+REASONING_BUDGET_STATE=.reasoning_budget.json
+```
+"""
+
+EFFORTS = ("low", "medium", "high")
+
+# Starting effort and completion budget (reasoning plus visible tokens) of each tier
+DEFAULT_TIERS = {
+    "low": ("low", 2000),
+    "medium": ("medium", 5000),
+    "high": ("high", 16000),
+}
+
+# Completion budgets never go below or above these
+MIN_COMPLETION_TOKENS = 1000
+MAX_COMPLETION_TOKENS = 32000
+
+# Observations kept per tier, and how many are needed before the defaults are adjusted
+WINDOW = 50
+MIN_OBSERVATIONS = 10
+
+# A tier whose answers mostly reason less than this is moved to a lower effort
+LOW_REASONING_TOKENS = 300
+# ... and one whose answers mostly spend more than this share of the completion budget reasoning to a higher effort
+HIGH_REASONING_SHARE = 0.5
+
+MULTI_STEP_PATTERN = re.compile(
+    r"\b(step[- ]by[- ]step|steps|analy[sz]e|analysis|compare|comparison|trade-?offs?|prove|proof|derive|"
+    r"design|plan|optimi[sz]e|evaluate|explain why|pros and cons|calculate|estimate|debug|refactor)\b",
+    re.IGNORECASE,
+)
+BRIEF_PATTERN = re.compile(r"\b(in (one|a single|1) (sentence|word|line)|briefly|short answer|tl;?dr|yes or no)\b", re.IGNORECASE)
+MATH_PATTERN = re.compile(r"[=^∑∫√]|\d+\s*[-+*/]\s*\d+")
+
+
+@dataclass(frozen=True)
+class ReasoningPlan:
+    """
+    A class to represent the settings picked for one request.
+    """
+    tier: str
+    reasoning_effort: str
+    max_completion_tokens: int
+
+
+def supports_reasoning_effort(deployment: str) -> bool:
+    """
+    Returns True for o-series reasoning deployments (o1, o3, o3-mini, o4-mini, ...), which accept `reasoning_effort`.
+    """
+    return bool(re.match(r"o\d", (deployment or "").lower()))
+
+
+def complexity_score(question: str) -> float:
+    """
+    Scores how much reasoning a question is likely to need. Roughly: below 1 is trivial, above 3 is multi-step work.
+    """
+    words = len(question.split())
+    score = math.log2(1 + words / 10)
+    score += 1.0 * min(3, len(MULTI_STEP_PATTERN.findall(question)))
+    score += 1.5 if "```" in question or re.search(r"\bdef |\bclass |;\s*$", question, re.MULTILINE) else 0.0
+    score += 1.0 if MATH_PATTERN.search(question) else 0.0
+    score += 0.5 * max(0, question.count("?") - 1)
+    score -= 2.0 if BRIEF_PATTERN.search(question) else 0.0
+    return score
+
+
+def classify(question: str) -> str:
+    score = complexity_score(question)
+    if score < 1.5:
+        return "low"
+    if score < 3.5:
+        return "medium"
+    return "high"
+
+
+def _inner_usage(response):
+    # The OpenAI response (or, for a merged stream, its chunks; only the last one carries usage) behind an SK message
+    inner = getattr(response, "inner_content", None)
+    for item in reversed(inner if isinstance(inner, list) else [inner]):
+        usage = getattr(item, "usage", None)
+        if usage is not None:
+            return usage
+    return None
+
+
+def usage_tokens(response) -> tuple:
+    """
+    Extracts (completion_tokens, reasoning_tokens, truncated) from a chat message returned by Semantic Kernel.
+    Missing values are returned as None.
+    """
+    metadata = getattr(response, "metadata", None) or {}
+    usage = metadata.get("usage")
+    # SK's CompletionUsage has no completion_tokens_details; the OpenAI usage it was built from does
+    inner_usage = _inner_usage(response)
+    completion = getattr(usage, "completion_tokens", None)
+    if completion is None:
+        completion = getattr(inner_usage, "completion_tokens", None)
+    details = getattr(inner_usage, "completion_tokens_details", None) or getattr(usage, "completion_tokens_details", None)
+    reasoning = getattr(details, "reasoning_tokens", None)
+    finish_reason = getattr(response, "finish_reason", None) or metadata.get("finish_reason")
+    truncated = str(getattr(finish_reason, "value", finish_reason) or "").lower() == "length"
+    return completion, reasoning, truncated
+
+
+class ReasoningBudget:
+    """
+    A class to represent the per-tier reasoning settings and the usage they are learned from.
+    """
+    def __init__(self, state_path: str = None):
+        self.state_path = state_path if state_path is not None else os.getenv("REASONING_BUDGET_STATE", ".reasoning_budget.json")
+        self._lock = threading.Lock()
+        self._completion = {tier: deque(maxlen=WINDOW) for tier in DEFAULT_TIERS}
+        self._reasoning = {tier: deque(maxlen=WINDOW) for tier in DEFAULT_TIERS}
+        self._efforts = {tier: effort for tier, (effort, _) in DEFAULT_TIERS.items()}
+        self._budgets = {tier: budget for tier, (_, budget) in DEFAULT_TIERS.items()}
+        self._load()
+
+    def _load(self):
+        if not self.state_path or not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        for tier in DEFAULT_TIERS:
+            saved = state.get(tier, {})
+            self._completion[tier].extend(saved.get("completion", []))
+            self._reasoning[tier].extend(saved.get("reasoning", []))
+            self._efforts[tier] = saved.get("effort", self._efforts[tier])
+            self._budgets[tier] = saved.get("budget", self._budgets[tier])
+
+    def _save(self):
+        if not self.state_path:
+            return
+        state = {tier: {"effort": self._efforts[tier], "budget": self._budgets[tier],
+                        "completion": list(self._completion[tier]), "reasoning": list(self._reasoning[tier])}
+                 for tier in DEFAULT_TIERS}
+        with open(self.state_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+
+    def plan(self, question: str) -> ReasoningPlan:
+        """
+        Returns the reasoning effort and completion budget for a question.
+        """
+        tier = classify(question)
+        with self._lock:
+            return ReasoningPlan(tier, self._efforts[tier], self._budgets[tier])
+
+    def observe(self, plan: ReasoningPlan, response):
+        """
+        Learns from the usage of a finished request.
+
+        Parameters:
+        plan (ReasoningPlan): The plan the request was sent with.
+        response (ChatMessageContent): The response, whose metadata carries the usage.
+        """
+        completion, reasoning, truncated = usage_tokens(response)
+        tier = plan.tier
+        with self._lock:
+            if truncated:
+                # The answer was cut off: give the tier more room and, if it is already at the ceiling, more effort
+                self._budgets[tier] = min(MAX_COMPLETION_TOKENS, max(self._budgets[tier], plan.max_completion_tokens) * 2)
+                # Remember it as a large answer so the learned budget does not shrink straight back
+                self._completion[tier].append(self._budgets[tier])
+                index = EFFORTS.index(self._efforts[tier])
+                if self._budgets[tier] >= MAX_COMPLETION_TOKENS and index < len(EFFORTS) - 1:
+                    self._efforts[tier] = EFFORTS[index + 1]
+            elif completion is not None:
+                self._completion[tier].append(completion)
+                if reasoning is not None:
+                    self._reasoning[tier].append(reasoning)
+                self._adjust(tier)
+            self._save()
+
+    def _adjust(self, tier: str):
+        completions = sorted(self._completion[tier])
+        if len(completions) < MIN_OBSERVATIONS:
+            return
+        p95 = completions[min(len(completions) - 1, int(0.95 * len(completions)))]
+        self._budgets[tier] = max(MIN_COMPLETION_TOKENS, min(MAX_COMPLETION_TOKENS, int(p95 * 1.5)))
+
+        reasoning = sorted(self._reasoning[tier])
+        if len(reasoning) < MIN_OBSERVATIONS:
+            return
+        index = EFFORTS.index(self._efforts[tier])
+        if reasoning[int(0.75 * len(reasoning))] < LOW_REASONING_TOKENS and index > 0:
+            self._efforts[tier] = EFFORTS[index - 1]
+        elif reasoning[len(reasoning) // 2] > HIGH_REASONING_SHARE * self._budgets[tier] and index < len(EFFORTS) - 1:
+            self._efforts[tier] = EFFORTS[index + 1]
+        else:
+            return
+        # Start the new effort level with fresh statistics
+        self._reasoning[tier].clear()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {tier: {"effort": self._efforts[tier], "max_completion_tokens": self._budgets[tier],
+                           "observations": len(self._completion[tier])} for tier in DEFAULT_TIERS}
+
+
+_budget = None
+_budget_lock = threading.Lock()
+
+
+def get_reasoning_budget() -> ReasoningBudget:
+    """
+    Returns the process-wide reasoning budget.
+    """
+    global _budget
+    with _budget_lock:
+        if _budget is None:
+            _budget = ReasoningBudget()
+        return _budget
@@ -13,6 +13,14 @@ from semantic_kernel.connectors.ai.open_ai import (
 )
 from semantic_kernel.contents import ChatHistory
 
+from chat_store import chat_session_id, get_chat_store
+from hedging import StageTimeoutError, hedge_delay, hedge_target, hedged_async, with_timeout
+from model_router import get_router
+from reasoning_budget import ReasoningPlan, get_reasoning_budget, supports_reasoning_effort
+from request_scheduler import get_scheduler
+from streaming_chat import TTFTRecorder, stream_reply, streaming_enabled
+from token_budget import BudgetExceededError, count_messages, fit_history, output_budget
+
 """
 # Reasoning Models Sample
 
@@ -64,17 +72,17 @@ Note: Unsupported features may be added in future updates.
 load_dotenv()
 
 # The envionrment variables needed to connect to the gpt-4o model in Azure AI Foundry
-deployment_name = "o3"
+# The deployment is picked by the model router's "reasoning" route (o3 by default)
+router = get_router()
+deployment_name = router.select("reasoning")
 endpoint = os.environ["CHAT_MODEL_ENDPOINT"]
 api_key = os.environ["CHAT_MODEL_API_KEY"]
 service_id = "reasoning"
 
 # chat_service = OpenAIChatCompletion(service_id="reasoning", deployment_name=deployment_name, endpoint=endpoint, api_key=api_key)
 chat_service = AzureChatCompletion(service_id=service_id, deployment_name=deployment_name, endpoint=endpoint, api_key=api_key)
-settings = OpenAIChatPromptExecutionSettings(
-    max_tokens=8000,  # Set a high token limit for detailed responses
-    # reasoning_effort="high" # applicable only for o3-mini models
-)
+# The reasoning effort and completion budget are picked per question, and learned from the usage of earlier answers
+reasoning_budget = get_reasoning_budget()
 
 # Create a ChatHistory object
 chat_history = ChatHistory()
@@ -89,6 +97,64 @@ as questions or consultations and answer them.
 # `system message` cannot be used with reasoning models.
 chat_history.add_developer_message(developer_message)
 
+# The conversation is persisted after every turn, so it can be resumed later with CHAT_SESSION (see chat_store.py)
+chat_store = get_chat_store()
+session_id = chat_session_id()
+
+
+# One chat service per deployment, so a slow turn can be hedged to another deployment of the route
+chat_services = {deployment_name: chat_service}
+
+
+def get_chat_service(deployment: str) -> AzureChatCompletion:
+    if deployment not in chat_services:
+        chat_services[deployment] = AzureChatCompletion(service_id=service_id, deployment_name=deployment, endpoint=endpoint, api_key=api_key)
+    return chat_services[deployment]
+
+
+def request_settings(deployment: str, plan: ReasoningPlan) -> OpenAIChatPromptExecutionSettings:
+    settings = OpenAIChatPromptExecutionSettings(
+        # Capped by what the deployment's context window has left
+        max_completion_tokens=output_budget(deployment, count_messages(chat_history.messages, deployment), plan.max_completion_tokens),
+    )
+    if supports_reasoning_effort(deployment):
+        settings.reasoning_effort = plan.reasoning_effort
+    return settings
+
+
+# Time to first token of the streamed turns
+ttft_recorder = TTFTRecorder()
+
+
+async def stream(deployment: str, plan: ReasoningPlan):
+    # Print the reply as it is generated instead of after the whole answer is done
+    with router.track(deployment):
+        response, timing = await stream_reply(
+            get_chat_service(deployment).get_streaming_chat_message_content(
+                chat_history=chat_history,
+                settings=request_settings(deployment, plan),
+            ),
+            deployment,
+        )
+    ttft_recorder.record(timing)
+    if timing.ttft is not None:
+        print(f"(first token after {timing.ttft:.2f}s, done after {timing.total:.2f}s)")
+    return response
+
+
+async def complete(deployment: str, plan: ReasoningPlan):
+    settings = request_settings(deployment, plan)
+    with router.track(deployment) as call:
+        try:
+            return await get_chat_service(deployment).get_chat_message_content(
+                chat_history=chat_history,
+                settings=settings
+            )
+        except asyncio.CancelledError:
+            # The other half of a hedged turn won
+            call.cancelled()
+            raise
+
 
 async def chat() -> bool:
     try:
@@ -105,26 +171,58 @@ async def chat() -> bool:
         return False
 
     chat_history.add_user_message(user_input)
+    user_message = chat_history.messages[-1]
+    plan = reasoning_budget.plan(user_input)
 
-    # Get the chat message content from the chat completion service.
-    response = await chat_service.get_chat_message_content(
-        chat_history=chat_history,
-        settings=settings
-    )
+    # Drop the oldest turns that no longer fit the context window, and refuse a message that can never fit
+    try:
+        fit_history(chat_history, deployment_name, plan.max_completion_tokens)
+    except BudgetExceededError as e:
+        print(f"{e}. Please send a shorter message.")
+        chat_history.messages.pop()
+        return True
+
+    # Stream the reply where the deployment supports it. Streamed turns are not hedged, as the reply is already on screen.
+    streamed = streaming_enabled(deployment_name)
+    # Otherwise get the chat message content from the chat completion service, hedging slow turns if enabled.
+    hedge_after = None if streamed else hedge_delay(router, deployment_name)
+    if streamed:
+        turn = stream(deployment_name, plan)
+    elif hedge_after is None:
+        turn = complete(deployment_name, plan)
+    else:
+        backup = hedge_target(router, "reasoning", deployment_name)
+        turn = hedged_async(lambda: complete(deployment_name, plan), lambda: complete(backup, plan), hedge_after)
+    try:
+        # Chat turns are interactive: they are scheduled ahead of report and batch agent runs on the same process
+        async with get_scheduler().slot_async("interactive", cost=plan.max_completion_tokens / 1000):
+            response = await with_timeout(turn, stage="reasoning")
+    except StageTimeoutError as e:
+        print(f"{e}. Please try again.")
+        # Drop the unanswered question so it is not sent twice on the next turn
+        chat_history.messages.pop()
+        return True
     if response:
-        print(f"{deployment_name} reply:", response)
+        if not streamed:
+            print(f"{deployment_name} reply:", response)
+        reasoning_budget.observe(plan, response)
 
         # Add the chat message to the chat history to keep track of the conversation.
         chat_history.add_message(response)
+        # Persist the turn and keep only the active window in memory
+        chat_store.commit_turn(session_id, chat_history, user_message)
 
     return True
 
 
 async def main() -> None:
+    resumed = chat_store.load(session_id, chat_history)
+    print(f"Chat session {session_id} (resume it with CHAT_SESSION={session_id})" + (f", resumed {resumed} earlier messages." if resumed else "."))
     # Start the chat loop. The chat loop will continue until the user types "exit".
     chatting = True
     while chatting:
         chatting = await chat()
+    print(ttft_recorder.summary())
 
     # Sample output:
     # User:> Why is the sky blue in one sentence?
@@ -10,6 +10,11 @@ from semantic_kernel.contents import ChatHistory
 from semantic_kernel.core_plugins.time_plugin import TimePlugin
 from semantic_kernel.filters import AutoFunctionInvocationContext, FilterTypes
 
+from chat_store import chat_session_id, get_chat_store
+from reasoning_budget import get_reasoning_budget
+from request_scheduler import get_scheduler
+from streaming_chat import TTFTRecorder, stream_reply, streaming_enabled
+
 """
 # Reasoning Models Sample
 
@@ -64,14 +69,19 @@ Note: Unsupported features may be added in future updates.
 
 
 chat_service = OpenAIChatCompletion(service_id="reasoning", instruction_role="developer")
-# Set the reasoning effort to "medium" and the maximum completion tokens to 5000.
-# also set the function_choice_behavior to auto and that includes auto invoking the functions.
-request_settings = OpenAIChatPromptExecutionSettings(
-    service_id="reasoning",
-    max_completion_tokens=5000,
-    reasoning_effort="medium",
-    function_choice_behavior=FunctionChoiceBehavior.Auto(),
-)
+# The reasoning effort and maximum completion tokens are picked per question (see reasoning_budget.py),
+# and learned from the usage of earlier answers.
+reasoning_budget = get_reasoning_budget()
+
+
+def request_settings(plan) -> OpenAIChatPromptExecutionSettings:
+    # Also set the function_choice_behavior to auto and that includes auto invoking the functions.
+    return OpenAIChatPromptExecutionSettings(
+        service_id="reasoning",
+        max_completion_tokens=plan.max_completion_tokens,
+        reasoning_effort=plan.reasoning_effort,
+        function_choice_behavior=FunctionChoiceBehavior.Auto(),
+    )
 
 
 # Create a ChatHistory object
@@ -85,10 +95,17 @@ as questions or consultations and answer them.
 """
 )
 
+# The conversation, function calls included, is persisted after every turn and can be resumed with CHAT_SESSION
+chat_store = get_chat_store()
+session_id = chat_session_id()
+
 # Create a kernel and register plugin.
 kernel = Kernel()
 kernel.add_plugin(TimePlugin(), "time")
 
+# Time to first token of the streamed turns
+ttft_recorder = TTFTRecorder()
+
 
 # add a simple filter to track the function call result
 @kernel.filter(filter_type=FilterTypes.AUTO_FUNCTION_INVOCATION)
@@ -115,24 +132,47 @@ async def chat() -> bool:
         return False
 
     chat_history.add_user_message(user_input)
-
-    # Get the chat message content from the chat completion service.
-    response = await chat_service.get_chat_message_content(
-        chat_history=chat_history,
-        settings=request_settings,
-        kernel=kernel,
-    )
+    user_message = chat_history.messages[-1]
+    plan = reasoning_budget.plan(user_input)
+
+    # Chat turns are interactive: they are scheduled ahead of report and batch agent runs on the same process
+    async with get_scheduler().slot_async("interactive", cost=plan.max_completion_tokens / 1000):
+        if streaming_enabled(chat_service.ai_model_id):
+            # Stream the reply as it is generated; functions called mid-stream are invoked automatically
+            response, timing = await stream_reply(
+                chat_service.get_streaming_chat_message_content(
+                    chat_history=chat_history,
+                    settings=request_settings(plan),
+                    kernel=kernel,
+                ),
+                "Mosscap",
+            )
+            ttft_recorder.record(timing)
+        else:
+            # Get the chat message content from the chat completion service.
+            response = await chat_service.get_chat_message_content(
+                chat_history=chat_history,
+                settings=request_settings(plan),
+                kernel=kernel,
+            )
+            if response:
+                print(f"Mosscap:> {response}")
     if response:
-        print(f"Mosscap:> {response}")
+        reasoning_budget.observe(plan, response)
         chat_history.add_message(response)
+        # Persist the turn (with the function calls made during it) and keep only the active window in memory
+        chat_store.commit_turn(session_id, chat_history, user_message)
     return True
 
 
 async def main() -> None:
+    resumed = chat_store.load(session_id, chat_history)
+    print(f"Chat session {session_id} (resume it with CHAT_SESSION={session_id})" + (f", resumed {resumed} earlier messages." if resumed else "."))
     # Start the chat loop. The chat loop will continue until the user types "exit".
     chatting = True
     while chatting:
         chatting = await chat()
+    print(ttft_recorder.summary())
 
     # Sample output:
     # User:> What time is it?
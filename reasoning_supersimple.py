@@ -4,11 +4,13 @@ from dotenv import load_dotenv
 from semantic_kernel.connectors.ai.open_ai import AzureChatCompletion, OpenAIChatCompletion, OpenAIChatPromptExecutionSettings
 from semantic_kernel.contents import ChatHistory
 
+from model_router import get_router
+
 load_dotenv()
 
 async def main():
     # The envionrment variables needed to connect to the gpt-4o model in Azure AI Foundry
-    deployment_name = "o3"
+    deployment_name = get_router().select("reasoning")  # o3 by default
     endpoint = os.environ["CHAT_MODEL_ENDPOINT"]
     api_key = os.environ["CHAT_MODEL_API_KEY"]
     service_id = "reasoning"
@@ -0,0 +1,324 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+from context_packing import pack_context
+from healthplan_agents import (
+    REPORT_AGENT_INSTRUCTIONS,
+    VALIDATION_AGENT_INSTRUCTIONS,
+    create_search_agent,
+    message_text,
+    report_agent_content,
+    save_report,
+)
+from report_jobs import is_pass
+from report_sections import validation_prompt
+from plan_catalog import canonical_plan
+from request_scheduler import priority
+from section_map import SectionMapStore
+
+load_dotenv()
+
+"""
+# Batch report generation
+
+Regenerates the reports of many plans at once through the Batch API instead of the interactive pipeline.
+Batch requests run within a 24 hour window on their own quota at a lower price, which suits a nightly
+rebuild of every plan's report.
+
+1. search: each plan's documents are searched with the configured search backend and the results are
+   packed (context_packing.py). Retrieval runs as an agent tool (or locally with SEARCH_BACKEND=local),
+   which the Batch API cannot call, so this stage runs directly, a few plans at a time.
+2. report: one chat completions request per plan, with the ReportAgent's prompt, compiled into a JSONL
+   file, uploaded and submitted as a batch.
+3. validate: one request per generated report, with the ValidationAgent's prompt, as a second batch.
+
+Requests are matched back to their plans by custom_id and every report that passes validation is saved to
+`<plan> Report.md`. Each stage's inputs, batch id and outputs are kept in the work directory, so a run that
+is interrupted (or re-run while a batch is still in progress) resumes instead of submitting again. A re-run
+also submits a follow-up batch for the requests that have no answer yet: ones that failed in an earlier
+batch, and plans whose search only succeeded this time.
+
+Set REPORT_BATCH_ENDPOINT to run against the local stand-in in batch_stub.py.
+
+# Usage
+
+```zsh
+python report_batch.py "Northwind Standard" "Northwind Health Plus"
+python report_batch.py --plans-file plans.txt --workdir report_batch
+```
+
+# .env examples
+
+```.env
+# A Global Batch deployment
+REPORT_BATCH_DEPLOYMENT=gpt-4.1-batch
+REPORT_BATCH_DIR=report_batch
+# Seconds between batch status checks
+REPORT_BATCH_POLL_INTERVAL=60
+REPORT_BATCH_SEARCH_CONCURRENCY=4
+# The local stand-in (batch_stub.py) instead of AZURE_OPENAI_V1_API_ENDPOINT
+REPORT_BATCH_ENDPOINT=http://localhost:8090/v1
+```
+"""
+
+# Batch statuses after which the service does no more work on a batch
+TERMINAL_BATCH_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+BATCH_ENDPOINT = "/chat/completions"
+
+
+class BatchFailedError(RuntimeError):
+    """
+    Raised when a batch ends without results, e.g. failed validation or expired.
+    """
+
+
+def get_batch_client():
+    """
+    Returns an OpenAI client for the Batch API: the local stand-in if REPORT_BATCH_ENDPOINT is set,
+    otherwise the shared v1 client from aoai_clients.py.
+    """
+    endpoint = os.getenv("REPORT_BATCH_ENDPOINT")
+    if endpoint:
+        from openai import OpenAI
+
+        return OpenAI(base_url=endpoint, api_key=os.getenv("REPORT_BATCH_API_KEY", "local"))
+    from aoai_clients import get_openai_client
+
+    return get_openai_client()
+
+
+def compile_requests(stage: str, prompts: list, deployment: str) -> list:
+    """
+    Builds the batch request lines of a stage.
+
+    Parameters:
+    stage (str): The stage, used as the custom_id prefix.
+    prompts (list[tuple[int, tuple[str, str]]]): (plan index, (instructions, content)) per request.
+    deployment (str): The batch deployment.
+
+    Returns:
+    requests (list[dict]): One chat completions request per prompt, with custom_id "<stage>-<plan index>".
+    """
+    return [
+        {
+            "custom_id": f"{stage}-{index}",
+            "method": "POST",
+            "url": BATCH_ENDPOINT,
+            "body": {"model": deployment, "messages": [{"role": "system", "content": instructions}, {"role": "user", "content": content}]},
+        }
+        for index, (instructions, content) in prompts
+    ]
+
+
+def write_jsonl(path: str, records: list):
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+
+def submit(client, path: str) -> str:
+    """
+    Uploads a JSONL request file and submits it as a batch. Returns the batch id.
+    """
+    with open(path, "rb") as f:
+        input_file = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(input_file_id=input_file.id, endpoint=BATCH_ENDPOINT, completion_window="24h")
+    return batch.id
+
+
+def wait(client, batch_id: str, poll_interval: float = None):
+    """
+    Polls a batch until it reaches a terminal status and returns it.
+    """
+    poll_interval = float(os.getenv("REPORT_BATCH_POLL_INTERVAL", "60")) if poll_interval is None else poll_interval
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        print(f"Batch {batch_id}: {batch.status}" + (f" ({counts.completed + counts.failed}/{counts.total})" if counts and counts.total else ""))
+        if batch.status in TERMINAL_BATCH_STATUSES:
+            return batch
+        time.sleep(poll_interval)
+
+
+def read_results(client, batch) -> tuple:
+    """
+    Downloads a finished batch's output and error files.
+
+    Returns:
+    (outputs, errors) (tuple[dict, dict]): The answer text and the error message per custom_id.
+    """
+    outputs, errors = {}, {}
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        for line in client.files.content(file_id).text.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get("response") or {}
+            if record.get("error") or response.get("status_code") != 200:
+                error = record.get("error") or response.get("body", {}).get("error") or {}
+                errors[record["custom_id"]] = error.get("message", str(error)) if isinstance(error, dict) else str(error)
+                continue
+            outputs[record["custom_id"]] = response["body"]["choices"][0]["message"]["content"] or ""
+    return outputs, errors
+
+
+class BatchReportRun:
+    """
+    A class to represent one batch regeneration of a set of plans' reports, checkpointed in a work directory.
+    """
+    def __init__(self, plan_names: list, workdir: str = None, client=None, deployment: str = None):
+        # Spellings of the same plan are only searched and reported once, under the plan's canonical name.
+        # The plan list comes from the operator, so new plans are learned and later misspellings of them match too.
+        unique = {}
+        for plan_name in plan_names:
+            plan = canonical_plan(plan_name, learn=True)
+            unique.setdefault(plan.id, plan.name)
+        self.plan_names = list(unique.values())
+        self.workdir = workdir or os.getenv("REPORT_BATCH_DIR", "report_batch")
+        self.client = client or get_batch_client()
+        self.deployment = deployment or os.getenv("REPORT_BATCH_DEPLOYMENT", "gpt-4.1")
+        self.manifest_path = os.path.join(self.workdir, "manifest.json")
+        os.makedirs(self.workdir, exist_ok=True)
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self) -> dict:
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+            # custom_ids are plan indexes, so a run can only resume with the same plans in the same order
+            if manifest.get("plans") == self.plan_names and manifest.get("deployment") == self.deployment:
+                print(f"Resuming the batch run in {self.workdir}")
+                return manifest
+        return {"plans": self.plan_names, "deployment": self.deployment, "stages": {}}
+
+    def _save_manifest(self):
+        with open(self.manifest_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=2)
+
+    def search(self, concurrency: int = None) -> dict:
+        """
+        Searches and packs every plan's documents. Returns the packed plan information per plan index.
+        """
+        stage = self.manifest["stages"].setdefault("search", {"outputs": {}, "errors": {}})
+        concurrency = int(os.getenv("REPORT_BATCH_SEARCH_CONCURRENCY", "4")) if concurrency is None else concurrency
+        pending = [i for i in range(len(self.plan_names)) if str(i) not in stage["outputs"]]
+        search_agent = create_search_agent()
+
+        def search_one(index: int):
+            plan_name = self.plan_names[index]
+            try:
+                # The pool's threads do not inherit the caller's context, so the class is set here
+                with priority("batch"):
+                    return index, pack_context(message_text(search_agent._search(plan_name)), plan_name), None
+            except Exception as e:
+                return index, None, f"{e.__class__.__name__}: {e}"
+
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+            for index, packed, error in pool.map(search_one, pending):
+                if error:
+                    stage["errors"][str(index)] = error
+                else:
+                    stage["outputs"][str(index)] = packed
+                    stage["errors"].pop(str(index), None)
+                # Checkpoint after every plan: searches are the slowest part that is not batched
+                self._save_manifest()
+        return {int(i): text for i, text in stage["outputs"].items()}
+
+    def run_batch(self, name: str, prompts: list) -> dict:
+        """
+        Compiles, submits and waits for one stage's batch, or picks up the one submitted by an earlier run.
+
+        Parameters:
+        name (str): The stage name.
+        prompts (list[tuple[int, tuple[str, str]]]): (plan index, (instructions, content)) per request.
+
+        Returns:
+        outputs (dict[int, str]): The answer per plan index. Failed requests are recorded in the manifest.
+        """
+        stage = self.manifest["stages"].setdefault(name, {})
+        stage.setdefault("outputs", {})
+        stage.setdefault("errors", {})
+        if "batch_id" not in stage:
+            # Only the requests without an answer are submitted, so a follow-up batch retries failures and late inputs
+            pending = [(index, prompt) for index, prompt in prompts if f"{name}-{index}" not in stage["outputs"]]
+            if pending:
+                path = os.path.join(self.workdir, f"{name}.jsonl")
+                write_jsonl(path, compile_requests(name, pending, self.deployment))
+                stage["batch_id"] = submit(self.client, path)
+                self._save_manifest()
+                print(f"Submitted {len(pending)} {name} requests as batch {stage['batch_id']}")
+        if "batch_id" in stage:
+            batch = wait(self.client, stage["batch_id"])
+            # Forget the batch either way: the next run submits whatever is still unanswered
+            del stage["batch_id"]
+            if batch.status != "completed":
+                self._save_manifest()
+                raise BatchFailedError(f"The {name} batch ended as {batch.status}: {batch.errors}")
+            outputs, errors = read_results(self.client, batch)
+            stage["outputs"].update(outputs)
+            for custom_id in outputs:
+                stage["errors"].pop(custom_id, None)
+            stage["errors"].update(errors)
+            self._save_manifest()
+        return {int(custom_id.rsplit("-", 1)[1]): text for custom_id, text in stage["outputs"].items()}
+
+    def run(self) -> dict:
+        """
+        Runs every stage and saves the reports that pass validation.
+
+        Returns:
+        results (dict[str, str]): Per plan, the report file name or why no report was saved.
+        """
+        plan_info = self.search()
+        reports = self.run_batch("report", [(i, (REPORT_AGENT_INSTRUCTIONS, report_agent_content(self.plan_names[i], info)))
+                                            for i, info in sorted(plan_info.items())])
+        verdicts = self.run_batch("validate", [(i, (VALIDATION_AGENT_INSTRUCTIONS, validation_prompt(report)))
+                                               for i, report in sorted(reports.items())])
+
+        results = {}
+        section_maps = SectionMapStore()
+        for index, plan_name in enumerate(self.plan_names):
+            failures = [f"{stage} failed: {self.manifest['stages'].get(stage, {}).get('errors', {}).get(key)}"
+                        for stage, key in (("search", str(index)), ("report", f"report-{index}"), ("validate", f"validate-{index}"))
+                        if self.manifest["stages"].get(stage, {}).get("errors", {}).get(key)]
+            if index in verdicts and is_pass(verdicts[index]):
+                section_maps.save(plan_name, reports[index], plan_info[index])
+                results[plan_name] = save_report(plan_name, reports[index])
+            elif index in verdicts:
+                results[plan_name] = f"did not pass validation: {verdicts[index]}"
+            else:
+                results[plan_name] = failures[0] if failures else "no result"
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Regenerate plan reports through the Batch API")
+    parser.add_argument("plan_names", nargs="*")
+    parser.add_argument("--plans-file", help="A file with one plan name per line")
+    parser.add_argument("--workdir", help="Where request files and progress are kept (defaults to REPORT_BATCH_DIR or report_batch)")
+    parser.add_argument("--deployment", help="The batch deployment (defaults to REPORT_BATCH_DEPLOYMENT)")
+    args = parser.parse_args()
+
+    plan_names = list(args.plan_names)
+    if args.plans_file:
+        with open(args.plans_file, encoding="utf-8") as f:
+            plan_names += [line.strip() for line in f if line.strip()]
+    if not plan_names:
+        parser.error("No plans given")
+
+    results = BatchReportRun(plan_names, args.workdir, deployment=args.deployment).run()
+    print()
+    for plan_name, result in results.items():
+        print(f"{plan_name}: {result}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+import argparse
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+from healthplan_agents import ReportAgent, ValidationAgent, create_search_agent, message_text, save_report
+from plan_catalog import canonical_plan
+from request_scheduler import priority
+from section_map import SectionMapStore
+from tracing import span
+
+load_dotenv()
+
+"""
+# Durable report job queue
+
+Report jobs are stored in a local SQLite database and processed by a pool of workers. The pipeline runs
+the Search -> Report -> Validate stages directly (no orchestrator LLM in between) and checkpoints each
+stage's output in the database. If a worker dies mid-job, its lease expires and the next worker that
+claims the job resumes from the last completed stage, so a finished search is never paid for twice.
+
+The database runs in WAL mode and jobs are claimed inside an immediate transaction, so any number of
+worker processes on the same machine (or sharing the database file on a volume with working locks) can
+pull from one queue.
+
+# Usage
+
+```zsh
+python report_jobs.py enqueue "Northwind Standard" "Northwind Health Plus"
+python report_jobs.py worker --concurrency 4
+python report_jobs.py status
+```
+
+# .env examples
+
+```.env
+REPORT_JOBS_DB=report_jobs.db
+# Seconds a claimed job stays leased to its worker between checkpoints
+REPORT_JOBS_LEASE=900
+REPORT_JOBS_MAX_ATTEMPTS=3
+```
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    plan_name TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    report_was_generated INTEGER,
+    result TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    job_id INTEGER NOT NULL REFERENCES jobs (id),
+    stage TEXT NOT NULL,
+    output TEXT NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (job_id, stage)
+);
+"""
+
+# The pipeline stages, in order
+STAGES = ("search", "report", "validate")
+
+
+def is_pass(verdict: str) -> bool:
+    """
+    Returns True if the ValidationAgent's verdict is 'Pass'.
+    """
+    return verdict.strip().strip("'\".").lower().startswith("pass")
+
+
+class ReportJobQueue:
+    """
+    A class to represent the SQLite-backed report job queue.
+    """
+    def __init__(self, path: str = None, lease: float = None, max_attempts: int = None):
+        """
+        Parameters:
+        path (str): The SQLite database file. Defaults to REPORT_JOBS_DB or report_jobs.db.
+        lease (float): Seconds a claimed job stays leased between checkpoints.
+        max_attempts (int): Attempts before a job is marked failed.
+        """
+        self.path = path or os.getenv("REPORT_JOBS_DB", "report_jobs.db")
+        self.lease = float(os.getenv("REPORT_JOBS_LEASE", "900")) if lease is None else lease
+        self.max_attempts = int(os.getenv("REPORT_JOBS_MAX_ATTEMPTS", "3")) if max_attempts is None else max_attempts
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        # One short-lived connection per operation keeps the queue safe to share between threads
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def enqueue(self, plan_name: str) -> int:
+        """
+        Adds a report job for the canonical plan of `plan_name` and returns its id.
+        Plans are queued by an operator, so names that are not in the catalog yet are learned.
+        """
+        plan_name = canonical_plan(plan_name, learn=True).name
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute("INSERT INTO jobs (plan_name, created, updated) VALUES (?, ?, ?)", (plan_name, now, now))
+            return cursor.lastrowid
+
+    def claim(self, worker: str):
+        """
+        Leases the oldest queued job (or one whose previous worker's lease expired) to `worker`.
+        Jobs whose lease expired after their last attempt (their worker crashed every time) are marked failed.
+
+        Returns:
+        job (sqlite3.Row): The claimed job, or None if the queue is empty.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            # BEGIN IMMEDIATE takes the write lock up front, so two workers can never claim the same job
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # A worker killed mid-job (OOM, SIGKILL) never calls fail(), so its attempts are counted here
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = COALESCE(error, 'The worker stopped responding'), lease_until = NULL, "
+                    "updated = ? WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+                    (now, now, self.max_attempts),
+                )
+                job = conn.execute(
+                    "SELECT * FROM jobs WHERE status = 'queued' OR (status = 'running' AND lease_until < ? AND attempts < ?) ORDER BY id LIMIT 1",
+                    (now, self.max_attempts),
+                ).fetchone()
+                if job is not None:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'running', worker = ?, lease_until = ?, attempts = attempts + 1, updated = ? WHERE id = ?",
+                        (worker, now + self.lease, now, job["id"]),
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            if job is None:
+                return None
+            return conn.execute("SELECT * FROM jobs WHERE id = ?", (job["id"],)).fetchone()
+
+    def checkpoints(self, job_id: int) -> dict:
+        """
+        Returns the outputs of the job's completed stages, keyed by stage.
+        """
+        with self._connect() as conn:
+            rows = conn.execute("SELECT stage, output FROM checkpoints WHERE job_id = ?", (job_id,)).fetchall()
+        return {row["stage"]: row["output"] for row in rows}
+
+    def _renew(self, conn, job_id: int, worker: str) -> bool:
+        # Extends the worker's lease if it still holds the job; another worker may have claimed it after the lease expired
+        now = time.time()
+        cursor = conn.execute("UPDATE jobs SET lease_until = ?, updated = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                              (now + self.lease, now, job_id, worker))
+        return cursor.rowcount > 0
+
+    def renew(self, job_id: int, worker: str) -> bool:
+        """
+        Renews the worker's lease on the job.
+
+        Returns:
+        owned (bool): False if the lease was lost and the job must not be touched any more.
+        """
+        with self._connect() as conn:
+            return self._renew(conn, job_id, worker)
+
+    def checkpoint(self, job_id: int, worker: str, stage: str, output: str) -> bool:
+        """
+        Stores a stage's output and renews the worker's lease on the job, in one transaction.
+        Nothing is stored if the lease was lost, so a stale worker cannot overwrite the new holder's checkpoints.
+
+        Returns:
+        owned (bool): False if the lease was lost and the job must not be touched any more.
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                owned = self._renew(conn, job_id, worker)
+                if owned:
+                    conn.execute("INSERT OR REPLACE INTO checkpoints (job_id, stage, output, created) VALUES (?, ?, ?, ?)",
+                                 (job_id, stage, output, time.time()))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            return owned
+
+    def complete(self, job_id: int, worker: str, report_was_generated: bool, result: str):
+        """
+        Records the job's result, unless its lease expired and another worker holds it now.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'done', report_was_generated = ?, result = ?, error = NULL, lease_until = NULL, updated = ? "
+                "WHERE id = ? AND worker = ?",
+                (int(report_was_generated), result, now, job_id, worker),
+            )
+
+    def fail(self, job_id: int, worker: str, error: str):
+        """
+        Records a failed attempt. The job goes back to the queue (keeping its checkpoints) until it runs out of attempts.
+        Nothing is recorded if the worker's lease expired and another worker holds the job now.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, error = ?, lease_until = NULL, updated = ? "
+                "WHERE id = ? AND worker = ?",
+                (self.max_attempts, error, now, job_id, worker),
+            )
+
+    def jobs(self) -> list:
+        with self._connect() as conn:
+            return conn.execute("SELECT * FROM jobs ORDER BY id").fetchall()
+
+
+def run_stage(stage: str, plan_name: str, outputs: dict) -> str:
+    """
+    Runs one pipeline stage with the agent plugins and returns its output as text.
+    """
+    if stage == "search":
+        return message_text(create_search_agent()._search(plan_name))
+    if stage == "report":
+        return message_text(ReportAgent()._write_report(plan_name, outputs["search"]))
+    if stage == "validate":
+        return message_text(ValidationAgent()._validate_report(outputs["report"]))
+    raise ValueError(f"Unknown stage {stage}")
+
+
+def process_job(queue: ReportJobQueue, job, worker: str):
+    """
+    Runs the remaining stages of a claimed job, checkpointing after each one.
+    """
+    outputs = queue.checkpoints(job["id"])
+    if outputs:
+        print(f"Job {job['id']} ({job['plan_name']}): resuming after {', '.join(s for s in STAGES if s in outputs)}")
+    for stage in STAGES:
+        if stage in outputs:
+            continue
+        with span(f"stage {stage}", job_id=job["id"], plan_name=job["plan_name"]):
+            outputs[stage] = run_stage(stage, job["plan_name"], outputs)
+        if not queue.checkpoint(job["id"], worker, stage, outputs[stage]):
+            print(f"{worker}: lost the lease on job {job['id']} during the {stage} stage, leaving it to its new worker")
+            return
+
+    # Check the lease once more before publishing: a job resumed after its last stage has not renewed it yet
+    if not queue.renew(job["id"], worker):
+        print(f"{worker}: lost the lease on job {job['id']}, leaving it to its new worker")
+        return
+    if is_pass(outputs["validate"]):
+        # Map the report's sections to their sources, so a later update only rewrites what changed (see report_update.py)
+        SectionMapStore().save(job["plan_name"], outputs["report"], outputs["search"])
+        queue.complete(job["id"], worker, True, save_report(job["plan_name"], outputs["report"]))
+    else:
+        queue.complete(job["id"], worker, False, f"The report for {job['plan_name']} did not pass validation: {outputs['validate']}")
+
+
+def worker_loop(queue: ReportJobQueue, worker: str, stop: threading.Event, poll_interval: float = 2.0):
+    """
+    Claims and processes jobs until `stop` is set. Sleeps while the queue is empty.
+    """
+    while not stop.is_set():
+        job = queue.claim(worker)
+        if job is None:
+            stop.wait(poll_interval)
+            continue
+        print(f"{worker}: processing job {job['id']} ({job['plan_name']}), attempt {job['attempts']}")
+        try:
+            # Queued jobs are background work: their agent runs yield to chat turns and interactive reports
+            with priority("batch"):
+                process_job(queue, job, worker)
+        except Exception as e:
+            print(f"{worker}: job {job['id']} failed: {e}")
+            queue.fail(job["id"], worker, str(e))
+
+
+def run_workers(queue: ReportJobQueue, concurrency: int = 2, drain: bool = False):
+    """
+    Runs a pool of worker threads in this process. Start more processes (on this or other hosts sharing the
+    database) to scale further.
+
+    Parameters:
+    queue (ReportJobQueue): The queue to pull from.
+    concurrency (int): The number of worker threads.
+    drain (bool): Exit once the queue is empty instead of waiting for new jobs.
+    """
+    stop = threading.Event()
+    prefix = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    threads = [threading.Thread(target=worker_loop, args=(queue, f"{prefix}-{i}", stop), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    try:
+        while any(thread.is_alive() for thread in threads):
+            time.sleep(1)
+            if drain and not any(job["status"] in ("queued", "running") for job in queue.jobs()):
+                stop.set()
+    except KeyboardInterrupt:
+        print("Stopping workers after their current job...")
+        stop.set()
+    for thread in threads:
+        thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Durable report job queue")
+    parser.add_argument("--db", help="SQLite database file (defaults to REPORT_JOBS_DB or report_jobs.db)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    enqueue = commands.add_parser("enqueue", help="Queue report jobs")
+    enqueue.add_argument("plan_names", nargs="+")
+    worker = commands.add_parser("worker", help="Process queued jobs")
+    worker.add_argument("--concurrency", type=int, default=2)
+    worker.add_argument("--drain", action="store_true", help="Exit once the queue is empty")
+    commands.add_parser("status", help="List jobs")
+    args = parser.parse_args()
+
+    queue = ReportJobQueue(args.db)
+    if args.command == "enqueue":
+        for plan_name in args.plan_names:
+            print(f"Queued job {queue.enqueue(plan_name)} for {plan_name}")
+    elif args.command == "worker":
+        run_workers(queue, args.concurrency, args.drain)
+    else:
+        for job in queue.jobs():
+            done = ", ".join(queue.checkpoints(job["id"]))
+            print(f"{job['id']:>5}  {job['status']:<8} attempts={job['attempts']}  stages=[{done}]  {job['plan_name']}  {job['error'] or ''}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import re
+from dataclasses import dataclass, field
+
+"""
+# Report sections
+
+Parses a generated markdown report (see `Northwind heathcare plan Report.md`) into its sections so that
+callers can work on the parts they need instead of the whole text. The ValidationAgent uses it to send
+only the sections relevant to each requirement, plus a table of contents, to the validation model.
+
+Headings are ATX headings (`### Title`) and lines that consist of a single bold phrase (`**Exclusions:**`).
+"""
+
+HEADING_PATTERN = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+BOLD_HEADING_PATTERN = re.compile(r"^\*\*([^*]+)\*\*:?\s*$")
+# Horizontal rules only separate sections visually
+RULE_PATTERN = re.compile(r"^\s*(-{3,}|\*{3,}|_{3,})\s*$")
+
+# The requirements the ValidationAgent checks, with the words that mark a section as relevant to them
+VALIDATION_REQUIREMENTS = {
+    "coverage exclusions": ("exclusion", "excluded", "exclude", "not cover", "not covered", "limitation", "does not include"),
+}
+
+
+@dataclass
+class Section:
+    """
+    A class to represent one section of a markdown report: its heading and the text up to the next heading.
+    """
+    level: int
+    title: str
+    body: str
+    # Titles of the enclosing sections, outermost first
+    parents: list = field(default_factory=list)
+    # The section's lines exactly as they appear in the report, heading and horizontal rules included
+    raw: str = ""
+
+    @property
+    def path(self) -> str:
+        return " > ".join(self.parents + [self.title])
+
+    def markdown(self) -> str:
+        heading = f"{'#' * max(1, self.level)} {self.title}\n" if self.title else ""
+        return f"{heading}{self.body}".strip()
+
+
+def _clean_title(title: str) -> str:
+    return title.replace("**", "").strip().rstrip(":").strip()
+
+
+def parse_sections(markdown: str) -> list:
+    """
+    Splits a markdown report into sections. Text before the first heading becomes a level 0 section without a title.
+    Bold-only lines count as headings one level below the enclosing heading.
+
+    Returns:
+    sections (list[Section]): The sections in document order.
+    """
+    sections = [Section(0, "", "")]
+    stack = []
+    lines = []
+    raw = []
+
+    def close():
+        sections[-1].body = "\n".join(lines).strip()
+        sections[-1].raw = "\n".join(raw).strip("\n")
+        lines.clear()
+        raw.clear()
+
+    for line in markdown.splitlines():
+        heading = HEADING_PATTERN.match(line)
+        bold = None if heading else BOLD_HEADING_PATTERN.match(line.strip())
+        if heading:
+            level, title = len(heading.group(1)), _clean_title(heading.group(2))
+        elif bold:
+            level, title = (stack[-1].level + 1 if stack else 1), _clean_title(bold.group(1))
+        else:
+            if not RULE_PATTERN.match(line):
+                lines.append(line)
+            raw.append(line)
+            continue
+        close()
+        raw.append(line)
+        while stack and stack[-1].level >= level:
+            stack.pop()
+        section = Section(level, title, "", [s.title for s in stack])
+        sections.append(section)
+        stack.append(section)
+    close()
+    return [s for s in sections if s.title or s.body]
+
+
+def assemble(sections: list) -> str:
+    """
+    Joins sections back into a markdown report, keeping each section's original formatting.
+    """
+    return "\n\n".join(s.raw.strip("\n") for s in sections if s.raw.strip()) + "\n"
+
+
+def table_of_contents(sections: list) -> str:
+    titled = [s for s in sections if s.title]
+    top = min((s.level for s in titled), default=1)
+    return "\n".join(f"{'  ' * (s.level - top)}- {s.title}" for s in titled)
+
+
+def mentions(text: str, keywords) -> bool:
+    """
+    Returns True if `text` contains any of the lower-case `keywords`.
+    """
+    text = text.lower()
+    return any(keyword in text for keyword in keywords)
+
+
+def select_sections(sections: list, keywords) -> list:
+    """
+    Returns the sections relevant to a requirement: those whose heading (or an enclosing heading) mentions
+    any of `keywords`, or, if no heading does, those whose text does. Sections that are only a heading
+    (their content sits in subsections) are skipped.
+    """
+    sections = [s for s in sections if s.body]
+    by_heading = [s for s in sections if mentions(s.path, keywords)]
+    return by_heading or [s for s in sections if mentions(s.body, keywords)]
+
+
+def excerpt(sections: list) -> str:
+    """
+    Formats sections as markdown excerpts, each headed by its full path in the report.
+    """
+    return "\n\n".join(f"[{s.path or 'Introduction'}]\n{s.body}" for s in sections)
+
+
+def validation_prompt(report: str, requirements: dict = None) -> str:
+    """
+    Builds the ValidationAgent's message: the report's table of contents and, for every requirement, only
+    the sections relevant to it.
+
+    Parameters:
+    report (str): The generated markdown report.
+    requirements (dict): Requirement -> keywords. Defaults to VALIDATION_REQUIREMENTS.
+
+    Returns:
+    content (str): The message for the validation model.
+    """
+    requirements = requirements or VALIDATION_REQUIREMENTS
+    sections = parse_sections(report)
+    parts = [
+        f"Validate that the generated report includes information about {' and '.join(requirements)}.",
+        "Only the sections of the report relevant to each requirement are included below.",
+        f"Table of contents of the report:\n{table_of_contents(sections) or '(the report has no headings)'}",
+    ]
+    for requirement, keywords in requirements.items():
+        relevant = select_sections(sections, keywords)
+        body = excerpt(relevant) if relevant else f"(No section of the report mentions {requirement}.)"
+        parts.append(f"Sections relevant to {requirement}:\n{body}")
+    return "\n\n".join(parts)
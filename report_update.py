@@ -0,0 +1,209 @@
+import argparse
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from azure.ai.projects import AIProjectClient
+from azure.identity import DefaultAzureCredential
+from dotenv import load_dotenv
+
+from healthplan_agents import (
+    REPORT_AGENT_INSTRUCTIONS,
+    ReportAgent,
+    ValidationAgent,
+    create_search_agent,
+    message_text,
+    run_agent,
+    save_report,
+)
+from model_router import ModelRouter, get_router
+from plan_catalog import canonical_plan
+from report_jobs import is_pass
+from report_sections import VALIDATION_REQUIREMENTS, Section, assemble, mentions, parse_sections
+from request_scheduler import priority
+from section_map import SectionMapStore, changed_sections
+from tracing import span
+
+load_dotenv()
+
+"""
+# Incremental report updates
+
+When a plan's documents get a small update, regenerating and re-validating the whole report pays for
+every section again. An update here searches the plan once more and compares the results with the
+section map of the last report that passed validation (section_map.py):
+
+1. sections whose source passages are unchanged are kept as they are
+2. each changed section is rewritten on its own by the ReportAgent, from its previous text and its new
+   passages, a few sections at a time
+3. the report is reassembled in its original order, and only the validation requirements that a
+   rewritten section touches are checked again; the others keep their earlier Pass
+4. a report that passes is saved, together with its new section map
+
+Plans without a map, updates that change more than REPORT_UPDATE_MAX_CHANGED of the sections, and
+search results with passages that fit no section are regenerated in full instead.
+
+The report_jobs.py workers and report_batch.py record a section map for every report they save, and so
+does this module.
+
+# Usage
+
+```zsh
+python report_update.py "Northwind Standard" "Northwind Health Plus"
+python report_update.py --full "Northwind Standard"
+```
+
+# .env examples
+
+```.env
+# Regenerate the whole report when more than this fraction of its sections changed
+REPORT_UPDATE_MAX_CHANGED=0.5
+# Sections rewritten in parallel
+REPORT_UPDATE_CONCURRENCY=4
+```
+"""
+
+
+def section_update_content(plan_name: str, section: Section, passages: list) -> str:
+    """
+    Returns the ReportAgent's request to rewrite one section of a report from its current source passages.
+    """
+    sources = "\n\n".join(passages) if passages else "(The plan's documents no longer say anything about this section.)"
+    return (
+        f"Here is the '{section.path}' section of a detailed report about the {plan_name} plan:\n\n{section.raw}\n\n"
+        "The plan's documents have changed. Rewrite this section so that it matches the information below, keeping "
+        "its heading, format and level of detail. Make sure to keep any information about coverage exclusions. "
+        f"Return only the markdown of the section.\n\nHere is the relevant information for the plan: {sources}"
+    )
+
+
+class ReportUpdater:
+    """
+    A class to represent the incremental updater of saved plan reports.
+    """
+    def __init__(self, router: ModelRouter = None, store: SectionMapStore = None, max_changed: float = None,
+                 concurrency: int = None):
+        """
+        Parameters:
+        router (ModelRouter): The router the agents pick their deployments from. Defaults to the process-wide router.
+        store (SectionMapStore): Where section maps are kept. Defaults to REPORT_MAPS_DIR.
+        max_changed (float): The fraction of changed sections above which the report is regenerated in full.
+        concurrency (int): Sections rewritten in parallel. Defaults to REPORT_UPDATE_CONCURRENCY or 4.
+        """
+        self.router = router or get_router()
+        self.store = store or SectionMapStore()
+        self.max_changed = float(os.getenv("REPORT_UPDATE_MAX_CHANGED", "0.5")) if max_changed is None else max_changed
+        self.concurrency = int(os.getenv("REPORT_UPDATE_CONCURRENCY", "4")) if concurrency is None else concurrency
+
+    def update(self, plan_name: str, source: str = None, full: bool = False) -> tuple:
+        """
+        Brings a plan's report up to date with its documents, rewriting only the sections whose sources changed.
+
+        Parameters:
+        plan_name (str): The plan.
+        source (str): The plan's current search results. Searched with the configured backend if not given.
+        full (bool): Regenerate the whole report regardless of the section map.
+
+        Returns:
+        (report_was_generated, content) (tuple[bool, str]): Whether the report passed validation, and the report or failure message.
+        """
+        plan_name = canonical_plan(plan_name).name
+        if source is None:
+            with span("stage search", plan_name=plan_name):
+                source = message_text(create_search_agent(self.router)._search(plan_name))
+
+        section_map = None if full else self.store.load(plan_name)
+        if section_map is None:
+            return self.regenerate(plan_name, source, "full regeneration requested" if full else "no section map")
+
+        sections, changed, assigned, unassigned_changed = changed_sections(section_map, source)
+        mapped = [i for i, s in enumerate(sections) if s.body]
+        if unassigned_changed:
+            return self.regenerate(plan_name, source, "the documents have information no section covers")
+        if len(changed) > self.max_changed * max(1, len(mapped)):
+            return self.regenerate(plan_name, source, f"{len(changed)} of {len(mapped)} sections changed")
+        if not changed:
+            print(f"The report for {plan_name} is up to date.")
+            return True, section_map["report"]
+
+        print(f"Rewriting {len(changed)} of {len(mapped)} sections of the report for {plan_name}...")
+        rewritten = self._rewrite_sections(plan_name, sections, changed, assigned)
+        previous = {i: sections[i].raw for i in changed}
+        for i, text in rewritten.items():
+            sections[i].raw = text
+        report = assemble(sections)
+
+        # Only the requirements whose sections were rewritten are validated again
+        requirements = {name: keywords for name, keywords in VALIDATION_REQUIREMENTS.items()
+                        if any(mentions(previous[i], keywords) or mentions(rewritten[i], keywords) for i in changed)}
+        if requirements:
+            verdict = message_text(ValidationAgent(self.router)._validate_report(report, requirements))
+            if not is_pass(verdict):
+                return False, f"The updated report for {plan_name} did not pass validation: {verdict}"
+
+        self.store.save(plan_name, report, source)
+        return True, report
+
+    def regenerate(self, plan_name: str, source: str, reason: str) -> tuple:
+        """
+        Writes and validates the whole report, and maps it if it passes.
+        """
+        print(f"Regenerating the whole report for {plan_name} ({reason})...")
+        with span("stage report", plan_name=plan_name):
+            report = message_text(ReportAgent(self.router)._write_report(plan_name, source))
+        with span("stage validate", plan_name=plan_name):
+            verdict = message_text(ValidationAgent(self.router)._validate_report(report))
+        if not is_pass(verdict):
+            return False, f"The report for {plan_name} did not pass validation: {verdict}"
+        self.store.save(plan_name, report, source)
+        return True, report
+
+    def _rewrite_sections(self, plan_name: str, sections: list, changed: list, assigned: dict) -> dict:
+        project_client = AIProjectClient(
+            credential=DefaultAzureCredential(),
+            endpoint=os.environ["AIPROJECT_CONNECTION_STRING"],
+        )
+
+        def rewrite(index: int) -> str:
+            section = sections[index]
+            with span("rewrite section", section=section.path):
+                last_msg = run_agent(
+                    project_client,
+                    name="report-agent",
+                    stage="report",
+                    instructions=REPORT_AGENT_INSTRUCTIONS,
+                    content=section_update_content(plan_name, section, assigned[index]),
+                    router=self.router,
+                )
+            text = message_text(last_msg).strip()
+            # Keep the section's heading if the model left it out
+            parsed = parse_sections(text)
+            if section.title and not (parsed and parsed[0].title):
+                text = f"{section.raw.strip().splitlines()[0]}\n{text}"
+            return text
+
+        # Each rewrite runs in a copy of the caller's context, so it keeps the request's priority, deadline and trace
+        with ThreadPoolExecutor(max_workers=max(1, self.concurrency), thread_name_prefix="report-update") as pool:
+            futures = {index: pool.submit(contextvars.copy_context().run, rewrite, index) for index in changed}
+            return {index: future.result() for index, future in futures.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Update plan reports, rewriting only the sections whose documents changed")
+    parser.add_argument("plan_names", nargs="+")
+    parser.add_argument("--full", action="store_true", help="Regenerate the whole report")
+    args = parser.parse_args()
+
+    updater = ReportUpdater()
+    for plan_name in args.plan_names:
+        # Updates are catalog maintenance, so their agent runs yield to chat turns and interactive reports
+        with priority("batch"):
+            report_was_generated, content = updater.update(plan_name, full=args.full)
+        if report_was_generated:
+            save_report(plan_name, content)
+        else:
+            print(content)
+
+
+if __name__ == "__main__":
+    main()
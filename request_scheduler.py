@@ -0,0 +1,314 @@
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+from hedging import AnyEvent, DeadlineExceededError, RequestCancelledError, current_deadline
+
+"""
+# Priority request scheduler
+
+Interactive chat turns, report pipelines and batch report jobs all call the same deployments. Without
+coordination, a worker pool regenerating the catalog drains the quota and a chat turn waits behind
+minutes of queued agent runs. The scheduler sits in front of every agent run and chat turn and hands
+out a limited number of concurrent slots by priority class:
+
+- interactive: chat turns (orchestrator_chat_loop, the reasoning chats, the service's sessions)
+- report: report pipelines a user is waiting for (the report loops, POST /reports)
+- batch: background regeneration (report_jobs.py workers, report_batch.py)
+
+Waiting requests are served by weighted fair queueing: each request gets a virtual finish time of
+`max(now, the class's last finish) + cost / weight`, where the cost is its estimated tokens, and the
+smallest finish time goes next. A high weight makes interactive turns jump ahead of queued batch work
+without starving it. Per-class concurrency caps keep slots free for the higher classes even when the
+lower ones have long queues.
+
+The class travels with the request in a context variable (`with priority("batch"):`), so it reaches the
+agent runs on worker threads through asyncio.to_thread and the hedging threads. Requests without a class
+are interactive. Code that already holds a slot does not take a second one.
+
+Async callers wait for their slot on the event loop (`slot_async`, or `run_in_slot` for blocking work that
+runs on a worker thread), so queued requests do not tie up the loop's default executor. A waiting request
+whose deadline passes or whose caller goes away leaves the queue instead of taking a slot nobody needs.
+
+# .env examples
+
+```.env
+SCHEDULER_ENABLED=true
+# Concurrent slots for all classes together
+SCHEDULER_MAX_CONCURRENCY=8
+SCHEDULER_WEIGHTS=interactive:16,report:4,batch:1
+# Per-class caps (default: all slots for interactive, all but one for report, a quarter for batch)
+SCHEDULER_REPORT_MAX_CONCURRENCY=7
+SCHEDULER_BATCH_MAX_CONCURRENCY=2
+```
+"""
+
+# Priority classes, highest first
+PRIORITY_CLASSES = ("interactive", "report", "batch")
+
+DEFAULT_WEIGHTS = {"interactive": 16.0, "report": 4.0, "batch": 1.0}
+
+# How often a thread blocked in slot() checks whether its request was cancelled, in seconds
+SLOT_POLL_INTERVAL = 0.5
+
+_priority = contextvars.ContextVar("request_priority", default=None)
+_holding = contextvars.ContextVar("request_slot_held", default=False)
+
+
+def current_priority() -> str:
+    """
+    Returns the priority class of the current request (interactive if none was set).
+    """
+    return _priority.get() or "interactive"
+
+
+@contextmanager
+def priority(name: str, only_if_unset: bool = False):
+    """
+    Runs the enclosed block (and everything it starts) in priority class `name`.
+
+    Parameters:
+    name (str): One of PRIORITY_CLASSES.
+    only_if_unset (bool): Keep the class an outer caller already set, e.g. a batch job calling the report pipeline.
+    """
+    if name not in PRIORITY_CLASSES:
+        raise ValueError(f"Unknown priority class {name}, expected one of {', '.join(PRIORITY_CLASSES)}")
+    if only_if_unset and _priority.get() is not None:
+        yield
+        return
+    token = _priority.set(name)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class _Waiter:
+    """
+    A request waiting for a slot.
+    """
+    def __init__(self, name: str, finish: float, loop: asyncio.AbstractEventLoop = None):
+        self.name = name
+        self.finish = finish
+        self.enqueued = time.monotonic()
+        self.granted = False
+        self.loop = loop
+        self.event = None if loop else threading.Event()
+        self.future = loop.create_future() if loop else None
+
+    def grant(self):
+        self.granted = True
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(lambda: self.future.done() or self.future.set_result(None))
+
+
+class ClassStats:
+    """
+    A class to represent the queue and wait-time metrics of one priority class.
+    """
+    def __init__(self, window: int = 1000):
+        self.running = 0
+        self.granted = 0
+        self.max_queue_depth = 0
+        self.waits = deque(maxlen=window)
+
+    def snapshot(self, queue_depth: int) -> dict:
+        waits = sorted(self.waits)
+
+        def percentile(q: float) -> float:
+            return round(waits[min(len(waits) - 1, int(q * len(waits)))], 3) if waits else 0.0
+
+        return {"queued": queue_depth, "running": self.running, "granted": self.granted, "max_queue_depth": self.max_queue_depth,
+                "wait_p50": percentile(0.5), "wait_p95": percentile(0.95), "wait_max": round(waits[-1], 3) if waits else 0.0}
+
+
+class RequestScheduler:
+    """
+    A class to represent the process-wide priority scheduler for agent runs and chat turns.
+    """
+    def __init__(self, max_concurrency: int = None, weights: dict = None, caps: dict = None, enabled: bool = None):
+        """
+        Parameters:
+        max_concurrency (int): Concurrent slots for all classes together. Defaults to SCHEDULER_MAX_CONCURRENCY or 8.
+        weights (dict[str, float]): WFQ weight per class. Defaults to SCHEDULER_WEIGHTS or DEFAULT_WEIGHTS.
+        caps (dict[str, int]): Concurrent slots per class. Missing classes are read from the environment.
+        enabled (bool): When False every slot is granted immediately. Defaults to SCHEDULER_ENABLED.
+        """
+        self.enabled = os.getenv("SCHEDULER_ENABLED", "true").lower() in ("1", "true", "yes") if enabled is None else enabled
+        self.max_concurrency = int(os.getenv("SCHEDULER_MAX_CONCURRENCY", "8")) if max_concurrency is None else max_concurrency
+        self.weights = dict(weights or self._weights_from_env())
+        default_caps = {"interactive": self.max_concurrency, "report": max(1, self.max_concurrency - 1),
+                        "batch": max(1, self.max_concurrency // 4)}
+        caps = dict(caps or {})
+        self.caps = {name: caps.get(name) or int(os.getenv(f"SCHEDULER_{name.upper()}_MAX_CONCURRENCY", default_caps[name]))
+                     for name in PRIORITY_CLASSES}
+        self.queues = {name: deque() for name in PRIORITY_CLASSES}
+        self.stats = {name: ClassStats() for name in PRIORITY_CLASSES}
+        self.running = 0
+        # WFQ virtual time: the finish tag of the last request that was granted a slot
+        self.virtual_time = 0.0
+        self.last_finish = {name: 0.0 for name in PRIORITY_CLASSES}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _weights_from_env() -> dict:
+        weights = dict(DEFAULT_WEIGHTS)
+        for item in os.getenv("SCHEDULER_WEIGHTS", "").split(","):
+            if ":" in item:
+                name, weight = item.split(":", 1)
+                weights[name.strip()] = float(weight)
+        return weights
+
+    def _enqueue(self, name: str, cost: float, loop=None) -> _Waiter:
+        # Called with the lock held
+        start = max(self.virtual_time, self.last_finish[name])
+        self.last_finish[name] = start + max(cost, 1e-6) / self.weights[name]
+        waiter = _Waiter(name, self.last_finish[name], loop)
+        self.queues[name].append(waiter)
+        stats = self.stats[name]
+        stats.max_queue_depth = max(stats.max_queue_depth, len(self.queues[name]))
+        self._dispatch()
+        return waiter
+
+    def _dispatch(self):
+        # Called with the lock held: grant slots to the smallest finish tags among the classes under their cap
+        while self.running < self.max_concurrency:
+            eligible = [queue[0] for name, queue in self.queues.items() if queue and self.stats[name].running < self.caps[name]]
+            if not eligible:
+                return
+            waiter = min(eligible, key=lambda w: (w.finish, PRIORITY_CLASSES.index(w.name)))
+            self.queues[waiter.name].popleft()
+            self.virtual_time = max(self.virtual_time, waiter.finish)
+            self.running += 1
+            stats = self.stats[waiter.name]
+            stats.running += 1
+            stats.granted += 1
+            stats.waits.append(time.monotonic() - waiter.enqueued)
+            waiter.grant()
+
+    def _release(self, name: str):
+        with self._lock:
+            self.running -= 1
+            self.stats[name].running -= 1
+            self._dispatch()
+
+    def _abandon(self, name: str, waiter: _Waiter):
+        # A waiter that gives up leaves the queue, or hands back the slot it was granted in the meantime
+        with self._lock:
+            granted = waiter.granted
+            if not granted:
+                self.queues[name].remove(waiter)
+        if granted:
+            self._release(name)
+
+    @contextmanager
+    def slot(self, name: str = None, cost: float = 1.0, cancel_event: threading.Event = None, expires: float = None,
+             stage: str = None):
+        """
+        Blocks the calling thread until a slot of class `name` (default: the current class) is free, and holds it for the block.
+        A request that is cancelled, or whose deadline passes, while it waits leaves the queue and raises
+        RequestCancelledError or DeadlineExceededError.
+
+        Parameters:
+        name (str): The priority class.
+        cost (float): The request's WFQ cost, e.g. its estimated tokens in thousands.
+        cancel_event (threading.Event): Gives up waiting when set. The request's deadline (see hedging.py) always does.
+        expires (float): The time.monotonic() by which the slot must be granted. Defaults to the request's deadline.
+        stage (str): The stage named in the DeadlineExceededError.
+        """
+        if not self.enabled or _holding.get():
+            yield
+            return
+        name = name or current_priority()
+        deadline = current_deadline()
+        cancel_event = AnyEvent(cancel_event, deadline)
+        if expires is None and deadline is not None:
+            expires = deadline.expires
+        with self._lock:
+            waiter = self._enqueue(name, cost)
+        while not waiter.event.wait(SLOT_POLL_INTERVAL if expires is None else
+                                    max(0.0, min(SLOT_POLL_INTERVAL, expires - time.monotonic()))):
+            if cancel_event.is_set():
+                self._abandon(name, waiter)
+                raise RequestCancelledError(f"The request was cancelled while waiting for a {name} slot")
+            if expires is not None and time.monotonic() >= expires:
+                self._abandon(name, waiter)
+                raise DeadlineExceededError(stage or f"{name} slot", expires - time.monotonic())
+        token = _holding.set(True)
+        try:
+            yield
+        finally:
+            _holding.reset(token)
+            self._release(name)
+
+    @asynccontextmanager
+    async def slot_async(self, name: str = None, cost: float = 1.0):
+        """
+        Waits, without blocking the event loop, for a slot of class `name` and holds it for the block.
+        A caller cancelled while waiting gives up its place in the queue.
+        """
+        if not self.enabled or _holding.get():
+            yield
+            return
+        name = name or current_priority()
+        with self._lock:
+            waiter = self._enqueue(name, cost, asyncio.get_running_loop())
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            self._abandon(name, waiter)
+            raise
+        token = _holding.set(True)
+        try:
+            yield
+        finally:
+            _holding.reset(token)
+            self._release(name)
+
+    def snapshot(self) -> dict:
+        """
+        Returns the queue depth, running count and wait-time percentiles (seconds) per class.
+        """
+        with self._lock:
+            return {
+                "running": self.running,
+                "max_concurrency": self.max_concurrency,
+                "classes": {name: self.stats[name].snapshot(len(self.queues[name])) for name in PRIORITY_CLASSES},
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> RequestScheduler:
+    """
+    Returns the process-wide scheduler shared by every agent run and chat turn.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler()
+        return _scheduler
+
+
+async def run_in_slot(fn, *args, cost: float = 1.0):
+    """
+    Waits on the event loop for a slot of the current class, then runs the blocking `fn(*args)` on a worker thread while holding it.
+    Blocking calls that waited for their slot inside asyncio.to_thread would tie up the loop's default executor instead.
+
+    Parameters:
+    fn (callable): The blocking function, e.g. an agent run. Slots it asks for itself are not taken twice.
+    cost (float): The request's WFQ cost, e.g. its estimated tokens in thousands.
+
+    Returns:
+    result: What `fn` returned.
+    """
+    async with get_scheduler().slot_async(cost=cost):
+        return await asyncio.to_thread(fn, *args)
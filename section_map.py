@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import re
+import time
+
+from dotenv import load_dotenv
+
+from context_packing import deduplicate, split_passages, strip_citations
+from plan_catalog import canonical_plan
+from report_sections import parse_sections
+
+load_dotenv()
+
+"""
+# Report section maps
+
+Records which passages of a plan's search results each section of its saved report was written from.
+The search results are split into passages (as in context_packing.py), each passage is assigned to the
+report section that shares the most words with it, and every section keeps a fingerprint of its
+passages. Passages that fit no section are fingerprinted together as "unassigned".
+
+When the plan's documents change, the new search results are assigned to the same sections again and
+the fingerprints are compared: only the sections whose passages changed need to be rewritten (see
+report_update.py). The map also keeps the report text, so it does not depend on the saved report file.
+
+# .env examples
+
+```.env
+REPORT_MAPS_DIR=report_maps
+# Passages sharing less than this fraction of their words with every section are left unassigned
+SECTION_MAP_MIN_OVERLAP=0.2
+```
+"""
+
+# Words that say nothing about which section a passage belongs to
+STOP_WORDS = {"the", "and", "for", "are", "with", "that", "this", "from", "your", "you", "not", "plan", "will", "any", "may", "have", "has"}
+
+
+def source_passages(source: str) -> list:
+    """
+    Splits search results into cleaned, deduplicated passages.
+    """
+    return deduplicate(split_passages(strip_citations(source)))
+
+
+def _words(text: str) -> set:
+    return {word for word in re.findall(r"[a-z0-9$%]+", text.lower()) if len(word) > 2 and word not in STOP_WORDS}
+
+
+def fingerprint(text: str) -> str:
+    """
+    Returns a short hash of a passage that ignores case, punctuation and whitespace.
+    """
+    return hashlib.sha256(" ".join(re.findall(r"[a-z0-9$%]+", text.lower())).encode("utf-8")).hexdigest()[:16]
+
+
+def combined_fingerprint(passages: list) -> str:
+    """
+    Returns the fingerprint of a set of passages, independent of their order.
+    """
+    return hashlib.sha256(",".join(sorted(fingerprint(p) for p in passages)).encode("utf-8")).hexdigest()[:16]
+
+
+def assign_passages(sections: list, passages: list, min_overlap: float = None) -> dict:
+    """
+    Assigns every passage to the section whose text shares the largest fraction of the passage's words.
+    Only sections with a body are candidates.
+
+    Parameters:
+    sections (list[Section]): The report's sections, from parse_sections.
+    passages (list[str]): The source passages.
+    min_overlap (float): The least overlap for an assignment. Defaults to SECTION_MAP_MIN_OVERLAP or 0.2.
+
+    Returns:
+    assigned (dict[int, list[str]]): Passages per section index; index -1 holds the unassigned passages.
+    """
+    min_overlap = float(os.getenv("SECTION_MAP_MIN_OVERLAP", "0.2")) if min_overlap is None else min_overlap
+    section_words = [(i, _words(f"{s.path}\n{s.body}")) for i, s in enumerate(sections) if s.body]
+    assigned = {i: [] for i in range(-1, len(sections))}
+    for passage in passages:
+        words = _words(passage)
+        best, best_score = -1, 0.0
+        for i, candidate in section_words:
+            score = len(words & candidate) / len(words) if words else 0.0
+            if score > best_score:
+                best, best_score = i, score
+        assigned[best if best_score >= min_overlap else -1].append(passage)
+    return assigned
+
+
+def build_section_map(report: str, source: str) -> dict:
+    """
+    Returns the section map of a report written from `source`.
+    """
+    sections = parse_sections(report)
+    assigned = assign_passages(sections, source_passages(source))
+    return {
+        "report": report,
+        "sections": [{"path": s.path, "fingerprint": combined_fingerprint(assigned[i]), "passages": len(assigned[i])}
+                     for i, s in enumerate(sections)],
+        "unassigned": combined_fingerprint(assigned[-1]),
+        "created": time.time(),
+    }
+
+
+def changed_sections(section_map: dict, source: str) -> tuple:
+    """
+    Compares new search results with a section map.
+
+    Returns:
+    (sections, changed, assigned, unassigned_changed) (tuple): The previous report's sections, the indexes of
+    those whose passages changed, the new passages per section index, and whether passages that fit no
+    section appeared or went away.
+    """
+    sections = parse_sections(section_map["report"])
+    assigned = assign_passages(sections, source_passages(source))
+    previous = section_map["sections"]
+    changed = [i for i, s in enumerate(sections)
+               if i >= len(previous) or previous[i]["fingerprint"] != combined_fingerprint(assigned[i])]
+    return sections, changed, assigned, section_map["unassigned"] != combined_fingerprint(assigned[-1])
+
+
+class SectionMapStore:
+    """
+    A class to represent the on-disk section maps, one JSON file per plan.
+    """
+    def __init__(self, path: str = None):
+        """
+        Parameters:
+        path (str): The directory. Defaults to REPORT_MAPS_DIR or report_maps.
+        """
+        self.path = path or os.getenv("REPORT_MAPS_DIR", "report_maps")
+
+    def _file(self, plan_name: str) -> str:
+        return os.path.join(self.path, f"{canonical_plan(plan_name).id}.json")
+
+    def load(self, plan_name: str) -> dict:
+        """
+        Returns the plan's section map, or None if its report was never mapped.
+        """
+        try:
+            with open(self._file(plan_name), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, plan_name: str, report: str, source: str) -> dict:
+        """
+        Maps a report that passed validation against the search results it was written from, and stores the map.
+        """
+        section_map = build_section_map(report, source)
+        os.makedirs(self.path, exist_ok=True)
+        # Write to a temporary file first so a crash never leaves a truncated map behind
+        path = self._file(plan_name)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(section_map, f, indent=2)
+        os.replace(f"{path}.tmp", path)
+        return section_map
@@ -0,0 +1,135 @@
+import re
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from hedging import AnyEvent, RequestCancelledError, current_deadline, deadline_scope
+
+"""
+# Single-flight request coalescing
+
+When several callers ask for the same thing at the same time, only the first one (the leader) does the
+work; everyone who arrives while it is in flight attaches to it and receives the same result or
+exception. Nothing is cached once the flight lands, so the next request after that starts fresh.
+A caller that gives up only detaches; the shared work is cancelled once the last caller has gone.
+
+Used to coalesce identical report requests, keyed on the canonical plan id (plan_catalog.py) and the
+pipeline configuration, so a burst of requests for one plan costs one Search -> Report -> Validate run.
+"""
+
+
+def normalize_plan_name(plan_name: str) -> str:
+    """
+    Normalizes a plan name for use in keys: case-folded, punctuation dropped, whitespace collapsed.
+    """
+    return " ".join(re.sub(r"[^\w\s]", " ", plan_name.casefold()).split())
+
+
+class SingleFlight:
+    """
+    A class to represent a group of in-flight calls keyed by request identity.
+    """
+    def __init__(self):
+        self._tasks = {}
+        self._waiters = {}
+        self._futures = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def run(self, key, coro_factory):
+        """
+        Awaits `coro_factory()` unless an identical call is already in flight, in which case its result is shared.
+
+        Parameters:
+        key (hashable): The request identity.
+        coro_factory (callable): Creates the coroutine doing the work; only called by the leader.
+
+        Returns:
+        result: The result of the (shared) call.
+        """
+        task = self._tasks.get(key)
+        if task is None:
+            self.leaders += 1
+            # The work runs as its own task so that one impatient caller cancelling does not cancel it for everyone
+            task = asyncio.ensure_future(coro_factory())
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        else:
+            self.coalesced += 1
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # Nobody is left to receive the result, so stop the work (and the agent runs under it)
+            if self._waiters[key] == 1 and not task.done():
+                task.cancel()
+            raise
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+
+    def do(self, key, fn, *args, cancel_event: threading.Event = None, **kwargs):
+        """
+        Thread-based version of `run` for synchronous work such as the agent plugins.
+
+        The work runs on its own thread under a detached deadline (the leader's expiry, but not its
+        cancellation) and is called as fn(*args, cancel_event=<shared deadline>, **kwargs). A caller whose
+        `cancel_event` or deadline is set only detaches with RequestCancelledError; the shared work is
+        cancelled once the last caller has gone.
+        """
+        with self._lock:
+            flight = self._futures.get(key)
+            if flight is None:
+                self.leaders += 1
+                flight = self._futures[key] = {"future": Future(), "waiters": 0, "deadline": None, "started": threading.Event()}
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+            flight["waiters"] += 1
+
+        if leader:
+            def work():
+                with deadline_scope(detached=True) as deadline:
+                    flight["deadline"] = deadline
+                    flight["started"].set()
+                    try:
+                        flight["future"].set_result(fn(*args, cancel_event=deadline, **kwargs))
+                    except BaseException as e:
+                        flight["future"].set_exception(e)
+                    finally:
+                        with self._lock:
+                            if self._futures.get(key) is flight:
+                                del self._futures[key]
+
+            # The work runs in a copy of the leader's context so it keeps the request's priority and trace
+            threading.Thread(target=contextvars.copy_context().run, args=(work,), daemon=True, name="single-flight").start()
+
+        caller_cancel_event = AnyEvent(cancel_event, current_deadline())
+        try:
+            while True:
+                try:
+                    return flight["future"].result(timeout=0.1)
+                except FutureTimeoutError:
+                    if caller_cancel_event.is_set():
+                        raise RequestCancelledError("The caller gave up waiting for the shared call")
+        finally:
+            with self._lock:
+                flight["waiters"] -= 1
+                last = not flight["waiters"] and not flight["future"].done()
+                if last and self._futures.get(key) is flight:
+                    # Later callers must start a fresh flight rather than join one that is being cancelled
+                    del self._futures[key]
+            if last:
+                # Nobody is left to receive the result, so stop the work (and the agent runs under it)
+                flight["started"].wait()
+                flight["deadline"].cancel("cancelled")
+
+    def in_flight(self) -> int:
+        """
+        Returns the number of distinct calls currently in flight.
+        """
+        return len(self._tasks) + len(self._futures)
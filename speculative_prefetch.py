@@ -0,0 +1,106 @@
+import asyncio
+import os
+import threading
+
+from plan_catalog import canonical_plan
+from request_scheduler import run_in_slot
+
+"""
+# Speculative SearchAgent prefetch
+
+In report mode the user's input is almost always a plan name, and the orchestrator's first action is
+always SearchAgent.search_plan_docs. With prefetching enabled, the search for the raw input is started
+as soon as the request arrives, in parallel with the orchestrator's first planning call. When the
+orchestrator then asks SearchAgent for that plan, it gets the already-running (or finished) search.
+
+A speculative search the orchestrator never asks for is cancelled on the service once the pipeline
+finishes, and counted as discarded.
+
+# .env examples
+
+```.env
+SPECULATIVE_SEARCH=true
+```
+"""
+
+
+def speculative_search_enabled() -> bool:
+    return os.getenv("SPECULATIVE_SEARCH", "").lower() in ("1", "true", "yes")
+
+
+def prefetch_key(plan_name: str) -> str:
+    """
+    Maps a plan name to its canonical plan id, so that "NW Standard plan" from the user matches "Northwind Standard" from the orchestrator.
+    """
+    return canonical_plan(plan_name).id
+
+
+class _Prefetch:
+    def __init__(self, task: asyncio.Future, cancel_event: threading.Event):
+        self.task = task
+        self.cancel_event = cancel_event
+        self.used = False
+
+
+class SearchPrefetcher:
+    """
+    A class to represent the registry of speculative searches, keyed by canonical plan id.
+    """
+    def __init__(self):
+        self._prefetches = {}
+        self.started = 0
+        self.used = 0
+        self.discarded = 0
+
+    def start(self, plan_name: str, search, cost: float = 1.0) -> bool:
+        """
+        Starts a speculative search unless one for the same plan is already running.
+
+        Parameters:
+        plan_name (str): The raw user input.
+        search (callable): Blocking search function, called on a worker thread as search(plan_name, cancel_event).
+        cost (float): The search's scheduler cost; the search waits for its slot on the event loop (see request_scheduler.py).
+
+        Returns:
+        started (bool): True if a new speculative search was started.
+        """
+        key = prefetch_key(plan_name)
+        if key in self._prefetches:
+            return False
+        cancel_event = threading.Event()
+        task = asyncio.ensure_future(run_in_slot(search, plan_name, cancel_event, cost=cost))
+        # A speculative failure is only interesting if someone uses the result, so keep it from being logged as unretrieved
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._prefetches[key] = _Prefetch(task, cancel_event)
+        self.started += 1
+        return True
+
+    def take(self, plan_name: str):
+        """
+        Claims the speculative search for a plan.
+
+        Returns:
+        task (asyncio.Future): The running or finished search, or None if nothing was prefetched for this plan.
+        """
+        prefetch = self._prefetches.get(prefetch_key(plan_name))
+        if prefetch is None or prefetch.cancel_event.is_set():
+            return None
+        if not prefetch.used:
+            prefetch.used = True
+            self.used += 1
+        return prefetch.task
+
+    def finish(self, plan_name: str):
+        """
+        Ends the speculation for a plan. An unused search is cancelled on the service and counted as discarded.
+        """
+        prefetch = self._prefetches.pop(prefetch_key(plan_name), None)
+        if prefetch is None or prefetch.used:
+            return
+        prefetch.cancel_event.set()
+        # A search still queued for a scheduler slot leaves the queue
+        prefetch.task.cancel()
+        self.discarded += 1
+
+    def stats(self) -> dict:
+        return {"started": self.started, "used": self.used, "discarded": self.discarded, "pending": len(self._prefetches)}
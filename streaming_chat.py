@@ -0,0 +1,159 @@
+import asyncio
+import os
+import sys
+import time
+from collections import deque
+
+from semantic_kernel.contents import ChatMessageContent, FunctionCallContent
+from semantic_kernel.contents.utils.author_role import AuthorRole
+
+"""
+# Streaming chat replies
+
+Prints a reply token by token as the streaming chat API delivers it, instead of waiting for the whole
+answer. Until the first token arrives (reasoning models can think for a long time before they answer)
+a status line shows that the model is still reasoning and for how long. Function calls made mid-stream
+by auto function invocation are announced as they start; Semantic Kernel runs them and continues the
+stream with the answer.
+
+Every turn records its time to first token (TTFT) and total duration.
+
+# .env examples
+
+```.env
+# Set to false to wait for complete answers instead
+REASONING_STREAM=true
+# Deployments that do not support the streaming API (comma separated)
+NON_STREAMING_DEPLOYMENTS=o1
+```
+"""
+
+# Seconds between updates of the "reasoning..." status line
+STATUS_INTERVAL = 1.0
+
+
+def streaming_enabled(deployment: str) -> bool:
+    """
+    Returns True if replies from `deployment` should be streamed.
+    """
+    if os.getenv("REASONING_STREAM", "true").lower() not in ("1", "true", "yes"):
+        return False
+    unsupported = {name.strip() for name in os.getenv("NON_STREAMING_DEPLOYMENTS", "o1").split(",") if name.strip()}
+    return deployment not in unsupported
+
+
+class TurnTiming:
+    """
+    A class to represent the timing of one streamed turn.
+    """
+    def __init__(self):
+        self.started = time.monotonic()
+        self.first_token = None
+        self.finished = None
+
+    @property
+    def ttft(self) -> float:
+        return None if self.first_token is None else self.first_token - self.started
+
+    @property
+    def total(self) -> float:
+        return None if self.finished is None else self.finished - self.started
+
+
+class TTFTRecorder:
+    """
+    A class to represent the recent time-to-first-token measurements of a chat loop.
+    """
+    def __init__(self, window: int = 100):
+        self.ttfts = deque(maxlen=window)
+        self.totals = deque(maxlen=window)
+
+    def record(self, timing: TurnTiming):
+        if timing.ttft is not None:
+            self.ttfts.append(timing.ttft)
+        if timing.total is not None:
+            self.totals.append(timing.total)
+
+    def summary(self) -> str:
+        if not self.ttfts:
+            return "No streamed turns."
+        ttfts = sorted(self.ttfts)
+        return (f"{len(ttfts)} turns, time to first token p50 {ttfts[len(ttfts) // 2]:.2f}s, "
+                f"max {ttfts[-1]:.2f}s, mean total {sum(self.totals) / max(1, len(self.totals)):.2f}s")
+
+
+async def _show_status(label: str, timing: TurnTiming):
+    # Only shown on a terminal, where the line can be redrawn in place
+    while True:
+        print(f"\r{label} is reasoning... {time.monotonic() - timing.started:.0f}s", end="", flush=True)
+        await asyncio.sleep(STATUS_INTERVAL)
+
+
+def _clear_status():
+    print("\r\033[K", end="", flush=True)
+
+
+async def stream_reply(chunks, label: str) -> tuple:
+    """
+    Prints a streamed reply as it arrives and assembles the complete message.
+
+    Parameters:
+    chunks (AsyncIterator[StreamingChatMessageContent]): The stream, e.g. from get_streaming_chat_message_content.
+    label (str): The name printed before the reply, e.g. the deployment.
+
+    Returns:
+    (message, timing) (tuple[ChatMessageContent, TurnTiming]): The assembled reply (None if nothing was
+    received) and the turn's timing.
+    """
+    timing = TurnTiming()
+    interactive = sys.stdout.isatty()
+    status = asyncio.create_task(_show_status(label, timing)) if interactive else None
+    texts = []
+    received = False
+    # SK 1.19 ends a stream with a usage-only chunk without a finish reason, so both are collected across the chunks
+    finish_reason = None
+    metadata = {}
+    usage_chunks = []
+
+    def stop_status():
+        nonlocal status
+        if status is not None:
+            status.cancel()
+            status = None
+            _clear_status()
+
+    try:
+        async for chunk in chunks:
+            if chunk is None:
+                continue
+            received = True
+            finish_reason = getattr(chunk, "finish_reason", None) or finish_reason
+            metadata.update({key: value for key, value in (chunk.metadata or {}).items() if value is not None})
+            if getattr(getattr(chunk, "inner_content", None), "usage", None) is not None:
+                usage_chunks.append(chunk.inner_content)
+            for item in getattr(chunk, "items", []):
+                # The first chunk of a function call carries its name; the arguments follow in later chunks
+                if isinstance(item, FunctionCallContent) and item.name:
+                    stop_status()
+                    print(f"Tools:>  calling {item.plugin_name + '-' if item.plugin_name else ''}{item.function_name}...", flush=True)
+            text = str(chunk.content or "")
+            if not text:
+                continue
+            if timing.first_token is None:
+                timing.first_token = time.monotonic()
+                stop_status()
+                print(f"{label} reply: ", end="", flush=True)
+            texts.append(text)
+            print(text, end="", flush=True)
+    finally:
+        stop_status()
+        timing.finished = time.monotonic()
+        if texts:
+            print()
+
+    if not received:
+        return None, timing
+    # The OpenAI chunks with usage are kept as the inner content, for the reasoning tokens SK's usage leaves out
+    message = ChatMessageContent(role=AuthorRole.ASSISTANT, content="".join(texts), metadata=metadata,
+                                 finish_reason=finish_reason, inner_content=usage_chunks or None)
+    return message, timing
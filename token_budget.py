@@ -0,0 +1,229 @@
+import os
+import re
+import threading
+from dataclasses import dataclass
+
+"""
+# Token budgets
+
+Counts the tokens of a request locally before it is sent and checks it against the deployment's context
+window and output limit. Oversized requests are trimmed (the oldest chat turns are dropped, embedded
+documents are cut) and requests that cannot fit at all are rejected with BudgetExceededError instead of
+being paid for and failing on the service.
+
+Tokens are counted with tiktoken when it is installed (`pip install tiktoken`), and estimated from the
+character count otherwise.
+
+# .env examples
+
+```.env
+# Override or add the limits of a deployment (name upper-cased, non-alphanumerics replaced by _)
+MODEL_GPT_4O_CONTEXT_TOKENS=128000
+MODEL_GPT_4O_MAX_OUTPUT_TOKENS=16384
+```
+"""
+
+# Average characters per token, used when tiktoken is not installed
+CHARS_PER_TOKEN = 4
+
+# Tokens the chat format adds per message and once per request
+MESSAGE_OVERHEAD_TOKENS = 4
+REQUEST_OVERHEAD_TOKENS = 3
+
+# A request whose completion allowance would drop below this is rejected rather than sent
+MIN_OUTPUT_TOKENS = 256
+
+TRUNCATION_MARKER = "\n\n[... {dropped} tokens truncated to fit the model's context window ...]"
+
+
+class BudgetExceededError(ValueError):
+    """
+    Raised when a request cannot fit the deployment's context window, even after trimming.
+    """
+    def __init__(self, deployment: str, prompt_tokens: int, context_tokens: int):
+        super().__init__(f"The request needs {prompt_tokens} prompt tokens but {deployment} accepts at most {context_tokens}")
+        self.deployment = deployment
+        self.prompt_tokens = prompt_tokens
+        self.context_tokens = context_tokens
+
+
+@dataclass(frozen=True)
+class ModelLimits:
+    """
+    A class to represent the token limits of a deployment.
+    """
+    context_tokens: int
+    max_output_tokens: int
+
+
+MODEL_LIMITS = {
+    "gpt-4o": ModelLimits(128000, 16384),
+    "gpt-4.1": ModelLimits(1047576, 32768),
+    "gpt-4.1-nano": ModelLimits(1047576, 32768),
+    "o3": ModelLimits(200000, 100000),
+}
+DEFAULT_LIMITS = ModelLimits(128000, 16384)
+
+
+def model_limits(deployment: str) -> ModelLimits:
+    """
+    Returns the limits of a deployment: MODEL_<DEPLOYMENT>_* overrides, then MODEL_LIMITS, then DEFAULT_LIMITS.
+    """
+    limits = MODEL_LIMITS.get(deployment, DEFAULT_LIMITS)
+    prefix = "MODEL_" + re.sub(r"[^A-Z0-9]", "_", (deployment or "").upper())
+    context = os.getenv(f"{prefix}_CONTEXT_TOKENS")
+    max_output = os.getenv(f"{prefix}_MAX_OUTPUT_TOKENS")
+    return ModelLimits(int(context) if context else limits.context_tokens,
+                       int(max_output) if max_output else limits.max_output_tokens)
+
+
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+
+def get_encoding(model: str = None):
+    """
+    Returns the tiktoken encoding of a model (o200k_base for unknown names), or None if tiktoken is not installed.
+    """
+    with _encodings_lock:
+        if model not in _encodings:
+            try:
+                import tiktoken
+            except ImportError:
+                _encodings[model] = None
+            else:
+                try:
+                    _encodings[model] = tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding("o200k_base")
+                except KeyError:
+                    _encodings[model] = tiktoken.get_encoding("o200k_base")
+        return _encodings[model]
+
+
+def count_tokens(text, model: str = None) -> int:
+    """
+    Returns the number of tokens in `text`.
+    """
+    text = "" if text is None else str(text)
+    encoding = get_encoding(model)
+    if encoding is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_messages(messages, model: str = None) -> int:
+    """
+    Returns the prompt tokens of a list of chat messages (ChatMessageContent objects, dicts or strings).
+    """
+    total = REQUEST_OVERHEAD_TOKENS
+    for message in messages:
+        content = message.get("content") if isinstance(message, dict) else getattr(message, "content", message)
+        total += MESSAGE_OVERHEAD_TOKENS + count_tokens(content, model)
+    return total
+
+
+def output_budget(deployment: str, prompt_tokens: int, requested: int) -> int:
+    """
+    Returns the completion allowance a request can get: `requested`, capped by the deployment's output limit
+    and by what is left of the context window after the prompt.
+
+    Raises:
+    BudgetExceededError: If less than MIN_OUTPUT_TOKENS would be left for the completion.
+    """
+    limits = model_limits(deployment)
+    available = min(requested, limits.max_output_tokens, limits.context_tokens - prompt_tokens)
+    if available < min(requested, MIN_OUTPUT_TOKENS):
+        raise BudgetExceededError(deployment, prompt_tokens, limits.context_tokens - min(requested, MIN_OUTPUT_TOKENS))
+    return available
+
+
+def truncate_text(text: str, max_tokens: int, model: str = None) -> str:
+    """
+    Cuts `text` to at most `max_tokens` tokens, keeping the beginning and noting how much was dropped.
+    """
+    tokens = count_tokens(text, model)
+    if tokens <= max_tokens:
+        return text
+    marker = TRUNCATION_MARKER.format(dropped=tokens - max_tokens)
+    keep = max(0, max_tokens - count_tokens(marker, model))
+    encoding = get_encoding(model)
+    head = encoding.decode(encoding.encode(text, disallowed_special=())[:keep]) if encoding else text[:keep * CHARS_PER_TOKEN]
+    return head + marker
+
+
+def fit_content(deployment: str, instructions: str, content: str, max_output_tokens: int) -> tuple:
+    """
+    Fits a single-message agent request (instructions plus one user message) into the deployment's budget,
+    cutting the user message if it is too long.
+
+    Returns:
+    (content, max_output_tokens) (tuple[str, int]): The content to send and its completion allowance.
+    """
+    limits = model_limits(deployment)
+    fixed = count_messages([instructions, ""], deployment)
+    requested = min(max_output_tokens, limits.max_output_tokens)
+    room = limits.context_tokens - fixed - requested
+    if room <= 0:
+        raise BudgetExceededError(deployment, fixed + requested, limits.context_tokens)
+    if count_tokens(content, deployment) > room:
+        print(f"Truncating the {deployment} request to fit its {limits.context_tokens}-token context window.")
+        content = truncate_text(content, room, deployment)
+    return content, output_budget(deployment, fixed + count_tokens(content, deployment), max_output_tokens)
+
+
+def _role(message) -> str:
+    role = message.get("role") if isinstance(message, dict) else getattr(message, "role", "")
+    return str(getattr(role, "value", role)).lower()
+
+
+def fit_history(history, deployment: str, max_output_tokens: int, instructions: str = None) -> int:
+    """
+    Drops the oldest turns of a chat history until it fits the deployment's context window together with
+    the completion allowance. Developer and system messages and the latest message are always kept.
+    Whole turns (a user message up to the next one) are dropped, so a function call is never separated
+    from its result, which the API would reject.
+
+    Parameters:
+    history (ChatHistory): The conversation; trimmed in place.
+    deployment (str): The deployment the history is sent to.
+    max_output_tokens (int): The completion allowance wanted.
+    instructions (str): The agent's instructions, if they are sent alongside the history.
+
+    Returns:
+    max_output_tokens (int): The completion allowance the request can get.
+
+    Raises:
+    BudgetExceededError: If the request does not fit even with only the latest message left.
+    """
+    limits = model_limits(deployment)
+    requested = min(max_output_tokens, limits.max_output_tokens)
+    messages = history.messages
+    pinned = count_messages([instructions] if instructions else [], deployment)
+    dropped = 0
+
+    def prompt_tokens():
+        return pinned + count_messages(messages, deployment)
+
+    def oldest():
+        # The oldest message that is neither an instruction nor the latest message
+        return next((i for i, m in enumerate(messages[:-1]) if _role(m) not in ("system", "developer")), None)
+
+    # Function results at the start whose calls were dropped earlier (e.g. by a resumed window) go first
+    while oldest() is not None and _role(messages[oldest()]) == "tool":
+        del messages[oldest()]
+        dropped += 1
+
+    while prompt_tokens() + requested > limits.context_tokens:
+        start = oldest()
+        if start is None:
+            break
+        # The turn runs up to the next user message; the latest turn is never dropped
+        end = next((i for i in range(start + 1, len(messages)) if _role(messages[i]) == "user"), None)
+        if end is None:
+            break
+        turn = [i for i in range(start, end) if _role(messages[i]) not in ("system", "developer")]
+        for index in reversed(turn):
+            del messages[index]
+        dropped += len(turn)
+    if dropped:
+        print(f"Dropped the {dropped} oldest messages to fit the {deployment} context window.")
+    return output_budget(deployment, prompt_tokens(), max_output_tokens)
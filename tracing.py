@@ -0,0 +1,250 @@
+import asyncio
+import atexit
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+"""
+# Tracing
+
+Records nested spans of where a request spends its wall time, e.g. for a report:
+
+    orchestrator turn -> ReportAgent.write_report -> agent run -> create thread -> run -> poll -> fetch message
+
+Spans come from Semantic Kernel function-invocation and prompt-rendering filters (add_kernel_tracing),
+from explicit `span()` blocks around the agent run steps, and from httpx event hooks on the shared HTTP
+clients (trace_http_client). Nothing is recorded unless tracing is enabled.
+
+With TRACE_FILE set, the spans are written when the process exits, either as a Chrome trace-event file
+(open it in chrome://tracing or https://ui.perfetto.dev) or, for files ending in .otlp.json, as OTLP/JSON.
+With TRACE_OTLP_ENDPOINT set, they are also posted to an OpenTelemetry collector's OTLP/HTTP endpoint.
+
+# .env examples
+
+```.env
+TRACE_FILE=trace.json
+# TRACE_FILE=trace.otlp.json
+TRACE_OTLP_ENDPOINT=http://localhost:4318/v1/traces
+TRACE_SERVICE_NAME=healthplan-agents
+```
+"""
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+    A class to represent one timed operation and its place in the span tree.
+    """
+    def __init__(self, name: str, parent=None, attributes: dict = None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes or {})
+        # Spans on the same lane are drawn nested in the Chrome trace viewer; concurrent tasks get their own lanes
+        self.lane = _lane()
+        self.start = time.time()
+        self.end = None
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+def _lane() -> int:
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    return id(task) if task is not None else threading.get_ident()
+
+
+class Tracer:
+    """
+    A class to represent the collector of finished spans and their exporters.
+    """
+    def __init__(self, enabled: bool = None, service_name: str = None):
+        self.enabled = (bool(os.getenv("TRACE_FILE") or os.getenv("TRACE_OTLP_ENDPOINT"))) if enabled is None else enabled
+        self.service_name = service_name or os.getenv("TRACE_SERVICE_NAME", "healthplan-agents")
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def record(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """
+        Times the enclosed block as a child of the current span. Works across await points and, through
+        asyncio.to_thread, in worker threads.
+        """
+        if not self.enabled:
+            yield None
+            return
+        span = Span(name, _current_span.get(), attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{e.__class__.__name__}: {e}"
+            raise
+        finally:
+            span.end = time.time()
+            _current_span.reset(token)
+            self.record(span)
+
+    def add_span(self, name: str, start: float, end: float, **attributes):
+        """
+        Records an already finished operation (e.g. an HTTP call timed by event hooks) under the current span.
+        """
+        if not self.enabled:
+            return
+        span = Span(name, _current_span.get(), attributes)
+        span.start, span.end = start, end
+        self.record(span)
+
+    # Exporters
+
+    def chrome_trace(self) -> dict:
+        pid = os.getpid()
+        events = []
+        for span in self.spans:
+            args = {**span.attributes, "span_id": span.span_id, "parent_id": span.parent_id, "trace_id": span.trace_id}
+            if span.error:
+                args["error"] = span.error
+            events.append({"name": span.name, "cat": span.name.split(" ")[0], "ph": "X", "pid": pid, "tid": span.lane,
+                           "ts": span.start * 1e6, "dur": (span.end - span.start) * 1e6, "args": args})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def otlp(self) -> dict:
+        def value(v):
+            if isinstance(v, bool):
+                return {"boolValue": v}
+            if isinstance(v, int):
+                return {"intValue": str(v)}
+            if isinstance(v, float):
+                return {"doubleValue": v}
+            return {"stringValue": str(v)}
+
+        spans = []
+        for span in self.spans:
+            otlp_span = {
+                "traceId": span.trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                "kind": 1,
+                "startTimeUnixNano": str(int(span.start * 1e9)),
+                "endTimeUnixNano": str(int(span.end * 1e9)),
+                "attributes": [{"key": k, "value": value(v)} for k, v in span.attributes.items() if v is not None],
+                "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+            }
+            if span.parent_id:
+                otlp_span["parentSpanId"] = span.parent_id
+            spans.append(otlp_span)
+        resource = {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]}
+        return {"resourceSpans": [{"resource": resource, "scopeSpans": [{"scope": {"name": "tracing.py"}, "spans": spans}]}]}
+
+    def export(self, path: str = None, endpoint: str = None):
+        """
+        Writes the spans to `path` (TRACE_FILE) and posts them to `endpoint` (TRACE_OTLP_ENDPOINT), if set.
+        """
+        path = path or os.getenv("TRACE_FILE")
+        endpoint = endpoint or os.getenv("TRACE_OTLP_ENDPOINT")
+        if not self.spans:
+            return
+        if path:
+            payload = self.otlp() if path.endswith(".otlp.json") else self.chrome_trace()
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(payload, f)
+            print(f"Wrote {len(self.spans)} spans to {path}")
+        if endpoint:
+            import httpx
+
+            try:
+                httpx.post(endpoint, json=self.otlp(), timeout=10).raise_for_status()
+            except httpx.HTTPError as e:
+                print(f"Could not export the trace to {endpoint}: {e}")
+
+
+tracer = Tracer()
+atexit.register(tracer.export)
+
+# Module-level shortcuts for the process-wide tracer
+span = tracer.span
+
+
+def traced(name: str = None):
+    """
+    Decorates a function (sync or async) so every call is recorded as a span.
+    """
+    def decorator(fn):
+        label = name or fn.__qualname__
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with tracer.span(label):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with tracer.span(label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def add_kernel_tracing(kernel):
+    """
+    Adds function-invocation and prompt-rendering filters to a Semantic Kernel kernel, so every plugin
+    call (including the ones the model invokes automatically) and every prompt render becomes a span.
+    """
+    if not tracer.enabled:
+        return kernel
+    from semantic_kernel.filters import FilterTypes
+
+    async def function_invocation(context, next):
+        with tracer.span(f"{context.function.plugin_name}.{context.function.name}", kind="function"):
+            await next(context)
+
+    async def prompt_rendering(context, next):
+        with tracer.span(f"render {context.function.name}", kind="prompt"):
+            await next(context)
+
+    kernel.add_filter(FilterTypes.FUNCTION_INVOCATION, function_invocation)
+    kernel.add_filter(FilterTypes.PROMPT_RENDERING, prompt_rendering)
+    return kernel
+
+
+def trace_http_client(client):
+    """
+    Adds event hooks to an httpx client (sync or async) that record every request as a span.
+    """
+    if not tracer.enabled:
+        return client
+    is_async = client.__class__.__name__ == "AsyncClient"
+
+    def on_request(request):
+        request.extensions["trace_start"] = time.time()
+
+    def on_response(response):
+        request = response.request
+        tracer.add_span(f"HTTP {request.method}", request.extensions.get("trace_start", time.time()), time.time(),
+                        url=str(request.url.copy_with(query=None)), status=response.status_code)
+
+    async def on_request_async(request):
+        on_request(request)
+
+    async def on_response_async(response):
+        on_response(response)
+
+    client.event_hooks["request"].append(on_request_async if is_async else on_request)
+    client.event_hooks["response"].append(on_response_async if is_async else on_response)
+    return client